@@ -0,0 +1,60 @@
+"""Throughput and size of the zips made for .sav and .asc data at each
+compression level, deflating in this process and on a process pool.
+
+    python -m benchmarks.compression [--size medium] [--processes 4]
+"""
+import multiprocessing
+import optparse
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+from marketsight.compression import zip_files
+
+from . import synthetic
+
+
+def run(filename, level, processes, repeat=3):
+    best = None
+    for attempt in xrange(repeat):
+        fileobj = tempfile.TemporaryFile()
+        start = time.time()
+        zip_files([(filename, os.path.basename(filename))], fileobj, level, processes)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        with zipfile.ZipFile(fileobj) as check:
+            assert check.testzip() is None
+        fileobj.close()
+    return best, size
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--size', default='medium', choices=sorted(synthetic.SIZES))
+    parser.add_option('--processes', type='int', default=multiprocessing.cpu_count())
+    parser.add_option('--levels', default='1,6,9')
+    options, args = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp(prefix='marketsight-benchmark-')
+    try:
+        respondents = synthetic.SIZES[options.size]
+        inputs = [synthetic.write_sav(os.path.join(tempdir, 'data.sav'), respondents),
+                  synthetic.write_asc(os.path.join(tempdir, 'data.asc'), respondents)]
+        print('%-10s %5s %9s %10s %9s %6s' % ('file', 'level', 'processes', 'MB/s', 'KB', 'ratio'))
+        for filename in inputs:
+            original = os.path.getsize(filename)
+            for level in [int(level) for level in options.levels.split(',')]:
+                for processes in sorted(set([1, options.processes])):
+                    elapsed, size = run(filename, level, processes)
+                    print('%-10s %5d %9d %10.1f %9d %6.3f' % (
+                        os.path.basename(filename), level, processes,
+                        original / elapsed / 1e6, size / 1024, float(size) / original))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
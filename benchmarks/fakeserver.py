@@ -0,0 +1,260 @@
+"""A local stand-in for the MarketSight upload and authorization services.
+
+Serves a WSDL for each service and answers its SOAP operations with canned
+but stateful replies, with configurable latency and bandwidth, so the client
+can be benchmarked without touching application.marketsight.com.
+
+    python benchmarks/fakeserver.py --port 8765 --latency 0.05
+"""
+import BaseHTTPServer
+import SocketServer
+import datetime
+import optparse
+import re
+import threading
+import time
+import uuid
+
+NS = 'http://www.marketsight.com/webservices/'
+
+OPERATIONS = {
+    'user': (
+        ('GetAuthorizationKey', ('un', 'pwd'), 'string'),
+    ),
+    'upload': (
+        ('GetNumberOfRespondents', ('key', 'datasetGuid'), 'int'),
+        ('GetLastUploadedDateTimeByGuid', ('key', 'datasetGuid'), 'string'),
+        ('CheckForMissingVariables', ('key', 'datasetGuid', 'variableList'), 'string'),
+        ('UpdateDatasetDataSPSSWithLabelsZipped', ('key', 'datasetGuid', 'zippedData', 'zippedVarLabeling'), 'boolean'),
+        ('UpdateDatasetDataTripleSWithLabelsZipped', ('key', 'datasetGuid', 'zippedData', 'zippedVarLabeling'), 'boolean'),
+        ('AppendDatasetDataSPSSZipped', ('key', 'datasetGuid', 'zippedData'), 'boolean'),
+        ('AppendDatasetDataTripleSZipped', ('key', 'datasetGuid', 'zippedData'), 'boolean'),
+    ),
+}
+PATHS = {
+    'user': '/MarketSightWebServices/DatasetUploadAuthorizationService.asmx',
+    'upload': '/MarketSightWebServices/DatasetUploadService.asmx',
+}
+BINARY = ('zippedData', 'zippedVarLabeling')
+
+ENVELOPE = ('<?xml version="1.0" encoding="utf-8"?>'
+            '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+            '<soap:Body>%s</soap:Body></soap:Envelope>')
+RESPONSE = '<%(op)sResponse xmlns="%(ns)s"><%(op)sResult>%(result)s</%(op)sResult></%(op)sResponse>'
+FAULT = ('<soap:Fault><faultcode>soap:Server</faultcode>'
+         '<faultstring>%s</faultstring><detail /></soap:Fault>')
+
+
+def wsdl(service, location):
+    elements, messages, porttypes, bindings = [], [], [], []
+    for op, params, result in OPERATIONS[service]:
+        fields = ''.join('<s:element minOccurs="0" maxOccurs="1" name="%s" type="s:%s"/>'
+                         % (p, 'base64Binary' if p in BINARY else 'string') for p in params)
+        elements.append('<s:element name="%s"><s:complexType><s:sequence>%s'
+                        '</s:sequence></s:complexType></s:element>' % (op, fields))
+        elements.append('<s:element name="%sResponse"><s:complexType><s:sequence>'
+                        '<s:element minOccurs="1" maxOccurs="1" name="%sResult" type="s:%s"/>'
+                        '</s:sequence></s:complexType></s:element>' % (op, op, result))
+        messages.append('<wsdl:message name="%sSoapIn"><wsdl:part name="parameters" element="tns:%s"/></wsdl:message>'
+                        '<wsdl:message name="%sSoapOut"><wsdl:part name="parameters" element="tns:%sResponse"/></wsdl:message>'
+                        % (op, op, op, op))
+        porttypes.append('<wsdl:operation name="%s"><wsdl:input message="tns:%sSoapIn"/>'
+                         '<wsdl:output message="tns:%sSoapOut"/></wsdl:operation>' % (op, op, op))
+        bindings.append('<wsdl:operation name="%s"><soap:operation soapAction="%s%s" style="document"/>'
+                        '<wsdl:input><soap:body use="literal"/></wsdl:input>'
+                        '<wsdl:output><soap:body use="literal"/></wsdl:output></wsdl:operation>'
+                        % (op, NS, op))
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<wsdl:definitions xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" '
+            'xmlns:s="http://www.w3.org/2001/XMLSchema" xmlns:tns="%(ns)s" '
+            'xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" targetNamespace="%(ns)s">'
+            '<wsdl:types><s:schema elementFormDefault="qualified" targetNamespace="%(ns)s">'
+            '%(elements)s</s:schema></wsdl:types>%(messages)s'
+            '<wsdl:portType name="ServiceSoap">%(porttypes)s</wsdl:portType>'
+            '<wsdl:binding name="ServiceSoap" type="tns:ServiceSoap">'
+            '<soap:binding transport="http://schemas.xmlsoap.org/soap/http"/>%(bindings)s</wsdl:binding>'
+            '<wsdl:service name="Service"><wsdl:port name="ServiceSoap" binding="tns:ServiceSoap">'
+            '<soap:address location="%(location)s"/></wsdl:port></wsdl:service>'
+            '</wsdl:definitions>') % dict(ns=NS, elements=''.join(elements),
+                                          messages=''.join(messages),
+                                          porttypes=''.join(porttypes),
+                                          bindings=''.join(bindings), location=location)
+
+
+class State(object):
+    """What the fake service remembers between calls"""
+
+    def __init__(self, key_ttl=None):
+        self.key_ttl = key_ttl
+        self.keys = {}
+        self.respondents = {}
+        self.uploaded = {}
+        self.calls = {}
+        self.bytes_received = 0
+        # The number of upload calls still to fail with a 503
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def count(self, op):
+        with self.lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+
+    def login(self, un, pwd):
+        if pwd == 'bad':
+            return 'A1'
+        key = uuid.uuid4().hex
+        with self.lock:
+            self.keys[key] = time.time()
+        return key
+
+    def check_key(self, key):
+        issued = self.keys.get(key)
+        if issued is None or (self.key_ttl and time.time() - issued > self.key_ttl):
+            raise ValueError('A1')
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer each reply, so its headers and body go out together
+    wbufsize = -1
+    head_size = 64 * 1024
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        # Stands in for the round trips of a TCP and TLS handshake
+        time.sleep(self.server.handshake)
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def service(self):
+        path = self.path.split('?')[0]
+        for service, service_path in PATHS.items():
+            if path == service_path:
+                return service
+
+    def reply(self, code, body, content_type='text/xml; charset=utf-8'):
+        time.sleep(self.server.latency)
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.service()
+        if service is None:
+            return self.reply(404, 'Not found', 'text/plain')
+        location = 'http://%s:%d%s' % (self.server.server_address[0],
+                                       self.server.server_address[1], PATHS[service])
+        self.reply(200, wsdl(service, location))
+
+    def read_body(self):
+        """Read the request in blocks, keeping only the head of it (the key
+        and dataset come before any zipped data) and the sizes of the
+        base64 parameters"""
+        remaining = int(self.headers.get('Content-Length', 0))
+        head = []
+        kept = 0
+        while remaining:
+            block = self.rfile.read(min(remaining, 64 * 1024))
+            if not block:
+                break
+            remaining -= len(block)
+            if self.server.bandwidth:
+                time.sleep(len(block) / float(self.server.bandwidth))
+            if kept < self.head_size:
+                head.append(block)
+                kept += len(block)
+            self.server.state.bytes_received += len(block)
+        return ''.join(head)
+
+    def do_POST(self):
+        service = self.service()
+        body = self.read_body()
+        op = self.headers.get('SOAPAction', '').strip('"').rsplit('/', 1)[-1]
+        if service is None or op not in [o[0] for o in OPERATIONS[service]]:
+            return self.reply(404, 'Not found', 'text/plain')
+        params = dict((m.group(1), m.group(2)) for m in
+                      re.finditer(r'<(?:\w+:)?(\w+)>([^<]*)</', body[:self.head_size]))
+        state = self.server.state
+        state.count(op)
+        if op.startswith(('Update', 'Append', 'Upload')) and state.failures:
+            with state.lock:
+                state.failures -= 1
+            return self.reply(503, 'Service Unavailable', 'text/plain')
+        try:
+            result = self.dispatch(state, op, params)
+        except ValueError as e:
+            return self.reply(500, ENVELOPE % (FAULT % e))
+        self.reply(200, ENVELOPE % (RESPONSE % dict(op=op, ns=NS, result=result)))
+
+    def dispatch(self, state, op, params):
+        if op == 'GetAuthorizationKey':
+            return state.login(params.get('un'), params.get('pwd'))
+        state.check_key(params.get('key'))
+        guid = params.get('datasetGuid')
+        if op == 'GetNumberOfRespondents':
+            return state.respondents.get(guid, 0)
+        if op == 'GetLastUploadedDateTimeByGuid':
+            uploaded = state.uploaded.get(guid, datetime.datetime(2016, 5, 9))
+            return uploaded.strftime('%m/%d/%Y %I:%M:%S %p')
+        if op == 'CheckForMissingVariables':
+            variables = [v.strip() for v in params.get('variableList', '').split(',')]
+            return ','.join(v for v in variables if v.lower().startswith('missing'))
+        with state.lock:
+            if op.startswith('Append'):
+                state.respondents[guid] = state.respondents.get(guid, 0) + 1
+            else:
+                state.respondents[guid] = 1
+            state.uploaded[guid] = datetime.datetime.now().replace(microsecond=0)
+        return 'true'
+
+
+class FakeMarketSight(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, bandwidth=None, key_ttl=None,
+                 handshake=0.0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.latency = latency
+        self.handshake = handshake
+        self.bandwidth = bandwidth
+        self.state = State(key_ttl)
+
+    def urls(self):
+        host, port = self.server_address[:2]
+        return dict((service, 'http://%s:%d%s?WSDL' % (host, port, path))
+                    for service, path in PATHS.items())
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8765)
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='seconds added to every reply')
+    parser.add_option('--bandwidth', type='int', default=None,
+                      help='bytes per second accepted from the client')
+    parser.add_option('--key-ttl', type='float', default=None,
+                      help='seconds before an authorization key expires')
+    parser.add_option('--handshake', type='float', default=0.0,
+                      help='seconds added to every new connection')
+    options, args = parser.parse_args()
+    server = FakeMarketSight((options.host, options.port), options.latency,
+                             options.bandwidth, options.key_ttl, options.handshake)
+    for service, url in sorted(server.urls().items()):
+        print('%s: %s' % (service, url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
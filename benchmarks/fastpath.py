@@ -0,0 +1,154 @@
+"""Checks the fast path of the small SOAP operations against suds, then
+measures the calls per second, and per CPU second (per core), of each.
+
+    python -m benchmarks.fastpath [--calls 2000] [--latency 0]
+
+The stand-in server runs in its own process, so the CPU time measured is
+the client's alone. Exits with status 1 if the fast path gave a different
+result from suds for any reply.
+"""
+import optparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENVELOPE = ('<?xml version="1.0" encoding="utf-8"?>'
+            '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><soap:Body>%s'
+            '</soap:Body></soap:Envelope>')
+RESPONSE = ('<%(op)sResponse xmlns="http://www.marketsight.com/webservices/">'
+            '%(result)s</%(op)sResponse>')
+FAULT = ('<soap:Fault><faultcode>soap:Server</faultcode>'
+         '<faultstring>%s</faultstring><detail /></soap:Fault>')
+
+# Replies to check both parsers with: results with text that needs care,
+# empty and nil results, and faults
+RESULTS = {
+    'GetAuthorizationKey': ['0123456789abcdef', 'A1', ' spaced ', 'a &amp; b &lt;c&gt;',
+                            'a &amp;amp; b', 'caf&#233;', '<![CDATA[x<y]]>'],
+    'GetNumberOfRespondents': ['0', '12345', ' 7 ', '-1'],
+    'GetLastUploadedDateTimeByGuid': ['05/09/2016 12:00:00 AM', ''],
+    'CheckForMissingVariables': ['', 'missing1,missing2', 'q&amp;a'],
+}
+
+
+def replies(op):
+    for result in RESULTS[op]:
+        yield ENVELOPE % (RESPONSE % dict(op=op, result='<%sResult>%s</%sResult>'
+                                                        % (op, result, op)))
+    yield ENVELOPE % (RESPONSE % dict(op=op, result='<%sResult/>' % op))
+    yield ENVELOPE % (RESPONSE % dict(op=op, result='<%sResult xsi:nil="true"/>' % op))
+    yield ENVELOPE % (FAULT % 'A1: invalid key')
+    yield ENVELOPE % (FAULT % 'U1 &amp; more')
+
+def outcome(function, *args):
+    """(type, value) of a result, or of a fault's string"""
+    import suds
+    try:
+        result = function(*args)
+    except suds.WebFault as fault:
+        return 'fault', fault.fault.faultstring
+    except Exception as error:
+        return 'error', type(error).__name__
+    return type(result).__name__, result
+
+def check_replies(url, op):
+    """The replies which the fast path parses differently from suds"""
+    from marketsight.clients import get_client
+    from marketsight.fastpath import fast_method
+    client = get_client(url)
+    method = client.wsdl.services[0].ports[0].methods[op]
+    fast = fast_method(url, op)
+    different = []
+    for reply in replies(op):
+        expected = outcome(lambda: method.binding.input.get_reply(method, reply)[1])
+        got = outcome(fast.parse, reply)
+        if expected != got:
+            different.append((reply, expected, got))
+    return different
+
+def start_server(latency):
+    """The stand-in server in its own process, and its URLs"""
+    server = subprocess.Popen([sys.executable, '-u', '-m', 'benchmarks.fakeserver',
+                               '--port', '0', '--latency', '%s' % latency],
+                              cwd=ROOT, stdout=subprocess.PIPE)
+    urls = {}
+    while len(urls) < 2:
+        service, url = server.stdout.readline().strip().split(': ', 1)
+        urls[service] = url
+    return server, urls
+
+def cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def measure(call, calls):
+    """(calls per second, calls per CPU second)"""
+    call()
+    start, start_cpu = time.time(), cpu()
+    for attempt in xrange(calls):
+        call()
+    return calls / (time.time() - start), calls / max(cpu() - start_cpu, 1e-9)
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--calls', type='int', default=2000)
+    parser.add_option('--latency', type='float', default=0.0)
+    options, args = parser.parse_args()
+
+    server, urls = start_server(options.latency)
+    try:
+        from marketsight.fastpath import fast_method
+        from marketsight.methods import Dataset, User
+
+        failed = False
+        for service, op in [('user', 'GetAuthorizationKey')] + \
+                           [('upload', op) for op in ('GetNumberOfRespondents',
+                                                      'GetLastUploadedDateTimeByGuid',
+                                                      'CheckForMissingVariables')]:
+            for reply, expected, got in check_replies(urls[service], op):
+                failed = True
+                print('DIFFERENT %s: suds %r, fast path %r for\n  %s' % (op, expected, got, reply))
+
+        import marketsight.config
+        marketsight.config.URLS.update(user=urls['user'], upload=urls['upload'])
+        user = User('benchmark', 'benchmark', verbose=False)
+        dataset = Dataset(user, '6f1b1a0e-0000-4000-8000-000000000001')
+        key = user.key
+        calls = [
+            ('GetAuthorizationKey', dataset.user.client,
+             dict(un='benchmark', pwd='bad'), urls['user']),
+            ('GetNumberOfRespondents', dataset.client,
+             dict(key=key, datasetGuid=dataset.dataset), urls['upload']),
+            ('GetLastUploadedDateTimeByGuid', dataset.client,
+             dict(key=key, datasetGuid=dataset.dataset), urls['upload']),
+            ('CheckForMissingVariables', dataset.client,
+             dict(key=key, datasetGuid=dataset.dataset, variableList='a,missing1,b'),
+             urls['upload']),
+        ]
+        print('%-32s %12s %12s %12s %12s' % ('operation', 'suds/s', 'fast/s',
+                                             'suds/cpu-s', 'fast/cpu-s'))
+        for op, client, kwargs, url in calls:
+            suds_method = getattr(client.service, op)
+            fast = fast_method(url, op)
+            expected, got = outcome(lambda: suds_method(**kwargs)), outcome(lambda: fast(**kwargs))
+            if expected != got:
+                failed = True
+                print('DIFFERENT %s: suds %r, fast path %r' % (op, expected, got))
+            suds_rate, suds_cpu = measure(lambda: suds_method(**kwargs), options.calls)
+            fast_rate, fast_cpu = measure(lambda: fast(**kwargs), options.calls)
+            print('%-32s %12.0f %12.0f %12.0f %12.0f' % (op, suds_rate, fast_rate,
+                                                         suds_cpu, fast_cpu))
+    finally:
+        server.terminate()
+        server.wait()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
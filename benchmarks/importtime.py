@@ -0,0 +1,62 @@
+"""How long importing marketsight takes in a fresh interpreter, for the
+imports that scripts which never make a SOAP call use, and whether any of
+them imported suds.
+
+    python -m benchmarks.importtime [--repeat 20] [--max-ms 50]
+
+Exits with status 1 if suds was imported, or an import took longer (at
+the median) than --max-ms.
+"""
+import optparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATEMENTS = [
+    'import marketsight',
+    'from marketsight.methods import ReportURL',
+    'from marketsight.helpers import datafile_to_base64',
+    'from marketsight import dataset',
+]
+
+TIMER = '''
+import sys, time
+start = time.time()
+%s
+elapsed = time.time() - start
+sys.stdout.write('%%r %%d\\n' %% (elapsed, 'suds' in sys.modules))
+'''
+
+
+def run(statement):
+    """(seconds, imported suds) for the statement in a fresh interpreter"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.check_output([sys.executable, '-c', TIMER % statement], cwd=ROOT, env=env)
+    elapsed, suds = output.split()
+    return float(elapsed), suds == '1'
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--repeat', type='int', default=20)
+    parser.add_option('--max-ms', type='float', default=None,
+                      help='fail if an import takes longer than this')
+    options, args = parser.parse_args()
+
+    failed = False
+    print('%-52s %8s %8s %6s' % ('import', 'p50 ms', 'max ms', 'suds'))
+    for statement in STATEMENTS:
+        runs = [run(statement) for attempt in xrange(options.repeat)]
+        times = sorted(elapsed * 1000 for elapsed, suds in runs)
+        suds = any(suds for elapsed, suds in runs)
+        median = times[len(times) // 2]
+        print('%-52s %8.2f %8.2f %6s' % (statement, median, times[-1], 'yes' if suds else 'no'))
+        if suds or (options.max_ms is not None and median > options.max_ms):
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Report links per second built one at a time with Report.chart and
+Report.datatable (a ReportURL each), and in bulk with ReportURLBuilder
+(tests/test_reports.py checks that both give the same URLs).
+
+    python -m benchmarks.reports [--links 50000]
+"""
+import optparse
+import time
+import uuid
+
+from marketsight.methods import Report, ReportURL, User
+from marketsight.transport import connection_pool
+
+from .fakeserver import FakeMarketSight
+
+
+def catalog(links):
+    kinds = [('chart', 'image'), ('crosstab', 'excel'), ('datatable', 'excel2007'),
+             ('chart', None)]
+    for index in xrange(links):
+        url_type, export = kinds[index % len(kinds)]
+        yield (url_type, '%s' % uuid.UUID(int=index), 'readonly', export)
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--links', type='int', default=50000)
+    options, args = parser.parse_args()
+
+    server = FakeMarketSight().start()
+    urls = server.urls()
+    # URLS is read from the environment on import, so point the clients here
+    from marketsight.config import URLS
+    URLS.update(user=urls['user'], upload=urls['upload'])
+    user = User('benchmark', 'benchmark', verbose=False)
+    user.key
+    reports = list(catalog(options.links))
+
+    start = time.time()
+    [ReportURL(url_type, id, user=user, mode=mode, export=export).geturl()
+     for url_type, id, mode, export in reports]
+    single = time.time() - start
+
+    start = time.time()
+    list(Report(user).urls(reports))
+    builder = time.time() - start
+
+    print('%-20s %12s' % ('method', 'links/s'))
+    print('%-20s %12.0f' % ('ReportURL.geturl', options.links / single))
+    print('%-20s %12.0f' % ('ReportURLBuilder', options.links / builder))
+    connection_pool.clear()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
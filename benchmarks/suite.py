@@ -0,0 +1,225 @@
+"""End-to-end benchmarks of Dataset against the local stand-in server: the
+update and append paths for SPSS and Triple-S data of each size, and the
+metadata calls. Each benchmark runs in a fresh interpreter so that its peak
+RSS is its own.
+
+    python -m benchmarks.suite [--sizes small,medium] [--latency 0.01]
+                               [--bandwidth 50000000] [--streaming]
+                               [--output results.json] [--compare baseline.json]
+
+With --compare, benchmarks which got slower (or bigger) than the baseline
+by more than --tolerance are listed, and the exit status is 1.
+"""
+import json
+import optparse
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from . import synthetic
+from .fakeserver import FakeMarketSight
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def peak_rss():
+    """This process's peak resident set size in MB (ru_maxrss is in KB on
+    Linux, and bytes on OS X)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024 if sys.platform == 'darwin' else 1024.0)
+
+def quiet_dataset(streaming):
+    from marketsight.methods import Dataset, User
+
+    class QuietDataset(Dataset):
+        def message(self, message):
+            pass
+
+    user = User('benchmark', 'benchmark', verbose=False)
+    return QuietDataset(user, '%s' % uuid.uuid4(), streaming=streaming)
+
+def run_upload(spec):
+    """Time an update or append of the spec's files"""
+    dataset = quiet_dataset(spec['streaming'])
+    dataset.user.key
+    paths = spec['paths']
+    start = time.time()
+    if spec['datatype'] == 'spss':
+        method = dataset.update_spss if spec['function'] == 'update' else dataset.append_spss
+        ok = method(paths['sav'])
+    elif spec['function'] == 'update':
+        ok = dataset.update_sss(paths['sss'], paths['asc'])
+    else:
+        ok = dataset.append_sss(paths['sss'], paths['asc'])
+    elapsed = time.time() - start
+    if not ok:
+        raise RuntimeError('%s failed: %s' % (spec['name'], dataset.last_error))
+    size = sum(os.path.getsize(path) for name, path in paths.items()
+               if name in (('sav',) if spec['datatype'] == 'spss' else ('sss', 'asc')))
+    return dict(seconds=elapsed, mb_per_s=size / elapsed / 1e6)
+
+def run_metadata(spec):
+    """Time each metadata call "calls" times"""
+    from marketsight.cache import variables_cache
+
+    dataset = quiet_dataset(spec['streaming'])
+    dataset.user.key
+    variables = synthetic.variable_names() + ['missing%d' % i for i in xrange(10)]
+    operations = [
+        ('respondents', dataset.number_of_respondents, ()),
+        ('last_uploaded', dataset.last_uploaded_datetime, ()),
+        ('missing_variables', dataset.check_for_missing_variables, (variables,)),
+    ]
+    result = {}
+    start = time.time()
+    for name, method, args in operations:
+        latencies = []
+        for call in xrange(spec['calls']):
+            began = time.time()
+            method(*args)
+            latencies.append(time.time() - began)
+            # Every variable check would otherwise be answered by the cache
+            variables_cache.clear()
+        result['%s_p50_ms' % name] = percentile(latencies, 0.5) * 1000
+        result['%s_p99_ms' % name] = percentile(latencies, 0.99) * 1000
+    elapsed = time.time() - start
+    result.update(seconds=elapsed, calls_per_s=spec['calls'] * len(operations) / elapsed)
+    return result
+
+def child(spec):
+    """Run one benchmark (in the child interpreter) and print its result"""
+    spec = json.loads(spec)
+    if spec['kind'] == 'metadata':
+        result = run_metadata(spec)
+    else:
+        result = run_upload(spec)
+    result['peak_rss_mb'] = peak_rss()
+    sys.stdout.write(json.dumps(result) + '\n')
+
+def run(spec, server):
+    """Run one benchmark in a fresh interpreter pointed at the server"""
+    urls = server.urls()
+    env = dict(os.environ,
+               MARKETSIGHT_USER_ENDPOINT=urls['user'],
+               MARKETSIGHT_UPLOAD_ENDPOINT=urls['upload'],
+               MARKETSIGHT_CACHE_DIR=spec['cache_dir'],
+               PYTHONPATH=os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'benchmarks.suite', '--child', json.dumps(spec)],
+        cwd=ROOT, env=env)
+    result = json.loads(output.strip().splitlines()[-1])
+    result['name'] = spec['name']
+    return result
+
+def specs(sizes, tempdir, streaming, calls):
+    cache_dir = os.path.join(tempdir, 'cache')
+    yield dict(name='metadata', kind='metadata', calls=calls, streaming=streaming,
+               cache_dir=cache_dir)
+    for size in sizes:
+        respondents = synthetic.SIZES[size]
+        directory = os.path.join(tempdir, size)
+        os.mkdir(directory)
+        paths = dict(sav=synthetic.write_sav(os.path.join(directory, 'data.sav'), respondents),
+                     asc=synthetic.write_asc(os.path.join(directory, 'data.asc'), respondents),
+                     sss=synthetic.write_sss(os.path.join(directory, 'data.sss')))
+        for datatype in ('spss', 'sss'):
+            for function in ('update', 'append'):
+                yield dict(name='%s_%s_%s' % (function, datatype, size), kind='upload',
+                           datatype=datatype, function=function, paths=paths,
+                           streaming=streaming, cache_dir=cache_dir)
+
+def worse(measure, change, tolerance):
+    """Whether a measure changing by the fraction "change" is a regression"""
+    if measure in ('mb_per_s', 'calls_per_s'):
+        return -change > tolerance
+    return change > tolerance
+
+def compare(results, baseline, tolerance):
+    """The (name, measure, baseline, result) of each regression"""
+    baseline = dict((result['name'], result) for result in baseline['results'])
+    regressions = []
+    for result in results:
+        before = baseline.get(result['name'], {})
+        for measure, value in sorted(result.items()):
+            if measure == 'name' or not before.get(measure):
+                continue
+            if worse(measure, (value - before[measure]) / float(before[measure]), tolerance):
+                regressions.append((result['name'], measure, before[measure], value))
+    return regressions
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sizes', default='small,medium',
+                      help='comma separated sizes from %s' % ', '.join(sorted(synthetic.SIZES)))
+    parser.add_option('--latency', type='float', default=0.005,
+                      help='seconds the server adds to every reply')
+    parser.add_option('--bandwidth', type='int', default=None,
+                      help='bytes per second the server accepts')
+    parser.add_option('--streaming', action='store_true', default=False)
+    parser.add_option('--calls', type='int', default=100,
+                      help='calls of each metadata operation')
+    parser.add_option('--output', help='write the results to this JSON file')
+    parser.add_option('--compare', help='a previous --output file to compare with')
+    parser.add_option('--tolerance', type='float', default=0.2,
+                      help='the fraction by which a measure may get worse')
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    if options.child:
+        return child(options.child)
+
+    sizes = [size.strip() for size in options.sizes.split(',') if size.strip()]
+    for size in sizes:
+        if size not in synthetic.SIZES:
+            parser.error('unknown size "%s"' % size)
+    server = FakeMarketSight(latency=options.latency, bandwidth=options.bandwidth).start()
+    tempdir = tempfile.mkdtemp(prefix='marketsight-benchmark-')
+    results = []
+    try:
+        print('%-22s %9s %9s %9s %12s' % ('benchmark', 'seconds', 'MB/s', 'calls/s', 'peak RSS MB'))
+        for spec in specs(sizes, tempdir, options.streaming, options.calls):
+            result = run(spec, server)
+            results.append(result)
+            print('%-22s %9.3f %9s %9s %12.1f' % (
+                result['name'], result['seconds'],
+                '%.1f' % result['mb_per_s'] if 'mb_per_s' in result else '-',
+                '%.1f' % result['calls_per_s'] if 'calls_per_s' in result else '-',
+                result['peak_rss_mb']))
+    finally:
+        shutil.rmtree(tempdir)
+        server.shutdown()
+
+    metadata = results[0]
+    for name in ('respondents', 'last_uploaded', 'missing_variables'):
+        print('%-22s p50 %.2f ms, p99 %.2f ms' % (
+            name, metadata['%s_p50_ms' % name], metadata['%s_p99_ms' % name]))
+
+    recorded = dict(recorded=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    python=platform.python_version(), platform=platform.platform(),
+                    options=dict(sizes=sizes, latency=options.latency,
+                                 bandwidth=options.bandwidth, streaming=options.streaming,
+                                 calls=options.calls),
+                    results=results)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(recorded, f, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for name, measure, before, after in regressions:
+            print('REGRESSION %s %s: %.3f -> %.3f' % (name, measure, before, after))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
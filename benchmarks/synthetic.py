@@ -0,0 +1,64 @@
+"""Synthetic SPSS and Triple-S datasets for the benchmarks.
+
+The data is seeded, so every run of a benchmark sees the same bytes, and is
+shaped like survey data (small integer codes, a few wide numerics) so that
+it compresses as real exports do.
+"""
+import random
+import struct
+import time
+
+SIZES = {
+    'small': 1000,
+    'medium': 50000,
+    'large': 500000,
+}
+
+
+def rows(respondents, columns=40, seed=1):
+    generator = random.Random(seed)
+    for respondent in xrange(1, respondents + 1):
+        yield [respondent] + [generator.randint(1, 9) for column in xrange(columns - 2)] + \
+              [generator.randint(0, 99999)]
+
+def variable_names(columns=40):
+    return ['RESPID'] + ['Q%d' % column for column in xrange(1, columns - 1)] + ['WEIGHT']
+
+def write_asc(filename, respondents, columns=40, seed=1):
+    """A fixed-width Triple-S .asc file: 6 digit ids, 1 digit codes and a
+    5 digit weight"""
+    with open(filename, 'wb') as f:
+        for row in rows(respondents, columns, seed):
+            f.write('%06d%s%05d\r\n' % (row[0], ''.join('%d' % code for code in row[1:-1]), row[-1]))
+    return filename
+
+def write_sss(filename, columns=40):
+    """The Triple-S .sss metadata describing write_asc's layout"""
+    layout = [(1, 6)] + [(index, index) for index in xrange(7, columns + 5)] + \
+             [(columns + 5, columns + 9)]
+    variables = []
+    for ident, (name, (start, finish)) in enumerate(zip(variable_names(columns), layout)):
+        variables.append('<variable ident="%d" type="quantity"><name>%s</name>'
+                         '<label>%s</label><position start="%d" finish="%d"/>'
+                         '<values><range from="0" to="%s"/></values></variable>'
+                         % (ident + 1, name, name, start, finish, '9' * (finish - start + 1)))
+    with open(filename, 'wb') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?><sss version="2.0">'
+                '<survey><record ident="A">%s</record></survey></sss>' % ''.join(variables))
+    return filename
+
+def write_sav(filename, respondents, columns=40, seed=1):
+    """An uncompressed SPSS system file of numeric variables"""
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<4s60siiiiid9s8s64s3s', '$FL2',
+                            '@(#) SPSS DATA FILE marketsight benchmarks'.ljust(60),
+                            2, columns, 0, 0, respondents, 100.0,
+                            time.strftime('%d %b %y'), time.strftime('%H:%M:%S'),
+                            'synthetic'.ljust(64), '\0' * 3))
+        for name in variable_names(columns):
+            f.write(struct.pack('<iiiiii8s', 2, 0, 0, 0, 0x050800, 0x050800, name.ljust(8)))
+        f.write(struct.pack('<ii', 999, 0))
+        case = struct.Struct('<%dd' % columns)
+        for row in rows(respondents, columns, seed):
+            f.write(case.pack(*row))
+    return filename
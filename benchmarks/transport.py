@@ -0,0 +1,57 @@
+"""Calls per second and latency of the small metadata calls through suds'
+own transport (a new connection per call) and through the keep-alive
+PooledHttpTransport, against the local stand-in server.
+
+    python -m benchmarks.transport [--calls 500] [--latency 0.002] [--handshake 0.03]
+"""
+import optparse
+import time
+import uuid
+
+from suds.transport.https import HttpAuthenticated
+
+from marketsight.clients import get_client
+from marketsight.transport import ConnectionPool, PooledHttpTransport
+
+from .fakeserver import FakeMarketSight
+
+
+def run(server, transport, calls):
+    urls = server.urls()
+    key = get_client(urls['user'], transport=transport()).service.GetAuthorizationKey(un='u', pwd='p')
+    client = get_client(urls['upload'], transport=transport())
+    dataset = '%s' % uuid.uuid4()
+    latencies = []
+    start = time.time()
+    for call in xrange(calls):
+        began = time.time()
+        client.service.GetNumberOfRespondents(key=key, datasetGuid=dataset)
+        latencies.append(time.time() - began)
+    elapsed = time.time() - start
+    latencies.sort()
+    return calls / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--calls', type='int', default=500)
+    parser.add_option('--latency', type='float', default=0.002,
+                      help='seconds the server adds to every reply')
+    parser.add_option('--handshake', type='float', default=0.03,
+                      help='seconds the server adds to every new connection')
+    options, args = parser.parse_args()
+
+    server = FakeMarketSight(latency=options.latency, handshake=options.handshake).start()
+    pool = ConnectionPool()
+    transports = [
+        ('suds (urllib2)', HttpAuthenticated),
+        ('keep-alive pool', lambda: PooledHttpTransport(pool)),
+    ]
+    print('%-16s %10s %12s %12s' % ('transport', 'calls/s', 'p50 ms', 'p99 ms'))
+    for name, transport in transports:
+        rate, p50, p99 = run(server, transport, options.calls)
+        print('%-16s %10.1f %12.2f %12.2f' % (name, rate, p50 * 1000, p99 * 1000))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
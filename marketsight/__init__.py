@@ -1,6 +1,8 @@
-# shortcuts
+# shortcuts (none of these modules import suds until a client is needed)
 from .methods import dataset, get_dataset, get_authorization_key,\
-                     MarketsightAuthError, login_user
+                     MarketsightAuthError, login_user, ReportURL, Report, ReportURLBuilder
+from .batch import upload_many, upload_to_many, UploadResult, Pipeline
+from .status import DatasetStatus
 
 # constants
 __major__ = 0  # for major interface/format changes
@@ -9,4 +11,6 @@ __release__ = 1  # for tweaks, bug-fixes, or development
 __version__ = '%d.%d.%d' % (__major__, __minor__, __release__)
 __author__ = 'Kieran Darcy'
 __author_email__ = 'kdarcy@acritas.com'
-__all__ = ('dataset','get_dataset','get_authorization_key','login_user','MarketsightAuthError')
+__all__ = ('dataset','get_dataset','get_authorization_key','login_user','MarketsightAuthError',
+           'ReportURL','Report','ReportURLBuilder',
+           'upload_many','upload_to_many','UploadResult','Pipeline','DatasetStatus')
@@ -0,0 +1,105 @@
+"""Non-blocking counterparts of User and Dataset. Their methods return at
+once with a multiprocessing AsyncResult while the SOAP call runs on a pool
+of worker threads shared by the whole process, each thread with its own
+client. Use result.get() for the value, or pass callback= to be called
+with it.
+
+    datasets = AsyncDataset(user)
+    pending = [datasets.number_of_respondents(guid) for guid in guids]
+    counts = [result.get() for result in pending]
+
+Calls beyond the pool's size (ASYNC_WORKERS) wait for a free thread, and
+the adaptive limiter may hold back those running. Uploads run on a pool of
+their own (ASYNC_UPLOAD_WORKERS), so that a few long uploads never hold up
+the status queries behind them.
+"""
+import functools
+import threading
+from multiprocessing.pool import ThreadPool
+
+from .config import ASYNC_WORKERS, ASYNC_UPLOAD_WORKERS, STREAMING
+from .methods import Dataset, User
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def shared_pool(uploads=False):
+    """The process-wide pool for calls, or for uploads"""
+    with _pool_lock:
+        if uploads not in _pools:
+            _pools[uploads] = ThreadPool(ASYNC_UPLOAD_WORKERS if uploads else ASYNC_WORKERS)
+        return _pools[uploads]
+
+
+class AsyncMixin(object):
+    operations = ()
+    # The operations run on the upload pool
+    uploads = ()
+
+    def __init__(self, pool=None, upload_pool=None):
+        self.pool = pool if pool is not None else shared_pool()
+        self.upload_pool = upload_pool if upload_pool is not None else shared_pool(uploads=True)
+        self.local = threading.local()
+
+    def target(self):
+        """The blocking object for the current worker thread"""
+        raise NotImplementedError
+
+    def run(self, operation, args, kwargs):
+        return getattr(self.target(), operation)(*args, **kwargs)
+
+    def submit(self, operation, *args, **kwargs):
+        callback = kwargs.pop('callback', None)
+        pool = self.upload_pool if operation in self.uploads else self.pool
+        return pool.apply_async(self.run, (operation, args, kwargs), callback=callback)
+
+    def __getattr__(self, name):
+        if name in self.operations:
+            return functools.partial(self.submit, name)
+        raise AttributeError(name)
+
+
+class AsyncUser(AsyncMixin):
+    operations = ('get_authorization_key',)
+
+    def __init__(self, user, pool=None, upload_pool=None):
+        AsyncMixin.__init__(self, pool, upload_pool)
+        self.user = user if isinstance(user, User) else User(*user)
+
+    def target(self):
+        return self.user
+
+    def key(self, callback=None):
+        """The user's (shared, cached) key"""
+        return self.pool.apply_async(lambda: self.user.key, callback=callback)
+
+    def __repr__(self):
+        return '<AsyncUser(%r)>' % ('%s' % self.user)
+
+
+class AsyncDataset(AsyncMixin):
+    uploads = ('update_spss', 'append_spss', 'update_sss', 'append_sss',
+               'append_sss_incremental', 'update_sss_with_zip', 'upload_zipped')
+    operations = ('number_of_respondents', 'last_uploaded_datetime',
+                  'check_for_missing_variables') + uploads
+
+    def __init__(self, user, dataset=None, pool=None, streaming=STREAMING, manifest=None,
+                 upload_pool=None):
+        AsyncMixin.__init__(self, pool, upload_pool)
+        self.user = user if isinstance(user, User) else User(*user)
+        self.dataset = dataset
+        self.streaming = streaming
+        self.manifest = manifest
+        if dataset is not None:
+            # Validate the dataset now, rather than on the first call
+            Dataset(self.user, dataset, auto_login=False)
+
+    def target(self):
+        if not hasattr(self.local, 'dataset'):
+            self.local.dataset = Dataset(self.user, self.dataset, auto_login=False,
+                                         streaming=self.streaming, manifest=self.manifest)
+        return self.local.dataset
+
+    def __repr__(self):
+        return "<AsyncDataset(user='%s', dataset='%s')>" % (self.user, self.dataset)
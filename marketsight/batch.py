@@ -0,0 +1,431 @@
+"""Update or append many datasets at once. The files are zipped on a pool
+of processes and uploaded on a bounded pool of threads, each thread with its
+own Dataset (and so its own SOAP client), all sharing one User's key.
+
+    results = upload_many(user, [
+        (dataset_guid, 'data.sav', 'spss', 'update'),
+        (dataset_guid, ['data.asc', 'meta.sss', 'labels.xml'], 'sss', 'update'),
+    ], max_workers=4)
+
+upload_to_many sends the same files to many datasets, zipping them once:
+
+    results = upload_to_many(user, [guid1, guid2, guid3], 'data.sav')
+
+Pipeline uploads the jobs one at a time instead, zipping the next ones
+while each uploads, and reports which of the two stages held it up.
+"""
+import Queue
+import multiprocessing
+import multiprocessing.pool
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from .config import STREAMING, PIPELINE_PREFETCH
+from .helpers import Payload, datafile_members, files_digest, files_to_zipped_file
+from .manifest import Manifest
+from .metrics import metrics
+from .methods import Dataset, User
+from .payloads import PayloadCache, shared_cache
+
+
+class UploadResult(object):
+    """The outcome of one dataset's upload: its status ("uploaded",
+    "skipped" or "failed"), any error, and how long each stage took in
+    seconds"""
+
+    def __init__(self, dataset, datatype='spss', function='update'):
+        self.dataset = dataset
+        self.datatype = datatype
+        self.function = function
+        self.status = 'pending'
+        self.error = None
+        self.size = None
+        self.timings = {}
+
+    def __nonzero__(self):
+        return self.status in ('uploaded', 'skipped')
+
+    def __repr__(self):
+        return '<UploadResult(dataset=%r, status=%r)>' % (self.dataset, self.status)
+
+
+def parse_job(job):
+    """(dataset, paths[, datatype[, function]]) with the paths made into a
+    [data, metadata, labels] list"""
+    dataset, paths = job[:2]
+    datatype = job[2] if len(job) > 2 else 'spss'
+    function = job[3] if len(job) > 3 else 'update'
+    if isinstance(paths, basestring):
+        paths = [paths]
+    paths = list(paths) + [None] * (3 - len(paths))
+    return dataset, paths, datatype, function
+
+def zip_to_tempfile(filenames):
+    fd, filename = tempfile.mkstemp(suffix='.zip', prefix='marketsight-')
+    try:
+        with os.fdopen(fd, 'w+b') as f:
+            files_to_zipped_file(filenames, f)
+    except:
+        os.remove(filename)
+        raise
+    return filename
+
+def last_uploaded(dataset, manifest, job):
+    """The service's last uploaded datetime for an update job's dataset, for
+    the manifest to check before skipping it, or None if the manifest has no
+    upload to skip it by"""
+    guid, paths, datatype, function = parse_job(job)
+    if manifest is None or function != 'update':
+        return None
+    try:
+        guid = '%s' % uuid.UUID(guid)
+    except (TypeError, ValueError):
+        return None
+    if not (manifest.get(guid) or {}).get('digest'):
+        return None
+    try:
+        return dataset.last_uploaded_datetime(guid)
+    except Exception:
+        # The job is uploaded rather than skipped, and fails there if the
+        # service is really down
+        return None
+
+def prepare(indexed_job):
+    """Zip the data and labels of a job to temporary files, unless the
+    manifest says they are unchanged (and "uploaded", from last_uploaded(),
+    says nothing was uploaded since). This runs on the process pool, so it
+    returns a dict of paths and error messages, not objects."""
+    index, job, manifest, uploaded = indexed_job
+    start = time.time()
+    dataset, paths, datatype, function = parse_job(job)
+    prepared = dict(index=index, zipped=None, labels=None, temporary=[],
+                    digest=None, skipped=False, error=None)
+    try:
+        files, is_already_zip = datafile_members(paths[:2], datatype)
+        if manifest is not None and function == 'update':
+            prepared['digest'] = files_digest(files + [path for path in paths[2:] if path])
+            if manifest.unchanged('%s' % uuid.UUID(dataset), prepared['digest'], uploaded):
+                prepared['skipped'] = True
+                return prepared
+        if is_already_zip:
+            prepared['zipped'] = files[0]
+        else:
+            prepared['zipped'] = zip_to_tempfile(files)
+            prepared['temporary'].append(prepared['zipped'])
+        if paths[2] and shared_cache() is not None:
+            # Zipped once for every job which shares it
+            shared_cache().get([paths[2]])
+            prepared['labels_cached'] = paths[2]
+        elif paths[2]:
+            prepared['labels'] = zip_to_tempfile([paths[2]])
+            prepared['temporary'].append(prepared['labels'])
+    except Exception as e:
+        for filename in prepared['temporary']:
+            os.remove(filename)
+        prepared.update(temporary=[], error='%s' % e)
+    finally:
+        prepared['elapsed'] = time.time() - start
+    return prepared
+
+def record_prepared(result, prepared):
+    """Record the outcome of preparing a job, and return whether it is
+    ready to upload"""
+    result.timings['prepare'] = prepared['elapsed']
+    metrics.observe('stage_seconds', prepared['elapsed'], stage='prepare',
+                    datatype=result.datatype.upper())
+    if prepared['error'] is not None:
+        result.status = 'failed'
+        result.error = prepared['error']
+    elif prepared['skipped']:
+        result.status = 'skipped'
+    else:
+        return True
+    return False
+
+def upload_prepared(dataset, result, prepared):
+    """Upload a prepared job with "dataset", then remove its temporary files"""
+    start = time.time()
+    try:
+        payload = Payload(open(prepared['zipped'], 'rb'))
+        result.size = payload.size
+        if prepared.get('labels_cached'):
+            labels = shared_cache().payload([prepared['labels_cached']])
+        else:
+            labels = Payload(open(prepared['labels'], 'rb')) if prepared['labels'] else None
+        if dataset.upload_zipped(payload, dataset=result.dataset,
+                                 datatype=result.datatype,
+                                 function=result.function,
+                                 labels_file=labels,
+                                 digest=prepared['digest']):
+            result.status = 'uploaded'
+        else:
+            result.status = 'failed'
+            result.error = '%s' % dataset.last_error
+    except Exception as e:
+        result.status = 'failed'
+        result.error = '%s' % e
+    finally:
+        for filename in prepared['temporary']:
+            os.remove(filename)
+        result.timings['upload'] = time.time() - start
+        metrics.observe('stage_seconds', result.timings['upload'], stage='upload',
+                        datatype=result.datatype.upper())
+
+def upload_many(user, jobs, max_workers=4, processes=None, streaming=STREAMING, manifest=None):
+    """Upload every (dataset, paths, datatype, function) job, with at most
+    "max_workers" uploads in flight and "processes" more jobs zipped (or
+    being zipped) ahead of them, and return an UploadResult for each job in
+    the same order. With a Manifest, updates whose files are
+    unchanged since their last upload are "skipped"."""
+    if not isinstance(user, User):
+        user = User(*user)
+    if isinstance(manifest, basestring):
+        manifest = Manifest(manifest)
+    jobs = list(jobs)
+    results = [UploadResult(dataset, datatype, function)
+               for dataset, paths, datatype, function in map(parse_job, jobs)]
+    local = threading.local()
+
+    def local_dataset():
+        if not hasattr(local, 'dataset'):
+            local.dataset = Dataset(user, auto_login=False, streaming=streaming,
+                                    manifest=manifest)
+        return local.dataset
+
+    def upload(prepared):
+        try:
+            upload_prepared(local_dataset(), results[prepared['index']], prepared)
+        finally:
+            slots.release()
+
+    # A slot for each job being zipped, or zipped and not yet uploaded, so
+    # that fast compression doesn't fill the disk while uploads catch up
+    processes = processes or multiprocessing.cpu_count()
+    slots = threading.Semaphore(max_workers + processes)
+    stopping = threading.Event()
+
+    def bounded(indexed_jobs):
+        # Read by the process pool's task thread, which waits here for slots
+        for indexed_job in indexed_jobs:
+            slots.acquire()
+            if stopping.is_set():
+                return
+            yield indexed_job
+
+    # Log in once, up front, so the workers share the key
+    user.key
+    compressors = multiprocessing.Pool(processes)
+    uploaders = multiprocessing.pool.ThreadPool(max_workers)
+    try:
+        uploaded = uploaders.map(lambda job: last_uploaded(local_dataset(), manifest, job), jobs)
+        indexed_jobs = [(index, job, manifest, uploaded[index])
+                        for index, job in enumerate(jobs)]
+        for prepared in compressors.imap_unordered(prepare, bounded(indexed_jobs)):
+            if record_prepared(results[prepared['index']], prepared):
+                uploaders.apply_async(upload, (prepared,))
+            else:
+                slots.release()
+    finally:
+        # Stop early (on an interrupt) without waiting for more slots
+        stopping.set()
+        slots.release()
+        compressors.close()
+        uploaders.close()
+        uploaders.join()
+        compressors.join()
+    return results
+
+def upload_to_many(user, datasets, paths, datatype='spss', function='update', max_workers=4,
+                   streaming=STREAMING, manifest=None, cache=None):
+    """Update or append every dataset with the same files, which are zipped
+    and encoded once (into a PayloadCache, so again only if they change),
+    with at most "max_workers" uploads in flight. Returns an UploadResult
+    for each dataset, in the same order. With caching off, the payloads go
+    in a temporary PayloadCache, removed once they have been sent."""
+    if cache is None:
+        cache = shared_cache()
+    if cache is None:
+        directory = tempfile.mkdtemp(prefix='marketsight-')
+        try:
+            return upload_to_many(user, datasets, paths, datatype, function, max_workers,
+                                  streaming, manifest, PayloadCache(directory, max_size=None))
+        finally:
+            shutil.rmtree(directory)
+    if not isinstance(user, User):
+        user = User(*user)
+    if isinstance(manifest, basestring):
+        manifest = Manifest(manifest)
+    datasets = list(datasets)
+    empty, paths, datatype, function = parse_job((None, paths, datatype, function))
+    results = [UploadResult(dataset, datatype, function) for dataset in datasets]
+
+    start = time.time()
+    try:
+        files, is_already_zip = datafile_members(paths[:2], datatype)
+        digest = None
+        if manifest is not None and function == 'update':
+            digest = files_digest(files + [path for path in paths[2:] if path])
+        labels = [paths[2]] if paths[2] else None
+        with cache.payload(files, zipped=is_already_zip) as payload:
+            size = payload.size
+            # Without streaming, every upload sends the same string
+            zipped = None if streaming else payload.b64encode()
+        if labels:
+            with cache.payload(labels) as payload:
+                labels_data = None if streaming else payload.b64encode()
+        error = None
+    except Exception as e:
+        error = '%s' % e
+    prepared = dict(elapsed=time.time() - start, error=error, skipped=False)
+    if not all([record_prepared(result, prepared) for result in results]):
+        return results
+
+    local = threading.local()
+
+    def upload(result):
+        if not hasattr(local, 'dataset'):
+            local.dataset = Dataset(user, auto_login=False, streaming=streaming,
+                                    manifest=manifest)
+        start = time.time()
+        try:
+            guid = '%s' % uuid.UUID(result.dataset)
+            if digest is not None and manifest.unchanged(
+                    guid, digest, lambda: local.dataset.last_uploaded_datetime(guid)):
+                result.status = 'skipped'
+                return
+            result.size = size
+            if streaming:
+                # Each upload reads its own handle, reopened from the cache
+                payload = cache.payload(files, zipped=is_already_zip)
+                labels_payload = labels and cache.payload(labels)
+            else:
+                payload, labels_payload = zipped, labels and labels_data
+            if local.dataset.upload_zipped(payload, dataset=guid, datatype=result.datatype,
+                                           function=result.function,
+                                           labels_file=labels_payload, digest=digest):
+                result.status = 'uploaded'
+            else:
+                result.status = 'failed'
+                result.error = '%s' % local.dataset.last_error
+        except Exception as e:
+            result.status = 'failed'
+            result.error = '%s' % e
+        finally:
+            result.timings['upload'] = time.time() - start
+            metrics.observe('stage_seconds', result.timings['upload'], stage='upload',
+                            datatype=result.datatype.upper())
+
+    # Log in once, up front, so the workers share the key
+    user.key
+    uploaders = multiprocessing.pool.ThreadPool(max(1, min(max_workers, len(datasets))))
+    try:
+        uploaders.map(upload, results)
+    finally:
+        uploaders.close()
+        uploaders.join()
+    return results
+
+
+class Pipeline(object):
+    """Upload jobs in order, one at a time, while a worker process zips
+    the jobs after the current one. At most "prefetch" zipped jobs wait
+    on disk, so a slow network doesn't fill the disk.
+
+    After run(), "busy" holds the seconds each stage spent working, and
+    utilisation() the fraction of the run that is: the stage close to 1.0
+    is the bottleneck, and the other stage spent the rest waiting for it.
+    """
+    stages = ('prepare', 'upload')
+
+    def __init__(self, user, prefetch=PIPELINE_PREFETCH, streaming=STREAMING, manifest=None):
+        self.user = user if isinstance(user, User) else User(*user)
+        if isinstance(manifest, basestring):
+            manifest = Manifest(manifest)
+        self.manifest = manifest
+        self.prefetch = max(1, prefetch)
+        self.dataset = Dataset(self.user, auto_login=False, streaming=streaming,
+                               manifest=manifest)
+        self.busy = dict.fromkeys(self.stages, 0.0)
+        self.elapsed = 0.0
+
+    def utilisation(self):
+        if not self.elapsed:
+            return dict.fromkeys(self.stages, 0.0)
+        return dict((stage, min(1.0, self.busy[stage] / self.elapsed)) for stage in self.stages)
+
+    def summary(self):
+        utilisation = self.utilisation()
+        return 'prepare %.0f%% busy, upload %.0f%% busy over %.1f seconds (%s bound)' % (
+            utilisation['prepare'] * 100, utilisation['upload'] * 100, self.elapsed,
+            'compression' if utilisation['prepare'] > utilisation['upload'] else 'network')
+
+    def run(self, jobs):
+        """Upload every (dataset, paths, datatype, function) job, and return
+        an UploadResult for each, as upload_many does"""
+        jobs = list(jobs)
+        results = [UploadResult(dataset, datatype, function)
+                   for dataset, paths, datatype, function in map(parse_job, jobs)]
+        ready = Queue.Queue()
+        # One slot for the job uploading, and one for each job waiting
+        slots = threading.Semaphore(self.prefetch + 1)
+        stopping = threading.Event()
+        compressor = multiprocessing.Pool(1)
+        # The uploads use self.dataset's client, so the producer has its own
+        checker = Dataset(self.user, auto_login=False)
+
+        def produce():
+            try:
+                for index, job in enumerate(jobs):
+                    slots.acquire()
+                    if stopping.is_set():
+                        break
+                    start = time.time()
+                    try:
+                        uploaded = last_uploaded(checker, self.manifest, job)
+                        prepared = compressor.apply(prepare,
+                                                    ((index, job, self.manifest, uploaded),))
+                    except Exception as e:
+                        prepared = dict(index=index, temporary=[], skipped=False,
+                                        error='%s' % e, elapsed=time.time() - start)
+                    self.busy['prepare'] += time.time() - start
+                    ready.put(prepared)
+            finally:
+                ready.put(None)
+
+        self.busy = dict.fromkeys(self.stages, 0.0)
+        self.user.key
+        start = time.time()
+        producer = threading.Thread(target=produce, name='marketsight-prepare')
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                prepared = ready.get()
+                if prepared is None:
+                    break
+                try:
+                    result = results[prepared['index']]
+                    if record_prepared(result, prepared):
+                        upload_start = time.time()
+                        upload_prepared(self.dataset, result, prepared)
+                        self.busy['upload'] += time.time() - upload_start
+                finally:
+                    slots.release()
+        finally:
+            # Stop early (on an interrupt) without leaving zipped files behind
+            stopping.set()
+            slots.release()
+            producer.join()
+            while not ready.empty():
+                prepared = ready.get()
+                for filename in (prepared or {}).get('temporary', []):
+                    os.remove(filename)
+            compressor.close()
+            compressor.join()
+            self.elapsed = time.time() - start
+        self.dataset.message('...%s' % self.summary())
+        return results
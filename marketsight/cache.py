@@ -0,0 +1,70 @@
+"""In-process caches of what the MarketSight services said about each
+dataset. Dataset drops a dataset's entries whenever it uploads to it."""
+import threading
+import time
+from collections import OrderedDict
+
+from .config import STATUS_TTL, STATUS_CACHE_SIZE, VARIABLES_TTL
+
+
+class LRUCache(object):
+    """A thread-safe mapping which forgets entries "ttl" seconds after they
+    were set, and the least recently used ones beyond "maxsize"."""
+
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, expires = self.entries.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires <= time.time():
+                return default
+            self.entries[key] = (value, expires)
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def merge(self, key, values):
+        """Add "values" to the set stored under key"""
+        with self.lock:
+            value, expires = self.entries.pop(key, (frozenset(), None))
+            if expires is not None and expires <= time.time():
+                value, expires = frozenset(), None
+            if expires is None and self.ttl is not None:
+                expires = time.time() + self.ttl
+            self.entries[key] = (value | frozenset(values), expires)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+status_cache = LRUCache(STATUS_CACHE_SIZE, STATUS_TTL)
+# The variables known to be in each dataset
+variables_cache = LRUCache(STATUS_CACHE_SIZE, VARIABLES_TTL)
+
+def invalidate(dataset):
+    """Forget everything cached about the dataset"""
+    status_cache.delete(dataset)
+    variables_cache.delete(dataset)
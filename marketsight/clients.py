@@ -0,0 +1,97 @@
+"""Shared suds clients. suds is only imported once a client (or one of its
+exceptions) is first needed, so importing marketsight stays cheap."""
+import os
+import threading
+
+from .config import CACHE_DIR, WSDL_CACHE_HOURS
+
+# Bump when a change here makes previously cached WSDL objects unusable
+CACHE_VERSION = 1
+
+_clients = {}
+_lock = threading.Lock()
+
+
+class LocalMultiRef(threading.local):
+    """A suds MultiRef per thread. suds keeps one in each binding of the
+    WSDL, which every clone of a client shares, and MultiRef.process()
+    keeps the reply it is working on in the instance, so threads replying
+    at once would otherwise get each other's results."""
+
+    def __init__(self, factory):
+        self.multiref = factory()
+
+    def process(self, body):
+        return self.multiref.process(body)
+
+def thread_safe(client):
+    """Give each of the client's bindings a MultiRef per thread"""
+    from suds.bindings.multiref import MultiRef
+    for service in client.wsdl.services:
+        for port in service.ports:
+            for method in port.methods.values():
+                for binding in (method.binding.input, method.binding.output):
+                    if binding is not None and not isinstance(binding.multiref, LocalMultiRef):
+                        binding.multiref = LocalMultiRef(MultiRef)
+    return client
+
+
+def wsdl_cache(location=None, hours=None):
+    """The on-disk cache of the WSDL and schema documents suds downloads
+    (parsed, but not yet made into WSDL objects, under suds' default
+    caching policy). It is versioned by both this module and suds, so an
+    upgrade never unpickles stale documents.
+    """
+    if location is None:
+        location = CACHE_DIR
+    if hours is None:
+        hours = WSDL_CACHE_HOURS
+    import suds
+    from suds.cache import ObjectCache
+    location = os.path.join(location, 'wsdl-%s-suds-%s' % (CACHE_VERSION, suds.__version__))
+    return ObjectCache(location=location, hours=hours)
+
+def get_client(url, **options):
+    """Return a suds client for "url". The parsed WSDL is loaded once per
+    process (from the disk cache where possible) and every caller gets a
+    cheap clone of it, with its own options and transport.
+    """
+    with _lock:
+        client = _clients.get(url)
+        if client is None:
+            import logging
+            import suds.client
+            #Enable SUDS logger
+            logging.getLogger('suds.client').setLevel(logging.CRITICAL)
+            client = _clients[url] = thread_safe(suds.client.Client(url, cache=wsdl_cache()))
+    client = client.clone()
+    if options:
+        client.set_options(**options)
+    return client
+
+def webfault():
+    """suds.WebFault, for "except webfault() as details:" clauses, which only
+    evaluate it when there is an exception to match"""
+    import suds
+    return suds.WebFault
+
+def cache_ids(url):
+    """The ids suds caches "url" under: its document, and its WSDL objects
+    (which suds only caches under caching policy 1)"""
+    from suds.options import Options
+    from suds.reader import Reader
+    reader = Reader(Options())
+    return [reader.mangle(url, x) for x in ('document', 'wsdl')]
+
+def invalidate(url=None):
+    """Forget the shared client for "url" and purge its cached WSDL, or
+    forget every client and clear the whole cache if no url is given"""
+    cache = wsdl_cache()
+    with _lock:
+        if url is None:
+            _clients.clear()
+            cache.clear()
+        else:
+            _clients.pop(url, None)
+            for id in cache_ids(url):
+                cache.purge(id)
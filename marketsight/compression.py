@@ -0,0 +1,146 @@
+"""Zip writing with a selectable deflate level and an optional parallel
+mode. In parallel mode each file is split into blocks which are deflated
+independently on a process pool; every block but the last ends with a full
+flush, so the blocks join into one ordinary deflate stream (as pigz does)
+and the zip is no different to any other.
+"""
+import itertools
+import os
+import time
+import zipfile
+import zlib
+
+from .config import CHUNK_SIZE, COMPRESSION_LEVEL, COMPRESSION_PROCESSES,\
+                    COMPRESSION_BLOCK_SIZE
+from .metrics import metrics
+
+
+def deflate_block(block):
+    """Deflate one block of a file (run on the process pool)"""
+    filename, offset, size, level, last = block
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        data = f.read(size)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + \
+           compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+
+def file_blocks(filename, size, level, block_size):
+    offsets = range(0, size, block_size) or [0]
+    return [(filename, offset, block_size, level, offset == offsets[-1])
+            for offset in offsets]
+
+def crc32(f, size, crc=0):
+    while size > 0:
+        data = f.read(min(size, CHUNK_SIZE))
+        if not data:
+            break
+        size -= len(data)
+        crc = zlib.crc32(data, crc)
+    return crc
+
+def write_member(zipper, filename, arcname, level=COMPRESSION_LEVEL, pool=None,
+                 block_size=COMPRESSION_BLOCK_SIZE):
+    """Deflate "filename" into the open ZipFile, as ZipFile.write does but
+    at the given level and, with a pool, in parallel"""
+    st = os.stat(filename)
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16L
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.file_size = st.st_size
+    zinfo.header_offset = zipper.fp.tell()
+    zipper._writecheck(zinfo)
+    zipper._didModify = True
+
+    # The CRC and compressed size are rewritten into the header at the end
+    zip64 = zipper._allowZip64 and st.st_size * 1.05 > zipfile.ZIP64_LIMIT
+    zinfo.CRC = zinfo.compress_size = 0
+    zipper.fp.write(zinfo.FileHeader(zip64))
+
+    blocks = file_blocks(filename, st.st_size, level, block_size)
+    if pool is None:
+        deflated = itertools.imap(deflate_block, blocks)
+    else:
+        deflated = pool.imap(deflate_block, blocks)
+    crc = 0
+    with open(filename, 'rb') as f:
+        for block, data in itertools.izip(blocks, deflated):
+            # Checksum each block while the pool deflates the next ones
+            crc = crc32(f, block[2], crc)
+            zinfo.compress_size += len(data)
+            zipper.fp.write(data)
+    zinfo.CRC = crc & 0xffffffff
+
+    position = zipper.fp.tell()
+    zipper.fp.seek(zinfo.header_offset)
+    zipper.fp.write(zinfo.FileHeader(zip64))
+    zipper.fp.seek(position)
+    zipper.filelist.append(zinfo)
+    zipper.NameToInfo[zinfo.filename] = zinfo
+
+def write_chunks(zipper, chunks, arcname, level=COMPRESSION_LEVEL, zip64=False):
+    """Deflate the strings from "chunks" into the open ZipFile as the member
+    "arcname", for data made on the fly rather than read from a file. The
+    size isn't known until the end, so the header only has room for zip64
+    sizes (which data over 4GB needs) when "zip64" is set."""
+    zinfo = zipfile.ZipInfo(arcname, time.localtime()[0:6])
+    zinfo.external_attr = 0600 << 16L
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.header_offset = zipper.fp.tell()
+    zipper._writecheck(zinfo)
+    zipper._didModify = True
+    zinfo.file_size = zinfo.CRC = zinfo.compress_size = 0
+    zipper.fp.write(zinfo.FileHeader(zip64))
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = 0
+    for chunk in chunks:
+        zinfo.file_size += len(chunk)
+        if not zip64 and zinfo.file_size > zipfile.ZIP64_LIMIT:
+            # Rather than once all of it has been read and deflated
+            raise zipfile.LargeZipFile('"%s" is over 4GB, which needs zip64' % arcname)
+        crc = zlib.crc32(chunk, crc)
+        data = compressor.compress(chunk)
+        zinfo.compress_size += len(data)
+        zipper.fp.write(data)
+    data = compressor.flush()
+    zinfo.compress_size += len(data)
+    zipper.fp.write(data)
+    zinfo.CRC = crc & 0xffffffff
+
+    position = zipper.fp.tell()
+    zipper.fp.seek(zinfo.header_offset)
+    zipper.fp.write(zinfo.FileHeader(zip64))
+    zipper.fp.seek(position)
+    zipper.filelist.append(zinfo)
+    zipper.NameToInfo[zinfo.filename] = zinfo
+    return zinfo
+
+def zip_files(files_to_zip, fileobj, level=COMPRESSION_LEVEL, processes=COMPRESSION_PROCESSES,
+              block_size=COMPRESSION_BLOCK_SIZE):
+    """Deflate the (filename, arcname) pairs into a zip written to the
+    (seekable) fileobj. "processes" above 1 deflates in parallel, except in
+    a daemonic process (such as a pool worker), which can't have children."""
+    pool = None
+    if processes > 1:
+        import multiprocessing
+        if not multiprocessing.current_process().daemon:
+            pool = multiprocessing.Pool(processes)
+    start = time.time()
+    offset = fileobj.tell()
+    try:
+        with zipfile.ZipFile(fileobj, mode='w', allowZip64=True) as zipper:
+            for filename, arcname in files_to_zip:
+                write_member(zipper, filename, arcname, level, pool, block_size)
+            size = sum(zinfo.file_size for zinfo in zipper.filelist)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    zipped = fileobj.tell() - offset
+    metrics.observe('zip_seconds', time.time() - start)
+    metrics.count('zip_bytes_in_total', size)
+    metrics.count('zip_bytes_out_total', zipped)
+    if zipped:
+        metrics.observe('compression_ratio', float(size) / zipped)
+    return fileobj
@@ -1,7 +1,108 @@
 import os
+import tempfile
 
 URLS = {
     'user':   os.environ.get('MARKETSIGHT_USER_ENDPOINT', 'https://application.marketsight.com/MarketSightWebServices/DatasetUploadAuthorizationService.asmx?WSDL'),
     'upload': os.environ.get('MARKETSIGHT_UPLOAD_ENDPOINT', 'https://application.marketsight.com/MarketSightWebServices/DatasetUploadService.asmx?WSDL'),
     'reports': os.environ.get('MARKETSIGHT_REVIEW_ENDPOINT', 'https://application.marketsight.com/MktgWorksite/ItemView.aspx'),
 }
+
+# Streaming uploads: bytes read/encoded/sent per chunk, and how large a
+# zipped payload may grow in memory before it is spooled to disk.
+STREAMING = os.environ.get('MARKETSIGHT_STREAMING', '').lower() in ('1', 'true', 'yes')
+CHUNK_SIZE = int(os.environ.get('MARKETSIGHT_CHUNK_SIZE', 1024 * 1024))
+SPOOL_SIZE = int(os.environ.get('MARKETSIGHT_SPOOL_SIZE', 8 * 1024 * 1024))
+
+# Parsed WSDLs are cached on disk here and shared by every process on the host
+CACHE_DIR = os.environ.get('MARKETSIGHT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'marketsight'))
+WSDL_CACHE_HOURS = float(os.environ.get('MARKETSIGHT_WSDL_CACHE_HOURS', 24))
+
+# Authorization keys are shared between Users through this store ("memory",
+# "file[:directory]" or "socket[:path]") and refreshed after KEY_TTL seconds
+KEYSTORE = os.environ.get('MARKETSIGHT_KEYSTORE', 'memory')
+KEY_TTL = float(os.environ.get('MARKETSIGHT_KEY_TTL', 30 * 60))
+
+# zlib level (1-9) for zipped uploads, and how many processes deflate each
+# file in COMPRESSION_BLOCK_SIZE blocks (1 deflates in this process)
+COMPRESSION_LEVEL = int(os.environ.get('MARKETSIGHT_COMPRESSION_LEVEL', 6))
+COMPRESSION_PROCESSES = int(os.environ.get('MARKETSIGHT_COMPRESSION_PROCESSES', 1))
+COMPRESSION_BLOCK_SIZE = int(os.environ.get('MARKETSIGHT_COMPRESSION_BLOCK_SIZE', 4 * 1024 * 1024))
+
+# Worker threads shared by AsyncUser and AsyncDataset, i.e. how many of
+# their SOAP calls can be in flight at once, and a separate pool of upload
+# threads, so that long uploads never hold up the status queries
+ASYNC_WORKERS = int(os.environ.get('MARKETSIGHT_ASYNC_WORKERS', 32))
+ASYNC_UPLOAD_WORKERS = int(os.environ.get('MARKETSIGHT_ASYNC_UPLOAD_WORKERS', 8))
+
+# SOAP calls reuse keep-alive connections from a pool shared by every client:
+# at most POOL_SIZE idle connections per host, each dropped after POOL_IDLE
+# idle seconds. TIMEOUT is the socket timeout in seconds.
+KEEPALIVE = os.environ.get('MARKETSIGHT_KEEPALIVE', '1').lower() in ('1', 'true', 'yes')
+POOL_SIZE = int(os.environ.get('MARKETSIGHT_POOL_SIZE', 10))
+POOL_IDLE = float(os.environ.get('MARKETSIGHT_POOL_IDLE', 60))
+TIMEOUT = float(os.environ.get('MARKETSIGHT_TIMEOUT', 90))
+
+# Dataset status (respondents and last upload) is cached for STATUS_TTL
+# seconds, for at most STATUS_CACHE_SIZE datasets
+STATUS_TTL = float(os.environ.get('MARKETSIGHT_STATUS_TTL', 5 * 60))
+STATUS_CACHE_SIZE = int(os.environ.get('MARKETSIGHT_STATUS_CACHE_SIZE', 10000))
+
+# check_for_missing_variables sends at most VARIABLES_CHUNK_SIZE variables
+# per call, with up to VARIABLES_WORKERS calls at once. Variables found in a
+# dataset are remembered for VARIABLES_TTL seconds, or until an upload
+VARIABLES_CHUNK_SIZE = int(os.environ.get('MARKETSIGHT_VARIABLES_CHUNK_SIZE', 500))
+VARIABLES_WORKERS = int(os.environ.get('MARKETSIGHT_VARIABLES_WORKERS', 4))
+VARIABLES_TTL = float(os.environ.get('MARKETSIGHT_VARIABLES_TTL', 60 * 60))
+
+# Uploads which fail with a transient error (a dropped connection, a
+# timeout, a 5xx reply) are attempted up to RETRY_ATTEMPTS times in all,
+# waiting a random time of up to RETRY_BACKOFF * 2**n seconds (at most
+# RETRY_MAX_BACKOFF) before retry n. Appends are only retried when the
+# connection was refused, as they may have been applied before failing.
+RETRY_ATTEMPTS = int(os.environ.get('MARKETSIGHT_RETRY_ATTEMPTS', 4))
+RETRY_BACKOFF = float(os.environ.get('MARKETSIGHT_RETRY_BACKOFF', 2))
+RETRY_MAX_BACKOFF = float(os.environ.get('MARKETSIGHT_RETRY_MAX_BACKOFF', 60))
+
+# The number of zipped datasets a Pipeline keeps waiting on disk while it
+# uploads another
+PIPELINE_PREFETCH = int(os.environ.get('MARKETSIGHT_PIPELINE_PREFETCH', 2))
+
+# Zipped and encoded payloads (of labels files, and of files sent to many
+# datasets) are kept here, by the digest of their files, so the same files
+# are only zipped once. The least recently used are removed beyond
+# PAYLOAD_CACHE_SIZE bytes; 0 stops labels files being cached.
+PAYLOAD_CACHE_DIR = os.environ.get('MARKETSIGHT_PAYLOAD_CACHE_DIR', os.path.join(CACHE_DIR, 'payloads'))
+PAYLOAD_CACHE_SIZE = int(os.environ.get('MARKETSIGHT_PAYLOAD_CACHE_SIZE', 1024 * 1024 * 1024))
+
+# SPSS data files' headers and dictionaries are checked before they are
+# zipped, so a corrupt or truncated file fails at once
+VALIDATE_SAV = os.environ.get('MARKETSIGHT_VALIDATE_SAV', '1').lower() in ('1', 'true', 'yes')
+
+# SOAP calls wait for one of a limited number of slots, starting with
+# LIMIT_INITIAL. The limit grows by one for every "limit" calls that succeed
+# in their usual time while (nearly) every slot is taken, and is multiplied
+# by LIMIT_BACKOFF (at most once per usual call time) when a call fails
+# transiently or takes LIMIT_TOLERANCE times longer
+# than usual, staying between LIMIT_MIN and LIMIT_MAX. LIMIT=0 turns it off.
+# Uploads have limits of their own, which only back off on errors.
+LIMIT = os.environ.get('MARKETSIGHT_LIMIT', '1').lower() in ('1', 'true', 'yes')
+LIMIT_INITIAL = int(os.environ.get('MARKETSIGHT_LIMIT_INITIAL', 8))
+LIMIT_MIN = int(os.environ.get('MARKETSIGHT_LIMIT_MIN', 1))
+LIMIT_MAX = int(os.environ.get('MARKETSIGHT_LIMIT_MAX', 64))
+LIMIT_BACKOFF = float(os.environ.get('MARKETSIGHT_LIMIT_BACKOFF', 0.7))
+LIMIT_TOLERANCE = float(os.environ.get('MARKETSIGHT_LIMIT_TOLERANCE', 3))
+
+# The small operations (logging in, respondents, last upload, missing
+# variables) are called from envelope templates and their replies read
+# with expat, rather than through suds' marshalling
+FASTPATH = os.environ.get('MARKETSIGHT_FASTPATH', '').lower() in ('1', 'true', 'yes')
+
+# Timings and counters of every call and upload stage are recorded unless
+# METRICS is off, and sent to a StatsD server at STATSD ("host:port") if set
+METRICS = os.environ.get('MARKETSIGHT_METRICS', '1').lower() in ('1', 'true', 'yes')
+STATSD = os.environ.get('MARKETSIGHT_STATSD', '')
+
+# marketsight-daemon serves upload jobs on this Unix socket, running up to
+# DAEMON_WORKERS of them at once
+DAEMON_SOCKET = os.environ.get('MARKETSIGHT_DAEMON_SOCKET', os.path.join(CACHE_DIR, 'daemon.sock'))
+DAEMON_WORKERS = int(os.environ.get('MARKETSIGHT_DAEMON_WORKERS', 4))
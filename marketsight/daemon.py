@@ -0,0 +1,288 @@
+"""A resident upload daemon, so that a cron job doesn't pay for starting
+Python, importing suds, parsing the WSDLs, logging in and connecting
+before every upload. The daemon keeps its Users (and so their keys), its
+Datasets' clients and its connections warm, and runs the jobs submitted to
+it on a local Unix socket, a few at a time, lowest priority number first.
+
+    marketsight-daemon [--socket PATH] [--workers 4]
+    marketsight-submit update details.txt data.sav
+    marketsight-submit append details.txt data.asc meta.sss --priority 1
+    marketsight-submit status details.txt
+
+A details file holds a username, a password and a dataset, one per line,
+as for get_dataset(). Each request is a line of JSON, answered with a line
+of JSON once the job has run. Only the daemon imports suds and parses the
+WSDLs, so submitting a job stays cheap.
+"""
+import Queue
+import SocketServer
+import itertools
+import json
+import optparse
+import os
+import socket
+import sys
+import threading
+import time
+
+from .config import DAEMON_SOCKET, DAEMON_WORKERS, STREAMING
+
+COMMANDS = ('update', 'append', 'status', 'missing')
+DEFAULT_PRIORITY = 10
+
+
+def read_details(details_file):
+    """The (username, password, dataset) in a details file"""
+    with open(details_file, 'r') as f:
+        details = [line.strip() for line in f if line.strip()]
+    if len(details) < 2:
+        raise AttributeError('"%s" needs a username and a password' % details_file)
+    return (details + [None])[:3]
+
+
+class Job(object):
+    """A request waiting for a worker, and then its result"""
+
+    def __init__(self, request):
+        self.request = request
+        self.submitted = time.time()
+        self.result = None
+        self.done = threading.Event()
+
+    def finish(self, **result):
+        result.setdefault('ok', False)
+        result['seconds'] = time.time() - self.submitted
+        self.result = result
+        self.done.set()
+
+
+class DaemonHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                result = dict(ok=False, error='%s' % e)
+            else:
+                result = self.server.handle_request_line(request)
+            self.wfile.write(json.dumps(result) + '\n')
+            self.wfile.flush()
+
+
+class UploadDaemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Runs update, append and status jobs on "workers" threads, each with
+    its own warm Dataset for each user"""
+    daemon_threads = True
+
+    def __init__(self, address=DAEMON_SOCKET, workers=DAEMON_WORKERS, streaming=STREAMING,
+                 manifest=None):
+        if not os.path.isdir(os.path.dirname(address)):
+            os.makedirs(os.path.dirname(address), 0700)
+        if os.path.exists(address):
+            os.remove(address)
+        SocketServer.UnixStreamServer.__init__(self, address, DaemonHandler)
+        os.chmod(address, 0600)
+        self.streaming = streaming
+        self.manifest = manifest
+        self.jobs = Queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.users = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+        self.running = 0
+        self.completed = 0
+        self.workers = [threading.Thread(target=self.work, name='marketsight-daemon-%d' % i)
+                        for i in xrange(max(1, workers))]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+    def handle_request_line(self, request):
+        """Answer "ping" at once, and queue a job until it has run"""
+        command = request.get('command')
+        if command == 'ping':
+            return dict(ok=True, queued=self.jobs.qsize(), running=self.running,
+                        completed=self.completed, users=len(self.users),
+                        uptime=time.time() - self.started)
+        if command not in COMMANDS:
+            return dict(ok=False, error='"%s" is not one of %s' % (command, ', '.join(COMMANDS)))
+        try:
+            priority = int(request.get('priority', DEFAULT_PRIORITY))
+        except (TypeError, ValueError):
+            return dict(ok=False, error='"%s" is not a priority' % request.get('priority'))
+        job = Job(request)
+        self.jobs.put((priority, next(self.sequence), job))
+        job.done.wait()
+        return job.result
+
+    def user(self, username, password):
+        from .methods import User
+        with self.lock:
+            user = self.users.get((username, password))
+            if user is None:
+                user = self.users[(username, password)] = User(username, password,
+                                                               verbose=False)
+            return user
+
+    def dataset(self, username, password):
+        """This worker's Dataset for the user, with a fresh list of messages"""
+        from .methods import Dataset
+        datasets = self.local.__dict__.setdefault('datasets', {})
+        dataset = datasets.get((username, password))
+        if dataset is None:
+            dataset = datasets[(username, password)] = Dataset(
+                self.user(username, password), auto_login=False, streaming=self.streaming,
+                manifest=self.manifest)
+        dataset.messages = []
+        dataset.message = dataset.messages.append
+        return dataset
+
+    def work(self):
+        while True:
+            priority, sequence, job = self.jobs.get()
+            with self.lock:
+                self.running += 1
+            try:
+                job.finish(**self.run(job.request))
+            except Exception as e:
+                job.finish(ok=False, error='%s: %s' % (type(e).__name__, e))
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+
+    def run(self, request):
+        if request.get('details'):
+            username, password, guid = read_details(request['details'])
+        else:
+            username, password, guid = request['username'], request['password'], None
+        guid = request.get('dataset') or guid
+        dataset = self.dataset(username, password)
+        command = request['command']
+        paths = request.get('paths') or []
+        datatype = request.get('datatype', 'spss')
+
+        if command == 'status':
+            respondents = dataset.number_of_respondents(guid)
+            uploaded = dataset.last_uploaded_datetime(guid)
+            return dict(ok=respondents is not None, respondents=respondents,
+                        last_uploaded=uploaded and '%s' % uploaded, messages=dataset.messages)
+        if command == 'missing':
+            missing = dataset.check_for_missing_variables(request.get('variables', ''), guid)
+            return dict(ok=missing is not None, missing=missing, messages=dataset.messages)
+
+        if not paths:
+            raise AttributeError('An %s needs a data file' % command)
+        paths = list(paths) + [None] * (3 - len(paths))
+        if datatype == 'spss':
+            method = dataset.update_spss if command == 'update' else dataset.append_spss
+            ok = method(paths[0], dataset=guid)
+        elif command == 'update':
+            ok = dataset.update_sss(paths[1], paths[0], paths[2], dataset=guid)
+        else:
+            ok = dataset.append_sss(paths[1], paths[0], dataset=guid)
+        return dict(ok=bool(ok), status=dataset.last_status,
+                    error=dataset.last_error and '%s' % dataset.last_error,
+                    messages=dataset.messages)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+
+def submit(request, address=DAEMON_SOCKET):
+    """Send a request to the daemon and return its result, once the job
+    has run"""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(address)
+        client.sendall(json.dumps(request) + '\n')
+        return json.loads(client.makefile('rb').readline())
+    finally:
+        client.close()
+
+
+def main(argv=None):
+    """Run the daemon"""
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--socket', default=DAEMON_SOCKET)
+    parser.add_option('--workers', type='int', default=DAEMON_WORKERS,
+                      help='jobs run at once')
+    parser.add_option('--streaming', action='store_true', default=STREAMING)
+    parser.add_option('--manifest', help='skip updates of files unchanged since, '
+                                         'as recorded in this file')
+    parser.add_option('--metrics-port', type='int',
+                      help='serve the metrics for Prometheus on this port')
+    options, args = parser.parse_args(argv)
+
+    daemon = UploadDaemon(options.socket, options.workers, options.streaming, options.manifest)
+    # Parse the WSDLs now, rather than in the first job
+    from .clients import get_client
+    from .methods import Dataset, User
+    for url in (User.url(), Dataset.url()):
+        get_client(url)
+    if options.metrics_port:
+        from .metrics import serve_prometheus
+        serve_prometheus(options.metrics_port)
+    print('Serving uploads on %s with %d workers' % (options.socket, len(daemon.workers)))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
+
+
+def submit_main(argv=None):
+    """Submit a job to the daemon, wait for it and print its result"""
+    parser = optparse.OptionParser(
+        usage='%prog [options] update|append|status|missing DETAILS_FILE [DATA [METADATA '
+              '[LABELS]]]\n\nFor "missing", the files are the variables to check.')
+    parser.add_option('--socket', default=DAEMON_SOCKET)
+    parser.add_option('--dataset', help='the dataset, if not the details file\'s')
+    parser.add_option('--datatype', choices=('spss', 'sss'),
+                      help='spss or sss (by default, sss for .asc and .csv data)')
+    parser.add_option('--priority', type='int', default=DEFAULT_PRIORITY,
+                      help='lower numbers run first (default %d)' % DEFAULT_PRIORITY)
+    parser.add_option('--json', action='store_true', default=False,
+                      help='print the whole result as JSON')
+    options, args = parser.parse_args(argv)
+    if len(args) < 2 or args[0] not in COMMANDS:
+        parser.error('a command (%s) and a details file are required' % ', '.join(COMMANDS))
+
+    command, details, files = args[0], os.path.abspath(args[1]), args[2:]
+    request = dict(command=command, details=details, dataset=options.dataset,
+                   priority=options.priority)
+    if command == 'missing':
+        request['variables'] = ','.join(files)
+    else:
+        request['paths'] = [os.path.abspath(path) for path in files]
+        datatype = options.datatype
+        if datatype is None and files:
+            extension = os.path.splitext(files[0])[1].lower()
+            datatype = 'sss' if extension in ('.asc', '.csv') else 'spss'
+        request['datatype'] = datatype or 'spss'
+    try:
+        result = submit(request, options.socket)
+    except socket.error as e:
+        sys.stderr.write('The daemon is not running on %s (%s)\n' % (options.socket, e))
+        return 2
+
+    if options.json:
+        print(json.dumps(result, indent=1, sort_keys=True))
+    else:
+        for message in result.get('messages', []):
+            print(message)
+        for name in ('status', 'respondents', 'last_uploaded', 'missing', 'error'):
+            if result.get(name) is not None:
+                print('%s: %s' % (name, result[name]))
+    return 0 if result.get('ok') else 1
+
+
+if __name__ == '__main__':
+    main()
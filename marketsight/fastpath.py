@@ -0,0 +1,202 @@
+"""Raw SOAP calls for the small operations (a key, a count, a date), which
+would otherwise spend most of their CPU time building suds objects for the
+request and parsing the reply into them.
+
+The envelope of each operation is made once by suds itself, from the WSDL,
+with a marker in place of each argument, and split into a template. A call
+fills the template in, sends it over the pooled transport and reads the
+result (or fault) from the reply with expat, converting it as suds would
+for its schema type. Errors are raised as suds raises them: a WebFault for
+a fault, and Exception((status, reason)) for other HTTP errors.
+
+Only used when MARKETSIGHT_FASTPATH is on. benchmarks/fastpath.py checks
+that both paths give the same results.
+"""
+import threading
+from xml.parsers import expat
+
+from .clients import get_client
+
+# The operations with a fast path, when the WSDL gives them a simple result
+OPERATIONS = ('GetAuthorizationKey', 'GetNumberOfRespondents',
+              'GetLastUploadedDateTimeByGuid', 'CheckForMissingVariables')
+
+XSI = 'http://www.w3.org/2001/XMLSchema-instance'
+MARKER = '\0marketsight-argument-%d\0'
+
+# How suds' builtin types translate the text of a result
+CONVERTERS = {
+    'string': unicode,
+    'int': int,
+    'short': int,
+    'byte': int,
+    'long': long,
+    'integer': long,
+    'boolean': lambda text: text.lower() in ('1', 'true'),
+}
+
+_methods = {}
+_lock = threading.Lock()
+
+
+class Fault(object):
+    """The fault of a WebFault, as suds would give it"""
+
+    def __init__(self, faultcode=None, faultstring=None, detail=None):
+        self.faultcode = faultcode
+        self.faultstring = faultstring
+        self.detail = detail
+
+    def __repr__(self):
+        return '<Fault(%r, %r)>' % (self.faultcode, self.faultstring)
+
+
+class ReplyParser(object):
+    """Reads the text of the element "result" (by local name), and the
+    code and string of any SOAP fault, from a reply"""
+
+    def __init__(self, result):
+        self.result = result
+        self.text = None
+        self.nil = False
+        self.fault = None
+        self.field = None
+        self.parts = []
+
+    def start(self, name, attributes):
+        name = name.rsplit(' ', 1)[-1]
+        if name == self.result:
+            self.field = name
+            self.parts = []
+            self.nil = attributes.get('%s nil' % XSI) in ('true', '1')
+        elif name == 'Fault':
+            self.fault = Fault()
+        elif self.fault is not None and name in ('faultcode', 'faultstring'):
+            self.field = name
+            self.parts = []
+
+    def end(self, name):
+        if self.field is not None and name.rsplit(' ', 1)[-1] == self.field:
+            text = u''.join(self.parts) if self.parts else None
+            if self.field == self.result:
+                self.text = text
+            else:
+                setattr(self.fault, self.field, text)
+            self.field = None
+
+    def characters(self, data):
+        if self.field is not None:
+            self.parts.append(data)
+
+    def parse(self, reply):
+        parser = expat.ParserCreate(namespace_separator=' ')
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.characters
+        parser.buffer_text = True
+        parser.Parse(reply, True)
+        return self
+
+
+class FastMethod(object):
+    """A SOAP operation called from a template of its envelope"""
+
+    def __init__(self, client, name):
+        from suds.sax.enc import Encoder
+        method = client.wsdl.services[0].ports[0].methods[name]
+        self.name = self.__name__ = name
+        self.location = method.location
+        self.headers = {'Content-Type': 'text/xml; charset=utf-8',
+                        'SOAPAction': method.soap.action}
+        self.parameters = [parameter[0] for parameter in method.binding.input.param_defs(method)]
+        envelope = method.binding.input.get_message(
+            method, (), dict((parameter, MARKER % index)
+                             for index, parameter in enumerate(self.parameters)))
+        envelope = envelope.plain().encode('utf-8')
+        self.template = []
+        for index in xrange(len(self.parameters)):
+            before, envelope = envelope.split(MARKER % index, 1)
+            self.template.append(before)
+        self.template.append(envelope)
+
+        returned, = method.binding.output.returned_types(method)
+        self.result = returned.name
+        self.convert = CONVERTERS[returned.resolve().name]
+        self.encoder = Encoder()
+        self.suds_method = getattr(client.service, name)
+
+    def envelope(self, kwargs):
+        parts = [self.template[0]]
+        for parameter, after in zip(self.parameters, self.template[1:]):
+            value = kwargs[parameter]
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            else:
+                value = '%s' % value
+            # Escaped just as suds escapes it
+            parts.append(self.encoder.encode(value))
+            parts.append(after)
+        return ''.join(parts)
+
+    def parse(self, reply):
+        """The result of a reply, or a WebFault raised for its fault"""
+        parsed = ReplyParser(self.result).parse(reply)
+        if parsed.fault is not None:
+            import suds
+            raise suds.WebFault(parsed.fault, reply)
+        if parsed.nil or parsed.text is None:
+            return None
+        if self.convert is unicode:
+            from suds.sax.text import Text
+            return Text(parsed.text)
+        return self.convert(parsed.text)
+
+    def __call__(self, **kwargs):
+        if set(kwargs) != set(self.parameters) or None in kwargs.values():
+            # suds leaves out (or nils) missing arguments
+            return self.suds_method(**kwargs)
+        from suds.transport import Request, TransportError
+        request = Request(self.location, self.envelope(kwargs))
+        request.headers = self.headers
+        try:
+            reply = transport().send(request)
+        except TransportError as error:
+            if error.httpcode in (202, 204):
+                return None
+            if error.httpcode == 500:
+                body = error.fp.read()
+                return self.parse(body) if body else (500, None)
+            raise Exception((error.httpcode, '%s' % error))
+        if reply is None or not reply.message:
+            return None
+        return self.parse(reply.message)
+
+    def __repr__(self):
+        return '<FastMethod(%r)>' % self.name
+
+
+_transport = None
+
+def transport():
+    """A pooled transport shared by every FastMethod"""
+    global _transport
+    if _transport is None:
+        from .transport import ConnectionPool, PooledHttpTransport, default_transport
+        _transport = default_transport() or PooledHttpTransport(ConnectionPool(size=0))
+    return _transport
+
+def fast_method(url, name):
+    """The FastMethod for an operation of the service at "url", made once
+    per process, or None if it has no fast path"""
+    key = (url, name)
+    with _lock:
+        if key not in _methods:
+            method = None
+            if name in OPERATIONS:
+                try:
+                    method = FastMethod(get_client(url), name)
+                except (KeyError, ValueError):
+                    # Not in the WSDL, or not a simple result
+                    pass
+            _methods[key] = method
+        return _methods[key]
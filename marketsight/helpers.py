@@ -2,35 +2,179 @@ import os
 import zipfile
 import StringIO
 import base64
+import contextlib
+import hashlib
+import mmap
+import shutil
+import tempfile
 
+from .compression import zip_files
+from .config import CHUNK_SIZE, SPOOL_SIZE, COMPRESSION_LEVEL, COMPRESSION_PROCESSES,\
+                    VALIDATE_SAV
+from .spss import read_header
 
-def files_to_zipped_data(filenames):
+
+@contextlib.contextmanager
+def file_lock(filename):
+    """Hold an exclusive flock on "filename" (created if need be), which
+    serialises access between threads and processes on the same host"""
+    import fcntl
+    fd = os.open(filename, os.O_CREAT | os.O_RDWR, 0600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def files_digest(filenames, chunk_size=CHUNK_SIZE):
+    """A sha1 of the names, sizes and contents of the files, read a chunk
+    at a time so that large files are never held in memory"""
+    digest = hashlib.sha1()
+    for filename in filenames:
+        digest.update('%s\0%d\0' % (os.path.basename(filename), os.path.getsize(filename)))
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), ''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def copy_rows(filename, outfile, skip=0):
+    """Copy the (non-blank) rows of a text data file after the first "skip"
+    to "outfile", a line at a time, and return the total number of rows"""
+    rows = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rows += 1
+            if rows > skip:
+                outfile.write(line)
+    return rows
+
+def map_file(filename):
+    """A read-only mmap of the file: reads come from the page cache rather
+    than a copy of the file on the heap, and it can be read like a file"""
+    with open(filename, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def zip_members(filenames):
     files_to_zip = []
 
     for filename in filenames:
         full_filename = os.path.realpath(filename)
         filepath, short_filename = os.path.split(full_filename)
         files_to_zip.append((full_filename, short_filename))
+    return files_to_zip
 
+def files_to_zipped_data(filenames, level=COMPRESSION_LEVEL, processes=COMPRESSION_PROCESSES):
     datafile_zipped = StringIO.StringIO()
-    with zipfile.ZipFile(datafile_zipped, mode='w') as zipper:
-        for f,fn in files_to_zip:
-            zipper.write(f, arcname=fn, compress_type=zipfile.ZIP_DEFLATED)
+    zip_files(zip_members(filenames), datafile_zipped, level, processes)
     data = datafile_zipped.getvalue()
     datafile_zipped.close()
 
     return data
 
+def files_to_zipped_file(filenames, fileobj=None, level=COMPRESSION_LEVEL,
+                         processes=COMPRESSION_PROCESSES):
+    """Zip the files into "fileobj" (by default a spooled temporary file),
+    which is returned rewound to the start. Files are deflated a block at a
+    time, so memory is bounded by SPOOL_SIZE and not the data size.
+    """
+    if fileobj is None:
+        fileobj = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    zip_files(zip_members(filenames), fileobj, level, processes)
+    fileobj.seek(0)
+    return fileobj
+
 def files_to_zipped_base64(filenames):
     data = files_to_zipped_data(filenames)
     return base64.b64encode(data)
 
-def datafile_to_base64(datafile_paths, datatype='spss', save_as=None):
+def base64_chunks(fileobj, chunk_size=CHUNK_SIZE):
+    """Yield the base64 encoding of "fileobj" a chunk at a time. Reading in
+    multiples of 3 bytes means the encoded chunks join without padding."""
+    chunk_size = max(3, chunk_size - chunk_size % 3)
+    fileobj.seek(0)
+    while True:
+        data = fileobj.read(chunk_size)
+        if not data:
+            break
+        yield base64.b64encode(data)
+
+
+class Payload(object):
+    """A zipped payload held in a (spooled) file and base64 encoded on
+    demand, so it never has to be held in memory as a whole"""
+
+    def __init__(self, fileobj, chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+
+    @property
+    def size(self):
+        self.fileobj.seek(0, os.SEEK_END)
+        return self.fileobj.tell()
+
+    @property
+    def b64size(self):
+        return 4 * ((self.size + 2) // 3)
+
+    def b64chunks(self):
+        return base64_chunks(self.fileobj, self.chunk_size)
+
+    def b64encode(self):
+        return ''.join(self.b64chunks())
+
+    def save_as(self, filename):
+        self.fileobj.seek(0)
+        with open(filename, 'wb') as outfile:
+            shutil.copyfileobj(self.fileobj, outfile, self.chunk_size)
+
+    def close(self):
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class EncodedPayload(Payload):
+    """A payload whose file holds the base64 encoding of the zip, so it is
+    sent as it is, without being encoded again"""
+
+    @property
+    def b64size(self):
+        return Payload.size.fget(self)
+
+    @property
+    def size(self):
+        """The size of the zip itself"""
+        b64size = self.b64size
+        self.fileobj.seek(max(0, b64size - 2))
+        return 3 * b64size // 4 - self.fileobj.read(2).count('=')
+
+    def b64chunks(self):
+        self.fileobj.seek(0)
+        return iter(lambda: self.fileobj.read(self.chunk_size), '')
+
+    def save_as(self, filename):
+        # Decoding 4 characters at a time keeps the chunks aligned
+        chunk_size = max(4, self.chunk_size - self.chunk_size % 4)
+        self.fileobj.seek(0)
+        with open(filename, 'wb') as outfile:
+            for chunk in iter(lambda: self.fileobj.read(chunk_size), ''):
+                outfile.write(base64.b64decode(chunk))
+
+
+def datafile_members(datafile_paths, datatype='spss'):
+    """Validate the data (and metadata) files for the given data type and
+    return the files to zip, or the path of an already zipped file."""
     if isinstance(datafile_paths, basestring):
         datafile_paths = [datafile_paths,None]
     datafile_path, metadatafile_path = datafile_paths
     datatypes = {
-        'spss': {'data':('.sav',)}, 
+        'spss': {'data':('.sav',)},
         'sss': {'metadata':'.sss', 'data':('.asc','.csv')},
         }
 
@@ -47,6 +191,8 @@ def datafile_to_base64(datafile_paths, datatype='spss', save_as=None):
         raise AttributeError('The %s data file must have the extension "%s".' \
                              % (datatype_key, ' or '.join(datatype['data'])))
     files_to_send_to_zip = [datafile]
+    if datatype_key == 'SPSS' and not is_already_zip and VALIDATE_SAV:
+        read_header(datafile)
 
     if datatype.get('metadata'):
         if metadatafile_path:
@@ -66,19 +212,55 @@ def datafile_to_base64(datafile_paths, datatype='spss', save_as=None):
                                      % (datatype_key, datatype['metadata']))
 
     if is_already_zip:
+        # Opening the zip reads only its central directory, not its members
         with zipfile.ZipFile(datafile, mode='r') as datafile_zipped:
             files_in_zip = [os.path.splitext(f)[1].lower() for f in datafile_zipped.namelist()]
-            if not set(datatype.values()) == set(files_in_zip):
-                raise TypeError('An %s ZIP file only allows one %s file.' % (datatype_key, ' and '.join(datatype.values())))
+        expected = [' or '.join(datatype['data'])]
+        data_files = [ext for ext in files_in_zip if ext in datatype['data']]
+        metadata_files = []
+        if datatype.get('metadata'):
+            expected.append(datatype['metadata'])
+            metadata_files = [ext for ext in files_in_zip if ext == datatype['metadata']]
+        if len(data_files) != 1 or len(metadata_files) != len(expected) - 1 or \
+           len(files_in_zip) != len(expected):
+            raise TypeError('An %s ZIP file only allows one %s file.' % (datatype_key, ' and '.join(expected)))
 
-        with open(datafile,'rb') as f:
-            f.seek(0)
-            data = f.read()
-    else:
-        data = files_to_zipped_data(files_to_send_to_zip)
+    return files_to_send_to_zip, is_already_zip
+
+def datafile_to_base64(datafile_paths, datatype='spss', save_as=None):
+    files_to_send_to_zip, is_already_zip = datafile_members(datafile_paths, datatype)
+
+    if is_already_zip:
+        if save_as:
+            shutil.copyfile(files_to_send_to_zip[0], save_as)
+        data = map_file(files_to_send_to_zip[0])
+        try:
+            return base64.b64encode(data)
+        finally:
+            data.close()
+
+    data = files_to_zipped_data(files_to_send_to_zip)
 
     if save_as:
         with open(save_as, 'wb') as outfile:
             outfile.write(data)
 
     return base64.b64encode(data)
+
+def datafile_to_payload(datafile_paths, datatype='spss', save_as=None, chunk_size=CHUNK_SIZE):
+    """As datafile_to_base64, but returns a streaming Payload"""
+    files_to_send_to_zip, is_already_zip = datafile_members(datafile_paths, datatype)
+
+    if is_already_zip:
+        if save_as:
+            shutil.copyfile(files_to_send_to_zip[0], save_as)
+        return Payload(map_file(files_to_send_to_zip[0]), chunk_size)
+
+    payload = Payload(files_to_zipped_file(files_to_send_to_zip), chunk_size)
+    if save_as:
+        payload.save_as(save_as)
+
+    return payload
+
+def files_to_payload(filenames, chunk_size=CHUNK_SIZE):
+    return Payload(files_to_zipped_file(filenames), chunk_size)
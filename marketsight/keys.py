@@ -0,0 +1,234 @@
+"""Authorization key stores, so that every User (and every process) logged
+in with the same credentials shares one key until it expires.
+
+    MemoryKeyStore()            - shared by the Users in one process
+    FileKeyStore(location)      - shared by the processes on one host
+    SocketKeyStore(address)     - shared through a KeyStoreServer daemon,
+                                  started with "python -m marketsight.keys"
+"""
+import errno
+import hashlib
+import json
+import os
+import socket
+import SocketServer
+import threading
+import time
+
+from .config import CACHE_DIR, KEY_TTL, KEYSTORE
+from .helpers import file_lock
+
+
+class KeyStore(object):
+    """Keys stored by name with an expiry time"""
+
+    def get(self, name):
+        raise NotImplementedError
+
+    def set(self, name, key, ttl=KEY_TTL):
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def fetch(self, name, factory, ttl=KEY_TTL):
+        """Return the stored key for "name", or store and return a new one
+        from "factory" if there isn't a live one"""
+        key = self.get(name)
+        if key is None:
+            key = factory()
+            self.set(name, key, ttl)
+        return key
+
+
+class MemoryKeyStore(KeyStore):
+
+    def __init__(self):
+        self.keys = {}
+        self.lock = threading.Lock()
+        # A lock per name, held while its key is fetched
+        self.fetching = {}
+
+    def get(self, name):
+        with self.lock:
+            key, expires = self.keys.get(name, (None, 0))
+            if expires <= time.time():
+                self.keys.pop(name, None)
+                return None
+            return key
+
+    def set(self, name, key, ttl=KEY_TTL):
+        with self.lock:
+            self.keys[name] = (key, time.time() + ttl)
+
+    def delete(self, name):
+        with self.lock:
+            self.keys.pop(name, None)
+
+    def fetch(self, name, factory, ttl=KEY_TTL):
+        # Concurrent Users with the same name log in only once, and Users
+        # with other names don't wait for them
+        with self.lock:
+            lock = self.fetching.setdefault(name, threading.RLock())
+        with lock:
+            return KeyStore.fetch(self, name, factory, ttl)
+
+
+class FileKeyStore(KeyStore):
+    """One file per name, readable only by the owner, guarded by an flock
+    so processes on the same host never log in for the same user at once"""
+
+    def __init__(self, location=None):
+        if location is None:
+            location = os.path.join(CACHE_DIR, 'keys')
+        self.location = location
+        try:
+            os.makedirs(self.location, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def filename(self, name):
+        return os.path.join(self.location, hashlib.sha1(name).hexdigest())
+
+    def locked(self, name):
+        return file_lock(self.filename(name) + '.lock')
+
+    def read(self, name):
+        try:
+            with open(self.filename(name), 'rb') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if entry.get('expires', 0) <= time.time():
+            return None
+        return entry.get('key')
+
+    def write(self, name, key, ttl):
+        filename = self.filename(name)
+        fd = os.open(filename + '.tmp', os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'wb') as f:
+            json.dump({'key': key, 'expires': time.time() + ttl}, f)
+        os.rename(filename + '.tmp', filename)
+
+    def get(self, name):
+        with self.locked(name):
+            return self.read(name)
+
+    def set(self, name, key, ttl=KEY_TTL):
+        with self.locked(name):
+            self.write(name, key, ttl)
+
+    def delete(self, name):
+        with self.locked(name):
+            try:
+                os.remove(self.filename(name))
+            except OSError:
+                pass
+
+    def fetch(self, name, factory, ttl=KEY_TTL):
+        with self.locked(name):
+            key = self.read(name)
+            if key is None:
+                key = factory()
+                self.write(name, key, ttl)
+            return key
+
+
+class SocketKeyStore(KeyStore):
+    """A client of a KeyStoreServer listening on a local Unix socket"""
+
+    def __init__(self, address=None):
+        if address is None:
+            address = os.path.join(CACHE_DIR, 'keys.sock')
+        self.address = address
+
+    def request(self, **command):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(self.address)
+            client.sendall(json.dumps(command) + '\n')
+            return json.loads(client.makefile('rb').readline())
+        finally:
+            client.close()
+
+    def get(self, name):
+        return self.request(command='get', name=name)
+
+    def set(self, name, key, ttl=KEY_TTL):
+        self.request(command='set', name=name, key=key, ttl=ttl)
+
+    def delete(self, name):
+        try:
+            self.request(command='delete', name=name)
+        except socket.error:
+            pass
+
+    def fetch(self, name, factory, ttl=KEY_TTL):
+        # With the daemon down (or its socket stale) every key is a miss,
+        # and Users log in as if there were no store at all
+        try:
+            key = self.get(name)
+        except socket.error:
+            return factory()
+        if key is None:
+            key = factory()
+            try:
+                self.set(name, key, ttl)
+            except socket.error:
+                pass
+        return key
+
+
+class KeyStoreHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            command = json.loads(line)
+            store = self.server.store
+            if command['command'] == 'get':
+                result = store.get(command['name'])
+            elif command['command'] == 'set':
+                result = store.set(command['name'], command['key'], command['ttl'])
+            else:
+                result = store.delete(command['name'])
+            self.wfile.write(json.dumps(result) + '\n')
+
+
+class KeyStoreServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, address=None, store=None):
+        if address is None:
+            address = os.path.join(CACHE_DIR, 'keys.sock')
+        if not os.path.isdir(os.path.dirname(address)):
+            os.makedirs(os.path.dirname(address), 0700)
+        if os.path.exists(address):
+            os.remove(address)
+        SocketServer.UnixStreamServer.__init__(self, address, KeyStoreHandler)
+        os.chmod(address, 0600)
+        self.store = store if store is not None else MemoryKeyStore()
+
+
+_default = None
+
+def default_keystore():
+    """The keystore configured by MARKETSIGHT_KEYSTORE: "memory" (the
+    default), "file[:directory]" or "socket[:path]"."""
+    global _default
+    if _default is None:
+        kind, _, location = KEYSTORE.partition(':')
+        if kind == 'file':
+            _default = FileKeyStore(location or None)
+        elif kind == 'socket':
+            _default = SocketKeyStore(location or None)
+        else:
+            _default = MemoryKeyStore()
+    return _default
+
+
+if __name__ == '__main__':
+    import sys
+    server = KeyStoreServer(sys.argv[1] if len(sys.argv) > 1 else None)
+    print('Serving keys on %s' % server.server_address)
+    server.serve_forever()
@@ -0,0 +1,143 @@
+"""Adaptive concurrency control of SOAP calls. Every call made by User and
+Dataset waits for a slot from a process-wide Limiter, whose limit is found
+by AIMD (additive increase, multiplicative decrease):
+
+    each call that succeeds in its usual time,
+    having taken one of the last slots           limit += 1 / limit
+    a transient error (see retry.classify)       limit *= backoff
+    a call slower than "tolerance" times its
+    operation's usual time                       limit *= backoff
+
+so concurrency grows while the service keeps up with all the calls the
+limit allows, and backs off when it starts faulting or slowing down. Calls
+made well under the limit don't raise it, so light traffic doesn't leave
+it too high to hold back a later burst. The limit is kept between min_limit and
+max_limit, and only decreased once per usual call time, so a burst of
+failures from calls made at the same limit counts once. The limit, the
+calls in flight and the calls queued for a slot are recorded as metrics.
+
+Uploads take as long as their data does, so they have a limiter of their
+own ("upload_limiter"), which only backs off on errors: a large upload is
+not taken for congestion, and an upload holding every slot doesn't hold up
+logging in or the status calls, which use "limiter".
+"""
+import contextlib
+import threading
+import time
+
+from .config import LIMIT, LIMIT_INITIAL, LIMIT_MIN, LIMIT_MAX, LIMIT_BACKOFF, LIMIT_TOLERANCE
+from .metrics import metrics, operation_name
+
+# Weight of each new latency in an operation's usual (average) latency
+SMOOTHING = 0.05
+# Calls of an operation needed before its latency is judged
+WARMUP = 10
+# The operations which send a dataset's data
+UPLOADS = ('Update', 'Append')
+# A call taking a slot with no more than this many others free may raise
+# the limit
+HEADROOM = 1
+
+
+class Limiter(object):
+
+    def __init__(self, initial=LIMIT_INITIAL, min_limit=LIMIT_MIN, max_limit=LIMIT_MAX,
+                 backoff=LIMIT_BACKOFF, tolerance=LIMIT_TOLERANCE, enabled=LIMIT,
+                 clock=time.time, name='calls', latency=True):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.enabled = enabled
+        self.clock = clock
+        self.name = name
+        # Whether slow calls count as congestion, as well as errors
+        self.latency = latency
+        self.in_flight = 0
+        self.queued = 0
+        # operation: (calls, usual latency)
+        self.latencies = {}
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def record(self):
+        metrics.gauge('concurrency_limit', self.limit, limiter=self.name)
+        metrics.gauge('concurrency_in_flight', self.in_flight, limiter=self.name)
+        metrics.gauge('concurrency_queued', self.queued, limiter=self.name)
+
+    def acquire(self):
+        """Take a slot, waiting for one if need be, and return whether it
+        was one of the last (so that the limit is in use)"""
+        with self.condition:
+            self.queued += 1
+            self.record()
+            try:
+                while self.in_flight >= int(self.limit):
+                    self.condition.wait()
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+            self.record()
+            return self.in_flight + HEADROOM >= int(self.limit)
+
+    def release(self, operation, latency, failed=False, saturated=False):
+        """Free a slot, and adjust the limit for how the call went.
+        "saturated" is what acquire() returned."""
+        with self.condition:
+            self.in_flight -= 1
+            calls, usual = self.latencies.get(operation, (0, latency))
+            if failed:
+                self.decrease('error', usual)
+            elif self.latency and calls >= WARMUP and latency > self.tolerance * usual:
+                self.decrease('latency', usual)
+            elif saturated:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            if not failed:
+                usual += SMOOTHING * (latency - usual)
+                self.latencies[operation] = (calls + 1, usual)
+            self.record()
+            self.condition.notify_all()
+
+    def decrease(self, reason, usual):
+        now = self.clock()
+        if now - self.last_decrease < usual:
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        metrics.count('limit_decreases_total', limiter=self.name, reason=reason)
+
+    @contextlib.contextmanager
+    def slot(self, operation):
+        """Hold a slot for the block, which is one call of "operation" """
+        if not self.enabled:
+            yield
+            return
+        saturated = self.acquire()
+        start = self.clock()
+        failed = False
+        try:
+            yield
+        except Exception as error:
+            from .retry import classify, TRANSIENT
+            failed = classify(error) == TRANSIENT
+            raise
+        finally:
+            self.release(operation, self.clock() - start, failed, saturated)
+
+    def call(self, method, **kwargs):
+        """Call a SOAP method (through metrics.call) once a slot is free"""
+        with self.slot(operation_name(method)):
+            return metrics.call(method, **kwargs)
+
+
+limiter = Limiter()
+upload_limiter = Limiter(name='uploads', latency=False)
+
+
+def limiter_for(operation):
+    return upload_limiter if operation.startswith(UPLOADS) else limiter
+
+def limited_call(method, **kwargs):
+    """Call a SOAP method once its limiter has a slot free"""
+    return limiter_for(operation_name(method)).call(method, **kwargs)
@@ -0,0 +1,81 @@
+"""A local record of what was last uploaded to each dataset: the digest of
+the files, so that an update with unchanged files can be skipped before
+anything is zipped or sent, and the number of rows, so that an incremental
+append only sends the rows added since. Both are kept with the dataset's
+last uploaded datetime, and are only trusted while it is unchanged (no one
+has uploaded to the dataset from the web, say, or another host).
+"""
+import json
+import os
+
+from .config import CACHE_DIR
+from .helpers import file_lock
+
+
+class Manifest(object):
+    """A JSON file of {dataset: entry}, read and rewritten under a file lock
+    so that several processes can share it"""
+
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = os.path.join(CACHE_DIR, 'manifest.json')
+        self.filename = filename
+        if not os.path.isdir(os.path.dirname(self.filename)):
+            os.makedirs(os.path.dirname(self.filename))
+
+    def locked(self):
+        return file_lock(self.filename + '.lock')
+
+    def read(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def write(self, entries):
+        with open(self.filename + '.tmp', 'wb') as f:
+            json.dump(entries, f, indent=1, sort_keys=True)
+        os.rename(self.filename + '.tmp', self.filename)
+
+    def get(self, dataset):
+        with self.locked():
+            return self.read().get(dataset)
+
+    def update(self, dataset, **entry):
+        """Merge "entry" into the dataset's entry"""
+        with self.locked():
+            entries = self.read()
+            entries.setdefault(dataset, {}).update(entry)
+            self.write(entries)
+
+    def forget(self, dataset):
+        with self.locked():
+            entries = self.read()
+            if entries.pop(dataset, None) is not None:
+                self.write(entries)
+
+    def unchanged(self, dataset, digest, uploaded):
+        """True if "digest" is what was last uploaded to the dataset, and
+        nothing has been uploaded to it since (from the web, say, or another
+        host). "uploaded" is the dataset's last uploaded datetime, or a
+        function to fetch it, only called if the digest matches."""
+        entry = self.get(dataset) or {}
+        if entry.get('digest') is None or entry.get('digest') != digest:
+            return False
+        if callable(uploaded):
+            uploaded = uploaded()
+        return uploaded is not None and entry.get('uploaded') == '%s' % uploaded
+
+    def rows(self, dataset, uploaded):
+        """The number of rows in the dataset after the last incremental
+        append, or None if nothing was recorded or it has been uploaded to
+        since. "uploaded" is as for unchanged()."""
+        entry = self.get(dataset) or {}
+        if entry.get('rows') is None:
+            return None
+        if callable(uploaded):
+            uploaded = uploaded()
+        if uploaded is None or entry.get('uploaded') != '%s' % uploaded:
+            return None
+        return entry['rows']
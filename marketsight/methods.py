@@ -1,20 +1,26 @@
 import base64
 import datetime
-import logging
+import hashlib
 import os.path
+import re
+import shutil
+import tempfile
 import urllib
 import urlparse
 import uuid
 from collections import OrderedDict
 
-import suds.client
+from .cache import invalidate, variables_cache
+from .clients import get_client, webfault
+from .config import URLS, STREAMING, VARIABLES_CHUNK_SIZE, VARIABLES_WORKERS, FASTPATH
+from .helpers import datafile_to_base64, files_to_zipped_base64,\
+                     datafile_to_payload, files_to_payload, Payload, files_digest,\
+                     copy_rows
+from .limiter import limited_call
+from .manifest import Manifest
+from .metrics import metrics
+from .retry import Retrying
 
-from .config import URLS
-from .helpers import datafile_to_base64, files_to_zipped_base64
-
-#Enable SUDS logger
-logging.getLogger('suds.client').setLevel(logging.CRITICAL)
-
 class MarketsightError(Exception): pass
 class MarketsightAuthError(MarketsightError): pass
 
@@ -32,14 +38,35 @@ class MethodMixin(object):
 
     @classmethod
     def parse_datetime(cls, dt_string):
+        # strptime's own first import of _strptime isn't thread-safe
+        import _strptime
         return datetime.datetime.strptime(dt_string, '%m/%d/%Y %I:%M:%S %p')
 
+    @classmethod
+    def new_client(cls, streaming=False):
+        """A client of the service with a transport of its own"""
+        from .transport import default_transport
+        transport = default_transport(streaming)
+        if transport is not None:
+            return get_client(cls.url(), transport=transport)
+        return get_client(cls.url())
+
     @property
     def client(self):
         if not hasattr(self, '_client'):
-            self._client = suds.client.Client(self.url())
+            self._client = self.new_client(getattr(self, 'streaming', False))
         return self._client
 
+    def method(self, name, client=None):
+        """The SOAP method "name": its fastpath.FastMethod if it has one and
+        FASTPATH is on, or else the suds client's"""
+        if FASTPATH:
+            from .fastpath import fast_method
+            method = fast_method(self.url(), name)
+            if method is not None:
+                return method
+        return getattr((client or self.client).service, name)
+
     def message(self, message):
         print(message)
 
@@ -54,33 +81,45 @@ class User(MethodMixin):
         'not fall into any known category.'
     }
 
-    def __init__(self, username, password, verbose=True):
+    def __init__(self, username, password, verbose=True, keystore=None):
         self.__username = username
         self.__password = password
         self.verbose = verbose
+        if keystore is None:
+            from .keys import default_keystore
+            keystore = default_keystore()
+        self.keystore = keystore
 
     def message(self, message):
         if self.verbose:
             print(message)
 
+    @property
+    def keystore_name(self):
+        """Keys are stored by username, but only shared between Users who
+        logged in with the same password"""
+        password = hashlib.sha1('%s:%s' % (self.__username, self.__password))
+        return '%s:%s' % (self.__username, password.hexdigest())
+
     @property
     def key(self):
-        if not hasattr(self, '_key'):
-            self._key = self.get_authorization_key()
-        return self._key
+        with metrics.timer('key_seconds'):
+            return self.keystore.fetch(self.keystore_name, self.get_authorization_key)
 
     def refresh(self):
-        try:
-            delattr(self, '_key')
-        except AttributeError:
-            pass
+        self.keystore.delete(self.keystore_name)
+
+    @classmethod
+    def is_auth_error(cls, fault):
+        return re.search(r'\bA1\b', '%s' % fault.fault.faultstring) is not None
 
     def get_authorization_key(self):
         self.message('...logging in as "%s"' % self.__username)
-        key = self.client.service.GetAuthorizationKey(un=self.__username, \
-                                                      pwd=self.__password)
+        key = limited_call(self.method('GetAuthorizationKey'), un=self.__username, \
+                           pwd=self.__password)
         error = self.error_codes.get(key)
         if error:
+            metrics.count('errors_total', operation='GetAuthorizationKey', code=key)
             raise MarketsightAuthError(error)
         self.message('...success')
         return key
@@ -94,13 +133,23 @@ class User(MethodMixin):
 class Dataset(MethodMixin):
     __url__ = 'upload'
 
-    def __init__(self, user, dataset=None, auto_login=True):
+    def __init__(self, user, dataset=None, auto_login=True, streaming=STREAMING, manifest=None,
+                 retry=None, payload_cache=None):
+        self.streaming = streaming
+        # None is the shared payloads.PayloadCache, and False none at all
+        self.payload_cache = payload_cache
+        self.retry = retry if retry is not None else Retrying()
+        if isinstance(manifest, basestring):
+            manifest = Manifest(manifest)
+        self.manifest = manifest
         if isinstance(user, User):
             self._user = user
         else:
             self._user = User(*user)
 
         self._dataset = None
+        self.last_error = None
+        self.last_status = None
         if dataset:
             self.dataset = dataset
 
@@ -143,6 +192,11 @@ class Dataset(MethodMixin):
     def __repr__(self):
         return "<Dataset(user='%s', dataset='%s')>" % (self.user, self.dataset)
 
+    def call(self, method, **kwargs):
+        """Call a SOAP method with the user's key. If the key is rejected
+        it has expired, so log in again and retry once."""
+        return Retrying(attempts=1).call(self.user, method, message=self.message, **kwargs)
+
     def __upload(self, datafile_paths, navigator_path, datatype='spss'):
         datatypes = {
             #'spss': self.client.service.UploadDatasetDataSPSSZipped,
@@ -172,14 +226,14 @@ class Dataset(MethodMixin):
         self.message('...uploading compressed %s data' % datatype_key)
 
         try:
-            datafunction(key=self.user.key, datasetGuid=self.select_dataset(dataset),
-                         zippedData=b64data)
-        except suds.WebFault as details:
+            self.call(datafunction, datasetGuid=self.select_dataset(dataset),
+                      zippedData=b64data)
+        except webfault() as details:
             self.message('An error ocurred\n%s' % details)
             return False
         return True
 
-    def __update(self, datafile_paths, dataset=None, datatype='spss', function='update', save_as=None, zipped_file=None):
+    def __update(self, datafile_paths, dataset=None, datatype='spss', function='update', save_as=None, zipped_file=None, labels_file=None, digest=None):
         datatypes = {
             'spss': {
                 #'update': self.client.service.UpdateDatasetDataSPSSZipped,
@@ -214,57 +268,172 @@ class Dataset(MethodMixin):
                 datafile_paths.append(None)
             labelsfile_path = datafile_paths.pop(2)
 
+            if self.manifest is not None and function == 'update':
+                digest = files_digest([path for path in datafile_paths + [labelsfile_path] if path])
+                guid = self.select_dataset(dataset)
+                if self.manifest.unchanged(guid, digest, lambda: self.last_uploaded_datetime(guid)):
+                    self.message('...%s data is unchanged since the last upload, skipping' % datatype_key)
+                    self.last_error, self.last_status = None, 'skipped'
+                    metrics.count('uploads_total', datatype=datatype_key, function=function,
+                                  status='skipped')
+                    return True
+
             self.message('...gathering %s data from "%s"' % (datatype_key, datafile_paths[0]))
-            b64data = datafile_to_base64(datafile_paths, datatype=datatype_key, save_as=save_as)
-            labels_b64data = None
-            if labelsfile_path:
-                self.message('...gathering labels XML data')
-                labels_b64data = files_to_zipped_base64([labelsfile_path])
-                self.message('...uploading compressed %s data' % datatype_key)
+            with metrics.timer('stage_seconds', stage='gather', datatype=datatype_key):
+                if self.streaming:
+                    zipped_file = datafile_to_payload(datafile_paths, datatype=datatype_key, save_as=save_as)
+                else:
+                    zipped_file = datafile_to_base64(datafile_paths, datatype=datatype_key, save_as=save_as)
+                if labelsfile_path:
+                    labels_file = self.labels_payload(labelsfile_path)
+            self.message('...uploading compressed %s data' % datatype_key)
 
         else:
             self.message('...uploading compressed data from zipped file')
-            b64data = zipped_file
-            labels_b64data = None
         try:
-            if function == 'update':
-                datafunction(key=self.user.key, datasetGuid=self.select_dataset(dataset),
-                             zippedData=b64data, zippedVarLabeling=labels_b64data)
-            else:
-                datafunction(key=self.user.key, datasetGuid=self.select_dataset(dataset),
-                             zippedData=b64data)
-        except suds.WebFault as details:
+            with metrics.timer('stage_seconds', stage='encode', datatype=datatype_key):
+                b64data, labels_b64data = self.encode(zipped_file), self.encode(labels_file)
+            # Transient failures are retried with the same (spooled) data
+            with metrics.timer('stage_seconds', stage='send', datatype=datatype_key):
+                if function == 'update':
+                    self.retry.call(self.user, datafunction, message=self.message,
+                                    datasetGuid=self.select_dataset(dataset),
+                                    zippedData=b64data, zippedVarLabeling=labels_b64data)
+                else:
+                    # An append which timed out may still have been applied
+                    self.retry.call(self.user, datafunction, message=self.message,
+                                    idempotent=False, datasetGuid=self.select_dataset(dataset),
+                                    zippedData=b64data)
+        except webfault() as details:
+            self.last_error, self.last_status = details, 'failed'
+            metrics.count('uploads_total', datatype=datatype_key, function=function, status='failed')
             self.message('An error ocurred\n%s' % details)
             return False
+        except Exception as details:
+            # Retries are exhausted, or the error is not one to retry
+            self.last_error, self.last_status = details, 'failed'
+            metrics.count('uploads_total', datatype=datatype_key, function=function, status='failed')
+            raise
+        finally:
+            # Even a failed upload may have changed the dataset
+            invalidate(self.select_dataset(dataset))
+            for payload in (zipped_file, labels_file):
+                if isinstance(payload, Payload):
+                    payload.close()
+            if self.streaming:
+                self.client.options.transport.payloads.clear()
+        self.last_error, self.last_status = None, 'uploaded'
+        metrics.count('uploads_total', datatype=datatype_key, function=function, status='uploaded')
+        if self.manifest is not None:
+            guid = self.select_dataset(dataset)
+            if function == 'update' and digest is not None:
+                uploaded = self.last_uploaded_datetime(dataset)
+                self.manifest.update(guid, digest=digest, rows=None,
+                                     uploaded=uploaded and '%s' % uploaded)
+            else:
+                self.manifest.update(guid, digest=None, rows=None)
         return True
 
+    def labels_payload(self, labelsfile_path):
+        """The zipped labels file, from the payload cache (where it is zipped
+        once for every dataset, until it changes) unless that is off"""
+        self.message('...gathering labels XML data')
+        cache = self.payload_cache
+        if cache is None:
+            from .payloads import shared_cache
+            cache = shared_cache()
+        if cache:
+            payload = cache.payload([labelsfile_path])
+            if self.streaming:
+                return payload
+            with payload:
+                return payload.b64encode()
+        if self.streaming:
+            return files_to_payload([labelsfile_path])
+        return files_to_zipped_base64([labelsfile_path])
+
+    def encode(self, zipped_file):
+        """The base64 data to send for a Payload: either a placeholder for
+        the streaming transport, or the encoded data itself"""
+        if not isinstance(zipped_file, Payload):
+            return zipped_file
+        if self.streaming:
+            return self.client.options.transport.register(zipped_file)
+        return zipped_file.b64encode()
+
     def __append(self, datafile_paths, dataset=None, datatype='spss', save_as=None):
         return self.__update(datafile_paths=datafile_paths, dataset=dataset,
                              datatype=datatype, function='append', save_as=save_as)
 
     def number_of_respondents(self, dataset=None):
         try:
-            return int(self.client.service.GetNumberOfRespondents(
-                        key=self.user.key, datasetGuid=self.select_dataset(dataset)))
-        except suds.WebFault as details:
+            return int(self.call(self.method('GetNumberOfRespondents'),
+                        datasetGuid=self.select_dataset(dataset)))
+        except webfault() as details:
             self.message('An error ocurred\n%s' % details)
 
     def last_uploaded_datetime(self, dataset=None):
         try:
             return self.parse_datetime(
-            self.client.service.GetLastUploadedDateTimeByGuid(key=self.user.key,
-                                        datasetGuid=self.select_dataset(dataset)))
-        except suds.WebFault as details:
+            self.call(self.method('GetLastUploadedDateTimeByGuid'),
+                      datasetGuid=self.select_dataset(dataset)))
+        except webfault() as details:
             self.message('An error ocurred\n%s' % details)
 
-    def check_for_missing_variables(self, variables, dataset=None):
+    def check_for_missing_variables(self, variables, dataset=None, chunk_size=VARIABLES_CHUNK_SIZE):
+        """Return the variables which are not in the dataset. Long lists are
+        checked in concurrent chunks, and variables already found in the
+        dataset (since it was last uploaded to) are not checked again."""
+        guid = self.select_dataset(dataset)
+        present = variables_cache.get(guid, frozenset())
+        unchecked = [variable for variable in OrderedDict.fromkeys(self.parse_list(variables))
+                     if variable not in present]
+        chunks = [unchecked[start:start + chunk_size]
+                  for start in xrange(0, len(unchecked), chunk_size)]
+        if len(chunks) > 1:
+            from multiprocessing.pool import ThreadPool
+            self.message('...checking %d variables in %d chunks' % (len(unchecked), len(chunks)))
+            pool = ThreadPool(min(VARIABLES_WORKERS, len(chunks)))
+            try:
+                # suds clients aren't thread-safe, so each chunk gets its own
+                results = pool.map(lambda chunk: self.__check_variables(
+                    guid, chunk, self.new_client()), chunks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self.__check_variables(guid, chunk, self.client) for chunk in chunks]
+
+        missing = []
+        for result in results:
+            if isinstance(result, webfault()):
+                # Chunks which did succeed are cached, so a retry only
+                # checks the rest
+                self.message('An error ocurred\n%s' % result)
+                return None
+            missing.extend(result)
+        # As the server names them
+        return list(OrderedDict.fromkeys(missing))
+
+    def missing_spss_variables(self, datafile_path, dataset=None):
+        """Return the variables of an SPSS data file which are not in the
+        dataset, read from its dictionary without reading the data"""
+        from .spss import read_header
+        return self.check_for_missing_variables(read_header(datafile_path).names, dataset)
+
+    def __check_variables(self, guid, variables, client):
         try:
-            return self.parse_list(
-            self.client.service.CheckForMissingVariables(key=self.user.key,
-                            datasetGuid=self.select_dataset(dataset),
-                            variableList=','.join(self.parse_list(variables))))
-        except suds.WebFault as details:
-            self.message('An error ocurred\n%s' % details)
+            missing = self.parse_list(
+                self.call(self.method('CheckForMissingVariables', client),
+                          datasetGuid=guid, variableList=','.join(variables)) or '')
+        except webfault() as details:
+            return details
+        # The server may not name a variable as it was asked for it (SPSS
+        # names are case-insensitive)
+        names = set(name.lower() for name in missing)
+        variables_cache.merge(guid, [variable for variable in variables
+                                     if variable.lower() not in names])
+        return missing
 
     def update_spss(self, datafile_path, dataset=None, save_as=None):
         return self.__update(datafile_path, dataset=dataset, save_as=save_as)
@@ -282,8 +451,16 @@ class Dataset(MethodMixin):
     #        raise AttributeError('Please specify a ZIP file')
     #    return self.append_spss(datafile_path=datafile_path, dataset=dataset)
 
-    def update_sss_with_zip(self, zipped_file=None):
-        return self.__update(None, datatype='sss', zipped_file=zipped_file)
+    def update_sss_with_zip(self, zipped_file=None, dataset=None):
+        return self.__update(None, dataset=dataset, datatype='sss', zipped_file=zipped_file)
+
+    def upload_zipped(self, zipped_file, dataset=None, datatype='spss', function='update',
+                      labels_file=None, digest=None):
+        """Update or append with data that is already zipped: either base64
+        strings or Payloads, which are closed once sent. "digest" is the
+        files_digest of the original files, recorded in the manifest."""
+        return self.__update(None, dataset=dataset, datatype=datatype, function=function,
+                             zipped_file=zipped_file, labels_file=labels_file, digest=digest)
 
     def update_sss(self, metadatafile_path, datafile_path, labelsfile_path=None, dataset=None, save_as=None):
         datafile = [datafile_path, metadatafile_path, labelsfile_path]
@@ -293,6 +470,60 @@ class Dataset(MethodMixin):
         datafile = [datafile_path, metadatafile_path]
         return self.__append(datafile, dataset=dataset, datatype='sss', save_as=save_as)
 
+    def update_sss_rows(self, schema, rows, labelsfile_path=None, dataset=None):
+        """Update with Triple-S data made from rows and a triples.Schema,
+        zipped as the rows are read, with no data files on disk"""
+        return self.__sss_rows(schema, rows, 'update', labelsfile_path, dataset)
+
+    def append_sss_rows(self, schema, rows, dataset=None):
+        return self.__sss_rows(schema, rows, 'append', None, dataset)
+
+    def __sss_rows(self, schema, rows, function, labelsfile_path, dataset):
+        from .triples import zip_triple_s
+        self.message('...gathering SSS data from rows')
+        with metrics.timer('stage_seconds', stage='gather', datatype='SSS'):
+            zipped_file = Payload(zip_triple_s(schema, rows))
+            labels_file = self.labels_payload(labelsfile_path) if labelsfile_path else None
+        return self.upload_zipped(zipped_file, dataset=dataset, datatype='sss',
+                                  function=function, labels_file=labels_file)
+
+    def append_sss_incremental(self, metadatafile_path, datafile_path, dataset=None):
+        """Append only the rows of the Triple-S data file that were added
+        since the last append. The high-water mark is the row count in the
+        manifest, unless the dataset has been uploaded to since, or else the
+        dataset's number of respondents."""
+        dataset = self.select_dataset(dataset)
+        rows = None
+        if self.manifest is not None:
+            rows = self.manifest.rows(dataset, lambda: self.last_uploaded_datetime(dataset))
+        if rows is None:
+            rows = self.number_of_respondents(dataset)
+            if rows is None:
+                return False
+
+        tempdir = tempfile.mkdtemp(prefix='marketsight-')
+        try:
+            delta_path = os.path.join(tempdir, os.path.basename(datafile_path))
+            with open(delta_path, 'wb') as delta:
+                total = copy_rows(datafile_path, delta, skip=rows)
+            if total < rows:
+                raise AttributeError('"%s" has %d rows, but %d have already been uploaded.'
+                                     % (datafile_path, total, rows))
+            if total == rows:
+                self.message('...no new rows in "%s", skipping' % datafile_path)
+                self.last_error, self.last_status = None, 'skipped'
+                return True
+            self.message('...appending %d new rows' % (total - rows))
+            if not self.append_sss(metadatafile_path, delta_path, dataset=dataset):
+                return False
+        finally:
+            shutil.rmtree(tempdir)
+
+        if self.manifest is not None:
+            uploaded = self.last_uploaded_datetime(dataset)
+            self.manifest.update(dataset, rows=total, uploaded=uploaded and '%s' % uploaded)
+        return True
+
     #def update_sss_zipped(self, datafile_path, dataset=None):
     #    if not os.path.splitext(datafile_path)[1].lower().endswith('.zip'):
     #        raise AttributeError('Please specify a ZIP file')
@@ -357,7 +588,7 @@ class ReportURL(object):
     @id.setter
     def id(self, id):
         if id is None:
-            raise AtributeError("You must specify an ID.")
+            raise AttributeError("You must specify an ID.")
         self._id = self.parse_id(id)
 
     def id_key(self):
@@ -391,10 +622,9 @@ class ReportURL(object):
     @export.setter
     def export(self, export):
         if export is not None:
-            try:
-                self._export = self.export_types[self.url_type]
-            except KeyError:
+            if export.lower() not in self.export_types.get(self.url_type, ()):
                 raise AttributeError('"%s" is not a valid export type for a %s' % (export, self.url_type))
+            self._export = export.lower()
         else:
             self._export = None
 
@@ -403,7 +633,7 @@ class ReportURL(object):
         if self.rows:
             self.query.update(rows=self.rows)
         if self.columns:
-            self.query.update(rows=self.columns)
+            self.query.update(columns=self.columns)
         if self.export:
             self.query.update(export=self.export)
         if self.ak:
@@ -414,12 +644,82 @@ class ReportURL(object):
         return urlparse.urljoin(self.base_url, '?{}'.format(urllib.urlencode(self.query)))
 
 
+class ReportURLBuilder(object):
+    """Builds the same URLs as ReportURL, for many reports at a time. The
+    user's key is looked up once per batch, each part of the query string
+    is encoded once up front, and canonical IDs are checked with a regex
+    rather than parsed."""
+    guid = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$',
+                      re.IGNORECASE)
+
+    def __init__(self, user=None, base_url=None):
+        self.user = user
+        scheme, netloc, path = urlparse.urlsplit(base_url or ReportURL.base_url)[:3]
+        # What urljoin(base_url, '?query') gives, less the query
+        self.prefix = urlparse.urlunsplit((scheme, netloc, path, '', '')) + '?'
+        self.modes = dict((mode, urllib.urlencode({'mode': name}))
+                          for mode, name in ReportURL.modes.items())
+        self.default_mode = urllib.urlencode({'mode': 'ReadOnly'})
+        self.exports = dict(((url_type, export), urllib.urlencode({'export': export}))
+                            for url_type, exports in ReportURL.export_types.items()
+                            for export in exports)
+        self.id_keys = dict((url_type, 'datasetid=' if url_type == 'dataset' else 'id=')
+                            for url_type in ReportURL.url_types)
+
+    def parse_id(self, id):
+        if isinstance(id, basestring) and self.guid.match(id):
+            return id.lower()
+        return ReportURL.parse_id(id)
+
+    def access_key(self):
+        """The encoded "ak" parameter, if there is a user"""
+        if self.user is None:
+            return None
+        return urllib.urlencode({'ak': self.user.key})
+
+    def build(self, ak, url_type, id, mode=None, export=None, rows=None, columns=None):
+        id_key = self.id_keys.get(url_type) or self.id_keys.get(url_type.lower())
+        if id_key is None:
+            raise AttributeError('"%s" is an unknown URL type.' % url_type)
+        url_type = url_type.lower()
+        query = [self.modes.get(mode.lower(), self.default_mode) if mode else self.default_mode]
+        if rows:
+            query.append('rows=' + urllib.quote_plus('%s' % rows))
+        if columns:
+            query.append('columns=' + urllib.quote_plus('%s' % columns))
+        if export is not None:
+            part = self.exports.get((url_type, export.lower()))
+            if part is None:
+                raise AttributeError('"%s" is not a valid export type for a %s' % (export, url_type))
+            query.append(part)
+        if ak:
+            query.append(ak)
+        query.append(id_key + self.parse_id(id))
+        return self.prefix + '&'.join(query)
+
+    def url(self, url_type, id, mode=None, export=None, rows=None, columns=None):
+        return self.build(self.access_key(), url_type, id, mode, export, rows, columns)
+
+    def urls(self, reports):
+        """Yield the URL of each (url_type, id[, mode[, export[, rows[,
+        columns]]]]) in "reports", which may be any iterable"""
+        ak = self.access_key()
+        build = self.build
+        for report in reports:
+            yield build(ak, *report)
+
+
 class Report(object):
     url_factory = ReportURL
 
     def __init__(self, user=None):
         self.user = user
 
+    def urls(self, reports):
+        """Yield the URL of each (url_type, id[, mode[, export[, rows[,
+        columns]]]]), as ReportURLBuilder.urls does"""
+        return ReportURLBuilder(self.user).urls(reports)
+
     def chart(self, id, mode='ReadOnly', export=None):
         url = self.url_factory('chart', id, user=self.user, mode=mode, export=export)
         return url.geturl()
@@ -442,7 +742,7 @@ def login_user(username, password):
     if an authentication error ocurrs, then return None"""
     user = User(username, password, verbose=False)
     try:
-        key = user.get_authorization_key()
+        key = user.key
     except MarketsightAuthError:
         user = None
     return user
@@ -0,0 +1,224 @@
+"""Counters and timings of SOAP calls, uploads and their stages.
+
+Everything is recorded in the process-wide "metrics" registry:
+
+    call_seconds{operation}         each SOAP call (each attempt of a retry)
+    errors_total{operation,code}    failed SOAP calls, by fault or HTTP code
+    retries_total{operation,kind}   retried calls, by "auth" or "transient"
+    key_seconds                     fetching a key (from the keystore or a login)
+    stage_seconds{stage,datatype}   gather (zip/encode files), encode, send,
+                                    and the prepare/upload stages of batches
+    uploads_total{datatype,function,status}
+    zip_seconds, zip_bytes_in_total, zip_bytes_out_total, compression_ratio
+    bytes_sent_total{operation}, bytes_received_total{operation}
+    connections_total{reused}
+    concurrency_limit{limiter}, concurrency_in_flight{limiter},
+    concurrency_queued{limiter}     the adaptive limiters' state (gauges), for
+                                    "calls" and "uploads"
+    limit_decreases_total{limiter,reason}
+                                    times one backed off, on "error" or "latency"
+
+Timings are kept as a count, sum and maximum (see metrics.get()), so
+recording is a dict update under a lock. metrics.prometheus() returns them in the Prometheus text
+format (serve_prometheus() serves that over HTTP), and hooks added with
+metrics.add_hook() see every value as it is recorded; StatsdHook sends them
+on to a StatsD server. Set MARKETSIGHT_METRICS=0 to record nothing.
+"""
+import contextlib
+import re
+import socket
+import threading
+import time
+
+from .config import METRICS, STATSD
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+SUMMARY = 'summary'
+
+
+def operation_name(method):
+    """The SOAP operation name of a suds service method"""
+    wsdl_method = getattr(method, 'method', None)
+    return getattr(wsdl_method, 'name', None) or getattr(method, '__name__', '%s' % method)
+
+def error_code(error):
+    """A short code for an error: the service's code (such as "A1") or the
+    fault code of a SOAP fault, the status of an HTTP error, or the name of
+    the exception"""
+    fault = getattr(error, 'fault', None)
+    if fault is not None:
+        match = re.search(r'\b([A-Z]\d+)\b', '%s' % getattr(fault, 'faultstring', ''))
+        return match.group(1) if match else '%s' % getattr(fault, 'faultcode', 'fault')
+    for status in (getattr(error, 'httpcode', None), getattr(error, 'code', None)):
+        if isinstance(status, int):
+            return '%d' % status
+    # suds raises HTTP errors other than faults as Exception((status, reason))
+    if error.args and isinstance(error.args[0], tuple) and error.args[0][:1]:
+        return '%s' % error.args[0][0]
+    return type(error).__name__
+
+
+class Metrics(object):
+
+    def __init__(self, enabled=METRICS, prefix='marketsight'):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.values = {}
+        self.hooks = []
+        self.lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """Call hook(kind, name, value, labels) with every value recorded"""
+        self.hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self, kind, name, value, labels):
+        key = (kind, name, tuple(sorted(labels.items())))
+        with self.lock:
+            if kind == COUNTER:
+                self.values[key] = self.values.get(key, 0) + value
+            elif kind == GAUGE:
+                self.values[key] = value
+            else:
+                count, total, maximum = self.values.get(key, (0, 0, value))
+                self.values[key] = (count + 1, total + value, max(maximum, value))
+        for hook in self.hooks:
+            try:
+                hook(kind, name, value, labels)
+            except Exception:
+                # A broken exporter must never break an upload
+                pass
+
+    def count(self, name, value=1, **labels):
+        if self.enabled:
+            self.record(COUNTER, name, value, labels)
+
+    def gauge(self, name, value, **labels):
+        """Set a value which goes up and down"""
+        if self.enabled:
+            self.record(GAUGE, name, value, labels)
+
+    def observe(self, name, value, **labels):
+        if self.enabled:
+            self.record(SUMMARY, name, value, labels)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observe the seconds taken by the block, even if it raises"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def call(self, method, **kwargs):
+        """Call a SOAP method, timing it and counting its errors"""
+        operation = operation_name(method)
+        try:
+            with self.timer('call_seconds', operation=operation):
+                return method(**kwargs)
+        except Exception as error:
+            self.count('errors_total', operation=operation, code=error_code(error))
+            raise
+
+    def get(self, name, **labels):
+        """A counter's or gauge's value, or a summary's (count, sum, max)"""
+        labels = tuple(sorted(labels.items()))
+        for kind in (COUNTER, GAUGE, SUMMARY):
+            value = self.values.get((kind, name, labels))
+            if value is not None:
+                return value
+
+    def reset(self):
+        with self.lock:
+            self.values.clear()
+
+    def prometheus(self):
+        """Everything recorded so far, in the Prometheus text format"""
+        with self.lock:
+            values = sorted(self.values.items())
+        lines = []
+        declared = set()
+        for (kind, name, labels), value in values:
+            name = '%s_%s' % (self.prefix, name)
+            if name not in declared:
+                declared.add(name)
+                lines.append('# TYPE %s %s' % (name, kind))
+            labels = ','.join('%s="%s"' % (label, ('%s' % label_value).replace('\\', '\\\\')
+                                                                      .replace('"', '\\"'))
+                              for label, label_value in labels)
+            labels = '{%s}' % labels if labels else ''
+            if kind in (COUNTER, GAUGE):
+                lines.append('%s%s %r' % (name, labels, value))
+            else:
+                count, total, maximum = value
+                lines.append('%s_count%s %d' % (name, labels, count))
+                lines.append('%s_sum%s %r' % (name, labels, total))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class StatsdHook(object):
+    """A hook which sends each value to StatsD over UDP, as a counter or a
+    gauge, or a timer (in milliseconds) for names ending "_seconds", or else
+    a histogram. Label values are appended to the name:
+    marketsight.call.GetNumberOfRespondents:12.5|ms"""
+
+    def __init__(self, address, prefix='marketsight'):
+        if isinstance(address, basestring):
+            host, port = address.rsplit(':', 1)
+            address = (host, int(port))
+        self.address = address
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def name(self, name, labels):
+        parts = [self.prefix, name] + [re.sub(r'[^\w-]', '_', '%s' % labels[label])
+                                       for label in sorted(labels)]
+        return '.'.join(parts)
+
+    def __call__(self, kind, name, value, labels):
+        if kind == COUNTER:
+            line = '%s:%s|c' % (self.name(name, labels), value)
+        elif kind == GAUGE:
+            line = '%s:%s|g' % (self.name(name, labels), value)
+        elif name.endswith('_seconds'):
+            line = '%s:%.3f|ms' % (self.name(name[:-len('_seconds')], labels), value * 1000)
+        else:
+            line = '%s:%s|h' % (self.name(name, labels), value)
+        self.socket.sendto(line, self.address)
+
+
+def serve_prometheus(port, host='', registry=None):
+    """Serve the metrics for Prometheus to scrape, on a daemon thread"""
+    import BaseHTTPServer
+
+    class PrometheusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            body = self.server.metrics.prometheus()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer((host, port), PrometheusHandler)
+    server.metrics = registry if registry is not None else metrics
+    thread = threading.Thread(target=server.serve_forever, name='marketsight-metrics')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if STATSD:
+    metrics.add_hook(StatsdHook(STATSD))
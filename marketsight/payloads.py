@@ -0,0 +1,175 @@
+"""An on-disk cache of zipped, base64 encoded payloads, addressed by the
+digest of the files they were made from, so that the same files sent to
+many datasets (or sent again unchanged) are zipped and encoded once.
+
+    cache = PayloadCache()
+    payload = cache.payload(['data.sav'])   # an EncodedPayload
+
+Labels files, which are often shared by many datasets, go through the
+shared_cache() on every upload.
+"""
+import errno
+import os
+import tempfile
+import threading
+import time
+
+from .cache import LRUCache
+from .config import COMPRESSION_LEVEL, PAYLOAD_CACHE_DIR, PAYLOAD_CACHE_SIZE
+from .helpers import EncodedPayload, base64_chunks, file_lock, files_digest,\
+                     files_to_zipped_file
+
+# The digests of files, by their paths, inodes, sizes and change times,
+# so that a file sent many times is only read once to find its payload
+digests = LRUCache(1000)
+# A file changed in the last few seconds could change again without its
+# times (of a second or coarser, on some filesystems) changing, so its
+# digest isn't remembered until then
+SETTLED = 2.0
+
+
+def digest(filenames):
+    """files_digest, remembered until a file changes"""
+    stats = []
+    settled = True
+    now = time.time()
+    for filename in filenames:
+        stat = os.stat(filename)
+        stats.append((os.path.realpath(filename), stat.st_ino, stat.st_size, stat.st_mtime,
+                      stat.st_ctime))
+        settled = settled and now - max(stat.st_mtime, stat.st_ctime) > SETTLED
+    stats = tuple(stats)
+    value = digests.get(stats) if settled else None
+    if value is None:
+        value = files_digest(filenames)
+        if settled:
+            digests.set(stats, value)
+    return value
+
+
+class PayloadCache(object):
+    """A directory of <digest>.b64 files, shared by every process on the
+    host: a payload is made under a file lock, and appears atomically.
+    Beyond "max_size" bytes (unless it is None), the least recently used
+    payloads are removed."""
+
+    def __init__(self, directory=PAYLOAD_CACHE_DIR, level=COMPRESSION_LEVEL,
+                 max_size=PAYLOAD_CACHE_SIZE):
+        self.directory = directory
+        self.level = level
+        self.max_size = max_size
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def key(self, filenames, zipped=False):
+        """The files' digest, and the compression level unless they are
+        already zipped"""
+        return '%s-%s' % (digest(filenames), 'zip' if zipped else self.level)
+
+    def path(self, key):
+        return os.path.join(self.directory, '%s.b64' % key)
+
+    def get(self, filenames, zipped=False):
+        """The path of the files' payload, made now if it isn't cached.
+        "zipped" means the file is a zip already, to be encoded as it is."""
+        path = self.path(self.key(filenames, zipped))
+        if os.path.exists(path):
+            try:
+                # The modification time marks when a payload was last used
+                os.utime(path, None)
+                return path
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        with file_lock(path + '.lock'):
+            if not os.path.exists(path):
+                self.make(filenames, zipped, path)
+        self.evict(keep=path)
+        return path
+
+    def make(self, filenames, zipped, path):
+        fd, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if zipped:
+                    with open(filenames[0], 'rb') as zipfile:
+                        for chunk in base64_chunks(zipfile):
+                            f.write(chunk)
+                else:
+                    with files_to_zipped_file(filenames, level=self.level) as zipfile:
+                        for chunk in base64_chunks(zipfile):
+                            f.write(chunk)
+            os.rename(temporary, path)
+        except:
+            os.remove(temporary)
+            raise
+
+    def entries(self):
+        """(modified, size, path) of each payload, least recently used first"""
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.b64'):
+                path = os.path.join(self.directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    @property
+    def size(self):
+        return sum(size for modified, size, path in self.entries())
+
+    def evict(self, keep=None):
+        """Remove the least recently used payloads (other than "keep") until
+        the rest fit in max_size bytes. Payloads already opened can still
+        be read, until they're closed."""
+        if self.max_size is None:
+            return
+        entries = self.entries()
+        size = sum(size for modified, size, path in entries)
+        for modified, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            for filename in (path, path + '.lock'):
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+            size -= entry_size
+
+    def open(self, filenames, zipped=False):
+        """The payload file opened for reading, made again if another
+        process removed it first"""
+        try:
+            return open(self.get(filenames, zipped), 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return open(self.get(filenames, zipped), 'rb')
+
+    def payload(self, filenames, zipped=False):
+        return EncodedPayload(self.open(filenames, zipped))
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.b64'):
+                os.remove(os.path.join(self.directory, filename))
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+def shared_cache():
+    """The PayloadCache in PAYLOAD_CACHE_DIR, or None if caching is off
+    (PAYLOAD_CACHE_SIZE is 0)"""
+    global _shared_cache
+    if not PAYLOAD_CACHE_SIZE:
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = PayloadCache()
+        return _shared_cache
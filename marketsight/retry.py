@@ -0,0 +1,123 @@
+"""Retrying of SOAP calls which fail for reasons that may pass.
+
+Errors are classified as:
+
+    AUTH       the key was rejected: log in again and retry at once
+    TRANSIENT  a dropped connection, timeout or server error: wait with
+               exponential backoff and jitter, then retry
+    PERMANENT  anything else (a bad dataset, bad data): raise at once
+
+Calls which are not idempotent (appends) are only retried after errors
+which show the request was never sent, such as a refused connection: a
+timeout or a server error may come after the service has applied it.
+
+The arguments are reused for every attempt, so an upload's payload is
+zipped and spooled once however many times it is sent.
+"""
+import random
+import re
+import time
+
+from .config import RETRY_ATTEMPTS, RETRY_BACKOFF, RETRY_MAX_BACKOFF
+from .limiter import limited_call
+from .metrics import metrics, operation_name
+
+AUTH = 'auth'
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+# Faults the service returns when it is busy, rather than because of the
+# request
+transient_fault = re.compile(r'time[d ]*out|temporar|unavailable|busy|deadlock', re.IGNORECASE)
+transient_statuses = (408, 429, 500, 502, 503, 504)
+
+
+def classify(error, user=None):
+    """Whether "error" is an AUTH, TRANSIENT or PERMANENT failure"""
+    # Only imported once there is an error to classify
+    import httplib
+    import socket
+    import urllib2
+    import suds
+    from suds.transport import TransportError
+
+    if isinstance(error, suds.WebFault):
+        if user is not None and user.is_auth_error(error):
+            return AUTH
+        if transient_fault.search('%s' % error.fault.faultstring):
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(error, TransportError):
+        if error.httpcode in transient_statuses:
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(error, urllib2.HTTPError):
+        if error.code in transient_statuses:
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(error, (socket.error, httplib.HTTPException, urllib2.URLError)):
+        return TRANSIENT
+    # suds raises HTTP errors other than faults as Exception((status, reason))
+    if type(error) is Exception and error.args and isinstance(error.args[0], tuple) \
+            and error.args[0][:1] and error.args[0][0] in transient_statuses:
+        return TRANSIENT
+    return PERMANENT
+
+
+def unsent(error):
+    """Whether "error" shows that the request never reached the service"""
+    import errno
+    import socket
+    import urllib2
+
+    if isinstance(error, urllib2.URLError) and not isinstance(error, urllib2.HTTPError):
+        error = error.reason
+    return isinstance(error, socket.error) and error.errno == errno.ECONNREFUSED
+
+
+class Retrying(object):
+    """Make calls with a user's key, retrying them as their errors are
+    classified. "sleep" and "random" can be replaced for testing."""
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF,
+                 max_backoff=RETRY_MAX_BACKOFF, sleep=time.sleep, random=random.random):
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.random = random
+
+    def delay(self, retry):
+        """Seconds to wait before the retry'th retry ("full jitter")"""
+        return self.random() * min(self.max_backoff, self.backoff * 2 ** retry)
+
+    def call(self, user, method, message=None, idempotent=True, **kwargs):
+        """Call method(key=user.key, **kwargs), and return its result or
+        raise its last error. A rejected key is refreshed only once, and a
+        call which is not idempotent is only retried if it was never sent."""
+        refreshed = False
+        retries = 0
+        operation = operation_name(method)
+        while True:
+            try:
+                return limited_call(method, key=user.key, **kwargs)
+            except Exception as error:
+                kind = classify(error, user)
+                if kind == AUTH and not refreshed:
+                    refreshed = True
+                    metrics.count('retries_total', operation=operation, kind=kind)
+                    if message:
+                        message('...authorization key expired, logging in again')
+                    user.refresh()
+                    continue
+                if kind != TRANSIENT or retries + 1 >= self.attempts:
+                    raise
+                if not idempotent and not unsent(error):
+                    raise
+                delay = self.delay(retries)
+                retries += 1
+                metrics.count('retries_total', operation=operation, kind=kind)
+                if message:
+                    message('...%s, retrying in %.1f seconds (%d of %d)'
+                            % (error, delay, retries, self.attempts - 1))
+                self.sleep(delay)
@@ -0,0 +1,256 @@
+"""A pre-flight check of SPSS system (.sav and .zsav) files, which reads
+the header and the dictionary records but none of the case data, so a
+corrupt, truncated or wrongly encoded file is rejected in milliseconds
+rather than after it has been zipped and uploaded. An encoding Python
+doesn't know isn't an error (the service may well know it): the names
+and labels are left undecoded.
+
+    header = read_header('data.sav')
+    header.names, header.cases, header.compression, header.encoding
+"""
+import codecs
+import collections
+import os
+import re
+import struct
+
+# The header's compression codes
+UNCOMPRESSED = 0
+BYTECODE = 1
+ZLIB = 2
+
+# Windows code pages (and others) of the character code in record 7.3,
+# for files without an encoding record (7.20)
+CODE_PAGES = {2: 'cp500', 3: 'ascii', 4: 'cp037', 1252: 'cp1252', 20127: 'ascii',
+              28591: 'latin-1', 65001: 'utf-8'}
+# Names SPSS writes in record 7.20 which Python knows by others (besides
+# windows-NNN for cpNNN)
+ENCODINGS = {'windows-31j': 'cp932', 'macintosh': 'mac_roman', 'x-mac-roman': 'mac_roman'}
+
+SavVariable = collections.namedtuple('SavVariable', 'name short_name width label')
+
+
+class SavHeader(object):
+    """What read_header() found: the variables (in order, with their long
+    names), the number of cases (None if the file doesn't say), the
+    compression code and the encoding (None if the file doesn't say).
+    Names and labels are unicode, or byte strings if Python doesn't know
+    the encoding."""
+
+    def __init__(self, filename, product, compression, cases, variables, encoding, file_label):
+        self.filename = filename
+        self.product = product
+        self.compression = compression
+        self.cases = cases
+        self.variables = variables
+        self.encoding = encoding
+        self.file_label = file_label
+
+    @property
+    def names(self):
+        return [variable.name for variable in self.variables]
+
+    @property
+    def compressed(self):
+        return self.compression != UNCOMPRESSED
+
+    def __repr__(self):
+        return '<SavHeader "%s": %d variables, %s cases, compression %d>' % (
+            self.filename, len(self.variables), self.cases, self.compression)
+
+
+class Reader(object):
+    """Reads the dictionary's fields, and raises an AttributeError
+    naming the file if it ends first"""
+
+    def __init__(self, f, filename, endian='<'):
+        self.f = f
+        self.filename = filename
+        self.endian = endian
+
+    def error(self, message):
+        return AttributeError('"%s" is not a valid SPSS file: %s (at byte %d)'
+                              % (self.filename, message, self.f.tell()))
+
+    def read(self, size):
+        data = self.f.read(size)
+        if len(data) != size:
+            raise self.error('it ends in the dictionary')
+        return data
+
+    def unpack(self, format):
+        format = self.endian + format
+        return struct.unpack(format, self.read(struct.calcsize(format)))
+
+    def int(self):
+        return self.unpack('i')[0]
+
+
+def read_header(filename):
+    """Read and check the header and dictionary of an SPSS system file"""
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        reader = Reader(f, filename)
+        magic = reader.read(4)
+        if magic not in ('$FL2', '$FL3'):
+            raise reader.error('it does not start with "$FL2" or "$FL3"')
+        product = reader.read(60)
+        # The layout code is 2 or 3 in the writer's byte order
+        layout, = struct.unpack('<i', reader.read(4))
+        if layout not in (2, 3):
+            reader.endian = '>'
+            if struct.unpack('>i', struct.pack('<i', layout))[0] not in (2, 3):
+                raise reader.error('its layout code is %d' % layout)
+        slots, compression, weight_index, cases, bias = reader.unpack('iiiid')
+        # The creation date and time
+        reader.read(17)
+        file_label = reader.read(64)
+        reader.read(3)
+        if compression not in (UNCOMPRESSED, BYTECODE, ZLIB) or \
+           (magic == '$FL3') != (compression == ZLIB):
+            raise reader.error('its compression code %d is not valid for "%s"'
+                               % (compression, magic))
+
+        variables, slot_count, encoding, code_page, extensions = read_dictionary(reader)
+
+        if slots not in (-1, slot_count):
+            raise reader.error('the header has %d variable slots, the dictionary %d'
+                               % (slots, slot_count))
+        if not variables:
+            raise reader.error('it has no variables')
+        if weight_index < 0 or weight_index > slot_count:
+            raise reader.error('its weight variable %d does not exist' % weight_index)
+
+        data_offset = f.tell()
+        if compression == ZLIB:
+            zheader, ztrailer, ztrailer_size = reader.unpack('qqq')
+            if zheader != data_offset or ztrailer + ztrailer_size != size:
+                raise reader.error('its zlib data does not end where the file does')
+        elif compression == UNCOMPRESSED and cases >= 0 and \
+             data_offset + cases * slot_count * 8 > size:
+            raise reader.error('it is truncated: %d cases need %d bytes, but it has %d'
+                               % (cases, data_offset + cases * slot_count * 8, size))
+
+    if encoding is None and code_page is not None:
+        encoding = CODE_PAGES.get(code_page, 'cp%d' % code_page)
+    if encoding is None:
+        # Short names are ASCII, or near enough, in files which don't say
+        codec, names_codec = None, 'latin-1'
+    else:
+        codec = names_codec = python_codec(encoding)
+    variables = name_variables(filename, variables, extensions, codec, names_codec)
+    return SavHeader(filename, product.rstrip(), compression, cases if cases >= 0 else None,
+                     variables, encoding, decode(filename, file_label.rstrip(), codec))
+
+def python_codec(encoding):
+    """The Python codec for an encoding named in a file, or None"""
+    name = encoding.lower()
+    name = ENCODINGS.get(name) or re.sub(r'^windows-(\d+)$', r'cp\1', name)
+    for codec in (encoding, name):
+        try:
+            codecs.lookup(codec)
+            return codec
+        except LookupError:
+            pass
+    return None
+
+def read_dictionary(reader):
+    """The (short name, width, label) of each variable, the number of
+    variable slots, the encoding and code page, and the extension records
+    (record 7) by subtype"""
+    variables = []
+    slot_count = 0
+    encoding = code_page = None
+    extensions = {}
+    while True:
+        record_type = reader.int()
+        if record_type == 2:
+            width, has_label, missing_values, print_format, write_format = reader.unpack('iiiii')
+            name = reader.read(8)
+            label = None
+            if has_label == 1:
+                length = reader.int()
+                label = reader.read((length + 3) // 4 * 4)[:length]
+            elif has_label != 0:
+                raise reader.error('a variable label flag is %d' % has_label)
+            if abs(missing_values) > 3 or missing_values == -1:
+                raise reader.error('a variable has %d missing values' % missing_values)
+            reader.read(abs(missing_values) * 8)
+            slot_count += 1
+            if width == -1:
+                # The continuation of a long string variable
+                continue
+            if not 0 <= width <= 255 or not name.strip():
+                raise reader.error('a variable has the width %d and name %r' % (width, name))
+            variables.append((name.rstrip(), width, label))
+        elif record_type == 3:
+            count = reader.int()
+            if count < 0:
+                raise reader.error('a value label set has %d labels' % count)
+            for value in xrange(count):
+                reader.read(8)
+                length = ord(reader.read(1))
+                reader.read((length + 8) // 8 * 8 - 1)
+            if reader.int() != 4:
+                raise reader.error('value labels are not followed by their variables')
+            count = reader.int()
+            if not 0 <= count <= slot_count:
+                raise reader.error('value labels apply to %d variables' % count)
+            reader.read(count * 4)
+        elif record_type == 6:
+            lines = reader.int()
+            if lines < 0:
+                raise reader.error('a document has %d lines' % lines)
+            reader.read(lines * 80)
+        elif record_type == 7:
+            subtype, item_size, count = reader.unpack('iii')
+            if item_size < 0 or count < 0:
+                raise reader.error('record 7.%d has %d items of %d bytes'
+                                   % (subtype, count, item_size))
+            data = reader.read(item_size * count)
+            if subtype == 3 and item_size == 4 and count >= 8:
+                code_page = struct.unpack(reader.endian + '8i', data[:32])[7]
+            elif subtype == 20:
+                encoding = data.strip('\0 ')
+            else:
+                extensions[subtype] = data
+        elif record_type == 999:
+            reader.int()
+            return variables, slot_count, encoding, code_page, extensions
+        else:
+            raise reader.error('there is an unknown record type %d' % record_type)
+
+def decode(filename, text, encoding):
+    if text is None or encoding is None:
+        return text
+    try:
+        return text.decode(encoding)
+    except UnicodeDecodeError as details:
+        raise AttributeError('"%s" is not valid %s: %r (%s)' % (filename, encoding, text, details))
+
+def name_variables(filename, variables, extensions, codec, names_codec):
+    """The SavVariables, with the long names of record 7.13, and very long
+    strings (record 7.14) made one variable out of their 255 byte segments.
+    Names are decoded with "names_codec", and labels with "codec"."""
+    long_names = dict(pair.split('=', 1) for pair in
+                      decode(filename, extensions.get(13, ''), names_codec).split('\t')
+                      if '=' in pair)
+    segments = {}
+    for pair in extensions.get(14, '').split('\0\t'):
+        name, _, width = pair.strip('\0').partition('=')
+        if width.strip().isdigit():
+            segments[name.strip()] = int(width)
+
+    named = []
+    skip = 0
+    for short_name, width, label in variables:
+        if skip:
+            skip -= 1
+            continue
+        short_name = decode(filename, short_name, names_codec)
+        if short_name in segments:
+            width = segments[short_name]
+            skip = (width + 251) // 252 - 1
+        named.append(SavVariable(long_names.get(short_name, short_name), short_name, width,
+                                 decode(filename, label, codec)))
+    return named
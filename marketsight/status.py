@@ -0,0 +1,63 @@
+"""The number of respondents and last upload time of many datasets at once.
+
+    statuses = DatasetStatus(user).get(guids)
+    statuses[guid].respondents, statuses[guid].last_uploaded
+
+Both are fetched concurrently for every dataset not already in the status
+cache, and cached until they expire or the dataset is uploaded to.
+"""
+from collections import namedtuple
+
+from .asynchronous import AsyncDataset
+from .cache import status_cache
+from .methods import Dataset, User
+
+Status = namedtuple('Status', 'dataset respondents last_uploaded')
+
+
+class DatasetStatus(object):
+
+    def __init__(self, user, pool=None, cache=None):
+        self.user = user if isinstance(user, User) else User(*user)
+        self.datasets = AsyncDataset(self.user, pool=pool)
+        # Only used to validate dataset IDs
+        self.select_dataset = Dataset(self.user, auto_login=False).select_dataset
+        self.cache = cache if cache is not None else status_cache
+
+    def get(self, datasets, refresh=False):
+        """Return {dataset: Status} for the datasets. Statuses which could
+        not be fetched are left out, and are not cached."""
+        datasets = [self.select_dataset(dataset) for dataset in datasets]
+        statuses = {}
+        pending = []
+        for dataset in datasets:
+            status = None if refresh else self.cache.get(dataset)
+            if status is not None:
+                statuses[dataset] = status
+            elif dataset not in statuses:
+                statuses[dataset] = None
+                pending.append((dataset,
+                                self.datasets.number_of_respondents(dataset),
+                                self.datasets.last_uploaded_datetime(dataset)))
+        for dataset, respondents, last_uploaded in pending:
+            try:
+                status = Status(dataset, respondents.get(), last_uploaded.get())
+            except Exception:
+                # A timeout or server error, say, for this dataset alone
+                del statuses[dataset]
+                continue
+            if status.respondents is None or status.last_uploaded is None:
+                del statuses[dataset]
+                continue
+            self.cache.set(dataset, status)
+            statuses[dataset] = status
+        return statuses
+
+    def __getitem__(self, dataset):
+        return self.get([dataset])[self.select_dataset(dataset)]
+
+    def invalidate(self, dataset=None):
+        if dataset is None:
+            self.cache.clear()
+        else:
+            self.cache.delete(self.select_dataset(dataset))
@@ -0,0 +1,196 @@
+import errno
+import httplib
+import socket
+import StringIO
+import threading
+import time
+import urlparse
+import uuid
+
+from suds.transport import Reply, TransportError
+from suds.transport.https import HttpAuthenticated
+
+from .config import KEEPALIVE, POOL_SIZE, POOL_IDLE, TIMEOUT
+from .metrics import metrics
+
+
+class ConnectionPool(object):
+    """Idle keep-alive connections, kept per scheme and host. At most "size"
+    are kept for each host, and any left idle for "idle" seconds are closed
+    rather than reused, as the server will have dropped them by then."""
+
+    def __init__(self, size=POOL_SIZE, idle=POOL_IDLE):
+        self.size = size
+        self.idle = idle
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def get(self, scheme, netloc, timeout=TIMEOUT):
+        """Return (connection, reused)"""
+        now = time.time()
+        with self.lock:
+            idle = self.connections.get((scheme, netloc), [])
+            while idle:
+                connection, released = idle.pop()
+                if now - released < self.idle:
+                    return connection, True
+                connection.close()
+        if scheme == 'https':
+            connection = httplib.HTTPSConnection(netloc, timeout=timeout)
+        else:
+            connection = httplib.HTTPConnection(netloc, timeout=timeout)
+        # Small requests on a kept-alive connection would otherwise wait on
+        # Nagle's algorithm for the server's delayed ACK
+        connection.connect()
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection, False
+
+    def put(self, scheme, netloc, connection):
+        with self.lock:
+            idle = self.connections.setdefault((scheme, netloc), [])
+            if len(idle) < self.size:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def clear(self):
+        with self.lock:
+            for idle in self.connections.values():
+                for connection, released in idle:
+                    connection.close()
+            self.connections.clear()
+
+
+connection_pool = ConnectionPool()
+
+
+class PooledHttpTransport(HttpAuthenticated):
+    """A suds transport which sends SOAP requests over keep-alive
+    connections from a shared ConnectionPool, instead of a new connection
+    (and TLS handshake) for every call. WSDLs are still fetched by suds."""
+
+    def __init__(self, pool=None, **kwargs):
+        kwargs.setdefault('timeout', TIMEOUT)
+        HttpAuthenticated.__init__(self, **kwargs)
+        self.pool = pool if pool is not None else connection_pool
+
+    def body_parts(self, message):
+        return [message]
+
+    def post(self, connection, path, headers, parts):
+        """Send the request, and return its length"""
+        length = sum(len(part) if isinstance(part, basestring) else part.b64size
+                     for part in parts)
+        connection.putrequest('POST', path, skip_accept_encoding=True)
+        for header, value in headers.items():
+            connection.putheader(header, value)
+        connection.putheader('Content-Length', str(length))
+        if len(parts) == 1:
+            # Send the headers and body together
+            connection.endheaders(parts[0])
+        else:
+            connection.endheaders()
+            for part in parts:
+                if isinstance(part, basestring):
+                    connection.send(part)
+                else:
+                    for chunk in part.b64chunks():
+                        connection.send(chunk)
+        return length
+
+    @classmethod
+    def dropped(cls, error, sending):
+        """Whether "error" shows that the server had closed the connection
+        before it could read the request (so it is safe to send again): a
+        reset or broken pipe while sending, or no reply at all. A timeout
+        never is, as the server may be working on the request."""
+        if sending:
+            return isinstance(error, socket.error) and \
+                error.errno in (errno.ECONNRESET, errno.EPIPE)
+        return isinstance(error, httplib.BadStatusLine)
+
+    def send(self, request):
+        url = urlparse.urlsplit(request.url)
+        path = url.path + ('?%s' % url.query if url.query else '')
+        parts = self.body_parts(request.message)
+        operation = request.headers.get('SOAPAction', '').strip('"').rsplit('/', 1)[-1]
+        while True:
+            connection, reused = self.pool.get(url.scheme, url.netloc, self.options.timeout)
+            metrics.count('connections_total', reused=reused)
+            sending = True
+            try:
+                sent = self.post(connection, path, request.headers, parts)
+                sending = False
+                response = connection.getresponse()
+                message = response.read()
+                break
+            except (httplib.HTTPException, socket.error) as error:
+                connection.close()
+                # A reused connection may have been dropped by the server
+                # while idle, so try again once on a fresh connection
+                if not reused or not self.dropped(error, sending):
+                    raise
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.put(url.scheme, url.netloc, connection)
+        metrics.count('bytes_sent_total', sent, operation=operation)
+        metrics.count('bytes_received_total', len(message), operation=operation)
+
+        if response.status in (202, 204):
+            return None
+        if response.status >= 300:
+            raise TransportError(response.reason, response.status,
+                                 StringIO.StringIO(message))
+        return Reply(response.status, dict(response.getheaders()), message)
+
+    def __deepcopy__(self, memo={}):
+        clone = HttpAuthenticated.__deepcopy__(self, memo)
+        clone.pool = self.pool
+        return clone
+
+
+class StreamingHttpTransport(PooledHttpTransport):
+    """A suds transport which streams registered Payloads into the SOAP
+    request body. The payload is passed to suds as a placeholder token and
+    swapped for its base64 chunks as the request is sent, so neither the
+    encoded data nor the envelope around it is ever built in memory.
+    """
+    token_prefix = 'marketsight-payload-'
+
+    def __init__(self, pool=None, **kwargs):
+        PooledHttpTransport.__init__(self, pool, **kwargs)
+        self.payloads = {}
+
+    def register(self, payload):
+        token = '%s%s' % (self.token_prefix, uuid.uuid4().hex)
+        self.payloads[token] = payload
+        return token
+
+    def unregister(self, token):
+        return self.payloads.pop(token, None)
+
+    def body_parts(self, message):
+        parts = [message]
+        for token, payload in self.payloads.items():
+            split = []
+            for part in parts:
+                if not isinstance(part, basestring) or token not in part:
+                    split.append(part)
+                    continue
+                before, after = part.split(token, 1)
+                split.extend([before, payload, after])
+            parts = split
+        return parts
+
+
+def default_transport(streaming=False):
+    """The transport for a new client. Without keep-alive, connections are
+    taken from a pool which keeps none of them; with neither keep-alive nor
+    streaming, suds' own transport is used."""
+    pool = connection_pool if KEEPALIVE else ConnectionPool(size=0)
+    if streaming:
+        return StreamingHttpTransport(pool)
+    if KEEPALIVE:
+        return PooledHttpTransport(pool)
+    return None
@@ -0,0 +1,173 @@
+"""Triple-S data made straight from rows (a database cursor, a generator),
+with no .sss or .asc file on disk. The schema becomes the .sss XML, and
+each row a fixed-width .asc record, deflated into the zip as it is made.
+
+    schema = Schema([
+        Variable('RESPID', 'quantity', width=6),
+        Variable('Q1', 'single', label='Gender', values={1: 'Male', 2: 'Female'}),
+        Variable('WEIGHT', 'quantity', width=8, decimals=4),
+        Variable('CITY', 'character', width=20),
+    ])
+    dataset.update_sss_rows(schema, cursor)
+"""
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from .compression import write_chunks
+from .config import CHUNK_SIZE, COMPRESSION_LEVEL, SPOOL_SIZE
+
+
+def text(value):
+    """XML-escaped UTF-8 text"""
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return escape(value)
+
+
+class Variable(object):
+    """A Triple-S variable: "single" (one code), "quantity" (a number, of
+    "decimals" places), "character" (text) or "logical" (true or false).
+    "values" labels the codes of a single, and "range" is the (from, to)
+    a single or quantity may take, by default the lowest to highest code of
+    a single, or what a quantity's width holds. The width defaults to fit
+    the range."""
+    types = ('single', 'quantity', 'character', 'logical')
+
+    def __init__(self, name, type='single', width=None, label=None, values=None, range=None,
+                 decimals=0):
+        if type not in self.types:
+            raise AttributeError('"%s" is not a Triple-S variable type (use %s)'
+                                 % (type, ', '.join(self.types)))
+        self.name = name
+        self.type = type
+        self.label = label if label is not None else name
+        self.values = values or {}
+        self.decimals = decimals
+        if range is None and type == 'single':
+            if not self.values:
+                raise AttributeError('The single variable "%s" needs values or a range' % name)
+            range = (min(self.values), max(self.values))
+        elif range is None and type == 'quantity':
+            point = decimals + 1 if decimals else 0
+            if width is not None and width <= point:
+                raise AttributeError('"%s" is too narrow for %d decimal places' % (name, decimals))
+            range = (0, 10 ** (width - point if width is not None else 1) - 1)
+        self.range = range
+        if width is None:
+            if type == 'character':
+                raise AttributeError('The character variable "%s" needs a width' % name)
+            if type == 'logical':
+                width = 1
+            else:
+                highest = max([abs(code) for code in self.values] + list(range or [0]))
+                width = len('%.*f' % (decimals, highest))
+        self.width = width
+
+    def sss(self, ident, start):
+        """The variable's XML, at columns start to start + width - 1"""
+        parts = ['<variable ident="%d" type="%s">' % (ident, self.type),
+                 '<name>%s</name>' % text(self.name),
+                 '<label>%s</label>' % text(self.label),
+                 '<position start="%d" finish="%d"/>' % (start, start + self.width - 1)]
+        if self.type in ('single', 'quantity'):
+            parts.append('<values>')
+            if self.range is not None:
+                parts.append('<range from=%s to=%s/>' % (
+                    quoteattr('%.*f' % (self.decimals, self.range[0])),
+                    quoteattr('%.*f' % (self.decimals, self.range[1]))))
+            for code, label in sorted(self.values.items()):
+                parts.append('<value code=%s>%s</value>' % (quoteattr('%s' % code), text(label)))
+            parts.append('</values>')
+        parts.append('</variable>')
+        return ''.join(parts)
+
+    def formatter(self):
+        """A function from a value to its fixed-width field"""
+        width, name = self.width, self.name
+        blank = ' ' * width
+
+        def fit(field, value):
+            if len(field) > width:
+                raise AttributeError('%r is too wide for "%s" (%d columns)' % (value, name, width))
+            return field
+
+        if self.type == 'character':
+            def format(value):
+                if value is None:
+                    return blank
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                return fit(value, value).ljust(width)
+        elif self.type == 'logical':
+            def format(value):
+                return blank if value is None else ('1' if value else '0')
+        elif self.decimals:
+            decimals = self.decimals
+            def format(value):
+                return blank if value is None else fit('%0*.*f' % (width, decimals, value), value)
+        else:
+            def format(value):
+                return blank if value is None else fit('%0*d' % (width, value), value)
+        return format
+
+
+class Schema(object):
+    """The variables of a Triple-S survey, laid out one after another in
+    a fixed-width record. Variables may be given as Variables or as dicts
+    of Variable's arguments."""
+
+    def __init__(self, variables, name='data', title=None):
+        self.variables = [variable if isinstance(variable, Variable) else Variable(**variable)
+                          for variable in variables]
+        if not self.variables:
+            raise AttributeError('A Triple-S schema needs at least one variable')
+        self.name = name
+        self.title = title
+        self.width = sum(variable.width for variable in self.variables)
+
+    def sss(self):
+        """The .sss metadata XML, encoded as UTF-8"""
+        variables = []
+        start = 1
+        for ident, variable in enumerate(self.variables):
+            variables.append(variable.sss(ident + 1, start))
+            start += variable.width
+        title = '<title>%s</title>' % text(self.title) if self.title else ''
+        return ('<?xml version="1.0" encoding="UTF-8"?><sss version="2.0"><survey>%s'
+                '<record ident="A">%s</record></survey></sss>' % (title, ''.join(variables)))
+
+    def records(self, rows, chunk_size=CHUNK_SIZE):
+        """Yield the .asc records of the rows (sequences of values in the
+        variables' order), joined into chunks of about "chunk_size" bytes"""
+        formatters = [variable.formatter() for variable in self.variables]
+        count = len(formatters)
+        lines_per_chunk = max(1, chunk_size // (self.width + 2))
+        lines = []
+        for row in rows:
+            if len(row) != count:
+                raise AttributeError('A row has %d values, but the schema has %d variables'
+                                     % (len(row), count))
+            lines.append(''.join([format(value) for format, value in zip(formatters, row)]))
+            if len(lines) >= lines_per_chunk:
+                lines.append('')
+                yield '\r\n'.join(lines)
+                lines = []
+        if lines:
+            lines.append('')
+            yield '\r\n'.join(lines)
+
+
+def zip_triple_s(schema, rows, fileobj=None, level=COMPRESSION_LEVEL, zip64=True):
+    """Zip the schema's .sss and the rows' .asc records into "fileobj" (by
+    default a spooled temporary file), which is returned rewound. There is
+    no telling how much data the rows make, so the .asc has room for zip64
+    sizes unless "zip64" is False."""
+    if fileobj is None:
+        fileobj = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with zipfile.ZipFile(fileobj, mode='w', compression=zipfile.ZIP_DEFLATED,
+                         allowZip64=True) as zipper:
+        zipper.writestr('%s.sss' % schema.name, schema.sss())
+        write_chunks(zipper, schema.records(rows), '%s.asc' % schema.name, level, zip64)
+    fileobj.seek(0)
+    return fileobj
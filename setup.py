@@ -37,6 +37,12 @@ setup(
     package_dir={'marketsight':
                  'marketsight'},
     include_package_data=True,
+    entry_points={
+        'console_scripts': [
+            'marketsight-daemon = marketsight.daemon:main',
+            'marketsight-submit = marketsight.daemon:submit_main',
+        ],
+    },
     install_requires=requirements,
     license="ISCL",
     zip_safe=False,
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_batch
+----------------------------------
+
+Tests for `marketsight.batch`, against the stand-in server.
+"""
+
+import os
+import tempfile
+import unittest
+
+from marketsight import payloads
+from marketsight.batch import upload_to_many
+from marketsight.config import PAYLOAD_CACHE_DIR
+from marketsight.payloads import PayloadCache
+from tests.test_methods import ServerTestCase
+
+GUIDS = ['6f1b1a0e-0000-4000-8000-%012d' % index for index in range(3)]
+
+
+class TestUploadToMany(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        with open(self.path('data.asc'), 'wb') as f:
+            f.write('0001 1\r\n0002 2\r\n' * 1000)
+        with open(self.path('data.sss'), 'wb') as f:
+            f.write('<sss version="2.0"/>')
+        self.files = [self.path('data.asc'), self.path('data.sss')]
+
+    def upload(self, **kwargs):
+        results = upload_to_many(self.user, GUIDS, self.files, 'sss', **kwargs)
+        self.assertEqual([result.status for result in results], ['uploaded'] * len(GUIDS))
+
+    def test_cache(self):
+        cache = PayloadCache(self.path('payloads'))
+        for streaming in (False, True):
+            self.upload(streaming=streaming, cache=cache)
+        self.assertEqual(self.server.state.calls['UpdateDatasetDataTripleSWithLabelsZipped'],
+                         2 * len(GUIDS))
+        # Zipped once, and kept
+        self.assertEqual(len(cache.entries()), 1)
+
+    def payloads(self):
+        if not os.path.isdir(PAYLOAD_CACHE_DIR):
+            return []
+        return sorted(os.listdir(PAYLOAD_CACHE_DIR))
+
+    def test_caching_off(self):
+        cached = self.payloads()
+        size, shared = payloads.PAYLOAD_CACHE_SIZE, payloads._shared_cache
+        tempdir = tempfile.tempdir
+        payloads.PAYLOAD_CACHE_SIZE, payloads._shared_cache = 0, None
+        # Where the temporary cache goes
+        tempfile.tempdir = self.path('temporary')
+        os.mkdir(tempfile.tempdir)
+        try:
+            self.upload(streaming=True)
+        finally:
+            payloads.PAYLOAD_CACHE_SIZE, payloads._shared_cache = size, shared
+            tempfile.tempdir = tempdir
+        self.assertEqual([name for name in os.listdir(self.path('temporary'))
+                          if name.startswith('marketsight-')], [])
+        self.assertEqual(self.payloads(), cached)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_clients
+----------------------------------
+
+Tests for `marketsight.clients`, against the stand-in server.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.fakeserver import FakeMarketSight
+from marketsight import clients
+
+
+class TestClients(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeMarketSight().start()
+        cls.url = cls.server.urls()['upload']
+        cls.user_url = cls.server.urls()['user']
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='marketsight-test-')
+        self.cache_dir = clients.CACHE_DIR
+        clients.CACHE_DIR = self.tempdir
+
+    def tearDown(self):
+        clients.invalidate()
+        clients.CACHE_DIR = self.cache_dir
+        shutil.rmtree(self.tempdir)
+
+    def cached(self):
+        files = []
+        for directory, subdirectories, filenames in os.walk(self.tempdir):
+            files.extend(filename for filename in filenames if filename.endswith('.px'))
+        return sorted(files)
+
+    def test_get_client(self):
+        client = clients.get_client(self.user_url, timeout=5)
+        self.assertTrue(client.service.GetAuthorizationKey(un='user', pwd='password'))
+        # Each caller gets its own clone, of the one WSDL document cached
+        self.assertIsNot(clients.get_client(self.user_url), client)
+        self.assertEqual(self.cached(), ['suds-%s.px' % clients.cache_ids(self.user_url)[0]])
+
+    def test_invalidate(self):
+        clients.get_client(self.url)
+        clients.get_client(self.user_url)
+        self.assertEqual(len(self.cached()), 2)
+        clients.invalidate(self.url)
+        self.assertEqual(len(self.cached()), 1)
+        self.assertNotIn(self.url, clients._clients)
+        clients.get_client(self.url)
+        self.assertEqual(len(self.cached()), 2)
+        clients.invalidate()
+        self.assertEqual(self.cached(), [])
+        self.assertEqual(clients._clients, {})
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_compression
+----------------------------------
+
+Tests for `marketsight.compression`: the zips it writes must read back,
+byte for byte, with zipfile (and unzip, where it is installed).
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+import zipfile
+
+from marketsight.compression import write_chunks, zip_files
+
+
+def unzip_test(filename):
+    """Whether unzip finds the zip sound, or None without unzip"""
+    try:
+        with open(os.devnull, 'wb') as devnull:
+            return subprocess.call(['unzip', '-tqq', filename], stdout=devnull,
+                                   stderr=devnull) == 0
+    except OSError:
+        return None
+
+
+class ZipTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='marketsight-test-')
+        generator = random.Random(1)
+        self.files = {
+            # Half compressible, half not, over many blocks
+            'data.sav': ''.join(chr(generator.randrange(256)) for i in xrange(50000)) +
+                        'respondent,' * 5000,
+            'meta.sss': '<sss version="2.0"/>',
+            'empty.asc': '',
+        }
+        for name, data in self.files.items():
+            with open(self.path(name), 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def path(self, name):
+        return os.path.join(self.tempdir, name)
+
+    def check(self, zipped, files):
+        """Check that the zip holds exactly "files", intact"""
+        with zipfile.ZipFile(zipped) as zipper:
+            self.assertIsNone(zipper.testzip())
+            self.assertEqual(sorted(zipper.namelist()), sorted(files))
+            for name in files:
+                self.assertEqual(zipper.read(name), self.files[name])
+                self.assertEqual(zipper.getinfo(name).file_size, len(self.files[name]))
+        self.assertNotEqual(unzip_test(zipped), False)
+
+
+class TestZipFiles(ZipTestCase):
+
+    def zip(self, names, **kwargs):
+        zipped = self.path('out.zip')
+        with open(zipped, 'wb') as f:
+            zip_files([(self.path(name), name) for name in names], f, **kwargs)
+        return zipped
+
+    def test_serial(self):
+        self.check(self.zip(sorted(self.files), processes=1, block_size=4096), self.files)
+
+    def test_parallel(self):
+        zipped = self.zip(sorted(self.files), processes=2, block_size=4096)
+        self.check(zipped, self.files)
+        with zipfile.ZipFile(zipped) as zipper:
+            parallel = [(zinfo.CRC, zinfo.compress_size) for zinfo in zipper.infolist()]
+        # The same blocks are deflated either way
+        with zipfile.ZipFile(self.zip(sorted(self.files), processes=1, block_size=4096)) as zipper:
+            self.assertEqual(parallel, [(zinfo.CRC, zinfo.compress_size)
+                                        for zinfo in zipper.infolist()])
+
+    def test_one_block(self):
+        self.check(self.zip(['data.sav'], processes=2), ['data.sav'])
+
+    def test_empty_file(self):
+        self.check(self.zip(['empty.asc'], processes=1), ['empty.asc'])
+        self.check(self.zip(['empty.asc'], processes=2), ['empty.asc'])
+
+    def test_levels(self):
+        sizes = []
+        for level in (1, 9):
+            zipped = self.zip(['data.sav'], level=level, processes=1)
+            self.check(zipped, ['data.sav'])
+            sizes.append(os.path.getsize(zipped))
+        self.assertGreaterEqual(sizes[0], sizes[1])
+
+    def test_zip64(self):
+        # Stands in for files over 4GB
+        limit = zipfile.ZIP64_LIMIT
+        zipfile.ZIP64_LIMIT = 1000
+        try:
+            zipped = self.zip(sorted(self.files), processes=2, block_size=4096)
+            self.check(zipped, self.files)
+        finally:
+            zipfile.ZIP64_LIMIT = limit
+
+
+class TestWriteChunks(ZipTestCase):
+
+    def write(self, name, chunks, zip64=False):
+        zipped = self.path('out.zip')
+        with zipfile.ZipFile(zipped, mode='w', compression=zipfile.ZIP_DEFLATED,
+                             allowZip64=True) as zipper:
+            zipper.writestr('meta.sss', self.files['meta.sss'])
+            write_chunks(zipper, chunks, name, zip64=zip64)
+        return zipped
+
+    def chunks(self, name, size=3000):
+        data = self.files[name]
+        return [data[start:start + size] for start in xrange(0, len(data), size)]
+
+    def test_chunks(self):
+        self.check(self.write('data.sav', self.chunks('data.sav')), ['meta.sss', 'data.sav'])
+
+    def test_zip64_header(self):
+        self.check(self.write('data.sav', self.chunks('data.sav'), zip64=True),
+                   ['meta.sss', 'data.sav'])
+
+    def test_no_chunks(self):
+        self.check(self.write('empty.asc', iter([])), ['meta.sss', 'empty.asc'])
+        self.check(self.write('empty.asc', ['', '']), ['meta.sss', 'empty.asc'])
+
+    def test_large_without_zip64(self):
+        limit = zipfile.ZIP64_LIMIT
+        zipfile.ZIP64_LIMIT = 10000
+        read = []
+
+        def chunks():
+            for chunk in self.chunks('data.sav'):
+                read.append(chunk)
+                yield chunk
+
+        try:
+            self.assertRaises(zipfile.LargeZipFile, self.write, 'data.sav', chunks())
+            # It fails once past the limit, not at the end
+            self.assertEqual(len(read), 4)
+            self.check(self.write('data.sav', self.chunks('data.sav'), zip64=True),
+                       ['meta.sss', 'data.sav'])
+        finally:
+            zipfile.ZIP64_LIMIT = limit
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
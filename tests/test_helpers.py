@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_helpers
+----------------------------------
+
+Tests for `marketsight.helpers`.
+"""
+
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from marketsight.helpers import copy_rows
+
+
+class TestCopyRows(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='marketsight-test-')
+        self.filename = os.path.join(self.tempdir, 'data.asc')
+        with open(self.filename, 'wb') as f:
+            f.write('0001 1\r\n0002 2\r\n\r\n0003 1\r\n   \n0004 2')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def copy(self, skip):
+        outfile = StringIO.StringIO()
+        return copy_rows(self.filename, outfile, skip), outfile.getvalue()
+
+    def test_all(self):
+        self.assertEqual(self.copy(0), (4, '0001 1\r\n0002 2\r\n0003 1\r\n0004 2'))
+
+    def test_skip(self):
+        # Blank lines aren't rows, and line endings are kept as they are
+        self.assertEqual(self.copy(2), (4, '0003 1\r\n0004 2'))
+
+    def test_skip_everything(self):
+        self.assertEqual(self.copy(4), (4, ''))
+        self.assertEqual(self.copy(10), (4, ''))
+
+    def test_empty(self):
+        open(self.filename, 'wb').close()
+        self.assertEqual(self.copy(0), (0, ''))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_keys
+----------------------------------
+
+Tests for the key stores in `marketsight.keys`.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from marketsight.keys import FileKeyStore, KeyStoreServer, MemoryKeyStore, SocketKeyStore
+
+
+class Logins(object):
+    """A key factory which counts its calls, and can be held up until
+    "release" is set"""
+
+    def __init__(self, key='key'):
+        self.key = key
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return '%s-%d' % (self.key, self.calls)
+
+
+class KeyStoreTests(object):
+    """Tests which every store passes"""
+
+    def test_get_set_delete(self):
+        self.assertIsNone(self.store.get('user'))
+        self.store.set('user', 'key')
+        self.assertEqual(self.store.get('user'), 'key')
+        self.assertIsNone(self.store.get('other'))
+        self.store.delete('user')
+        self.assertIsNone(self.store.get('user'))
+        self.store.delete('user')
+
+    def test_expiry(self):
+        self.store.set('user', 'key', ttl=0)
+        self.assertIsNone(self.store.get('user'))
+        self.store.set('user', 'key', ttl=60)
+        self.assertEqual(self.store.get('user'), 'key')
+
+    def test_fetch(self):
+        login = Logins()
+        self.assertEqual(self.store.fetch('user', login), 'key-1')
+        self.assertEqual(self.store.fetch('user', login), 'key-1')
+        self.assertEqual(login.calls, 1)
+        self.store.delete('user')
+        self.assertEqual(self.store.fetch('user', login), 'key-2')
+        # An expired key is replaced
+        self.assertEqual(self.store.fetch('other', login, ttl=0), 'key-3')
+        self.assertEqual(self.store.fetch('other', login), 'key-4')
+
+
+class TestMemoryKeyStore(KeyStoreTests, unittest.TestCase):
+
+    def setUp(self):
+        self.store = MemoryKeyStore()
+
+    def fetch_in_thread(self, name, factory, results):
+        thread = threading.Thread(target=lambda: results.append(self.store.fetch(name, factory)))
+        thread.start()
+        return thread
+
+    def test_one_login_per_name(self):
+        login = Logins()
+        login.release.clear()
+        results = []
+        threads = [self.fetch_in_thread('user', login, results) for i in range(4)]
+        self.assertTrue(login.started.wait(5))
+        login.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ['key-1'] * 4)
+        self.assertEqual(login.calls, 1)
+
+    def test_other_names_not_blocked(self):
+        slow = Logins('slow')
+        slow.release.clear()
+        thread = self.fetch_in_thread('slow', slow, [])
+        try:
+            self.assertTrue(slow.started.wait(5))
+            # Fetched while the slow login is still waiting
+            self.assertEqual(self.store.fetch('fast', Logins('fast')), 'fast-1')
+            self.assertIsNone(self.store.get('slow'))
+        finally:
+            slow.release.set()
+            thread.join(5)
+        self.assertEqual(self.store.get('slow'), 'slow-1')
+
+
+class TestFileKeyStore(KeyStoreTests, unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='marketsight-test-')
+        self.store = FileKeyStore(os.path.join(self.tempdir, 'keys'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_shared(self):
+        self.store.set('user', 'key')
+        self.assertEqual(FileKeyStore(self.store.location).get('user'), 'key')
+        self.assertEqual(os.stat(self.store.filename('user')).st_mode & 0777, 0600)
+
+    def test_corrupt(self):
+        with open(self.store.filename('user'), 'wb') as f:
+            f.write('{"key": ')
+        self.assertIsNone(self.store.get('user'))
+        self.assertEqual(self.store.fetch('user', Logins()), 'key-1')
+
+
+class TestSocketKeyStore(KeyStoreTests, unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='marketsight-test-')
+        self.address = os.path.join(self.tempdir, 'keys.sock')
+        self.server = KeyStoreServer(self.address)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.store = SocketKeyStore(self.address)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def test_shared(self):
+        self.store.set('user', 'key')
+        self.assertEqual(SocketKeyStore(self.address).get('user'), 'key')
+        self.assertEqual(self.server.store.get('user'), 'key')
+
+    def test_server_down(self):
+        self.server.shutdown()
+        self.server.server_close()
+        login = Logins()
+        for address in (self.address, os.path.join(self.tempdir, 'missing.sock')):
+            # A stale socket, and no socket at all, are both misses
+            store = SocketKeyStore(address)
+            self.assertEqual(store.fetch('user', login), 'key-%d' % login.calls)
+            store.delete('user')
+        self.assertEqual(login.calls, 2)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
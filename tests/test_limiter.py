@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_limiter
+----------------------------------
+
+Tests for `marketsight.limiter`, on a clock the tests move by hand.
+"""
+
+import threading
+import unittest
+
+from suds.transport import TransportError
+
+from marketsight.limiter import Limiter, WARMUP, limiter_for, limiter, upload_limiter
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def limiter(self, initial=4, **kwargs):
+        kwargs.setdefault('max_limit', 64)
+        return Limiter(initial=initial, min_limit=1, backoff=0.5, tolerance=3, enabled=True,
+                       clock=self.clock, name='test', **kwargs)
+
+    def call(self, limiter, seconds=1.0, error=None, operation='GetNumberOfRespondents'):
+        try:
+            with limiter.slot(operation):
+                self.clock.now += seconds
+                if error is not None:
+                    raise error
+        except Exception:
+            if error is None:
+                raise
+
+    def concurrent(self, limiter, calls, seconds=1.0):
+        """Make "calls" calls at once, all taking their slots before any
+        of them returns"""
+        saturated = [limiter.acquire() for call in range(calls)]
+        self.clock.now += seconds
+        for flag in saturated:
+            limiter.release('GetNumberOfRespondents', seconds, saturated=flag)
+
+    def test_light_traffic(self):
+        limiter = self.limiter(initial=8)
+        for call in range(100):
+            self.call(limiter)
+        # One call at a time never needed more than 8 slots
+        self.assertEqual(limiter.limit, 8)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_increase(self):
+        limiter = self.limiter(initial=4)
+        # Only the calls which took the last two slots
+        self.concurrent(limiter, 4)
+        self.assertAlmostEqual(limiter.limit, 4 + 1 / 4.0 + 1 / 4.25)
+        # Calls which keep every slot busy, each taking the one just freed
+        taken = []
+        for call in range(100):
+            while limiter.in_flight < int(limiter.limit):
+                taken.append(limiter.acquire())
+            self.clock.now += 0.1
+            limiter.release('GetNumberOfRespondents', 1.0, saturated=taken.pop(0))
+        self.assertGreater(limiter.limit, 14)
+
+    def test_nearly_saturated(self):
+        limiter = self.limiter(initial=8)
+        # One slot left is near enough, two aren't
+        self.concurrent(limiter, 6)
+        self.assertEqual(limiter.limit, 8)
+        self.concurrent(limiter, 7)
+        self.assertGreater(limiter.limit, 8)
+
+    def test_max_limit(self):
+        limiter = self.limiter(initial=4, max_limit=5)
+        for round in range(20):
+            self.concurrent(limiter, int(limiter.limit))
+        self.assertEqual(limiter.limit, 5)
+
+    def test_errors(self):
+        limiter = self.limiter(initial=8)
+        for call in range(WARMUP):
+            self.call(limiter)
+        error = TransportError('unavailable', 503)
+        self.call(limiter, error=error)
+        self.assertEqual(limiter.limit, 4)
+        # Failures within the usual call time count once
+        self.clock.now += 0.5
+        self.call(limiter, seconds=0, error=error)
+        self.assertEqual(limiter.limit, 4)
+        self.call(limiter, error=error)
+        self.assertEqual(limiter.limit, 2)
+        for call in range(5):
+            self.clock.now += 10
+            self.call(limiter, error=error)
+        self.assertEqual(limiter.limit, 1)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_permanent_errors(self):
+        limiter = self.limiter(initial=8)
+        self.call(limiter, error=ValueError('bad'))
+        self.assertEqual(limiter.limit, 8)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_latency(self):
+        limiter = self.limiter(initial=8)
+        for call in range(WARMUP):
+            self.call(limiter, seconds=1)
+        self.call(limiter, seconds=2)
+        self.assertEqual(limiter.limit, 8)
+        self.call(limiter, seconds=10)
+        self.assertEqual(limiter.limit, 4)
+        # Usual times are kept per operation, and not judged until known
+        self.call(limiter, seconds=10, operation='UpdateDatasetDataSPSSWithLabelsZipped')
+        self.assertEqual(limiter.limit, 4)
+
+    def test_latency_off(self):
+        limiter = self.limiter(initial=8, latency=False)
+        for call in range(WARMUP):
+            self.call(limiter, seconds=1)
+        self.call(limiter, seconds=100)
+        self.assertEqual(limiter.limit, 8)
+
+    def test_waits_for_a_slot(self):
+        limiter = self.limiter(initial=2)
+        limiter.acquire()
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.2))
+        self.assertEqual(limiter.queued, 1)
+        limiter.release('GetNumberOfRespondents', 1.0)
+        self.assertTrue(acquired.wait(5))
+        thread.join(5)
+        self.assertEqual((limiter.in_flight, limiter.queued), (2, 0))
+
+    def test_disabled(self):
+        limiter = Limiter(initial=1, enabled=False, clock=self.clock)
+        with limiter.slot('GetNumberOfRespondents'):
+            with limiter.slot('GetNumberOfRespondents'):
+                self.assertEqual(limiter.in_flight, 0)
+
+    def test_limiter_for(self):
+        self.assertIs(limiter_for('UpdateDatasetDataSPSSWithLabelsZipped'), upload_limiter)
+        self.assertIs(limiter_for('AppendDatasetDataTripleSZipped'), upload_limiter)
+        self.assertIs(limiter_for('GetNumberOfRespondents'), limiter)
+        self.assertIs(limiter_for('GetAuthorizationKey'), limiter)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
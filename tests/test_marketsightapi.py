@@ -5,12 +5,12 @@
 test_marketsightapi
 ----------------------------------
 
-Tests for `marketsightapi` module.
+Tests for `marketsight` package.
 """
 
 import unittest
 
-from marketsightapi import marketsightapi
+import marketsight
 
 
 class TestMarketsightapi(unittest.TestCase):
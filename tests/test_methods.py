@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_methods
+----------------------------------
+
+Tests for `marketsight.methods`, against the stand-in server.
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import fakeserver
+from benchmarks.fakeserver import FakeMarketSight
+from marketsight import methods
+from marketsight.cache import variables_cache
+from marketsight.keys import MemoryKeyStore
+from marketsight.manifest import Manifest
+
+GUID = '6f1b1a0e-0000-4000-8000-000000000001'
+
+
+class ServerTestCase(unittest.TestCase):
+    """Runs each test against a fresh stand-in server"""
+
+    def setUp(self):
+        self.server = FakeMarketSight().start()
+        self.urls = dict(methods.URLS)
+        methods.URLS.update(self.server.urls())
+        self.tempdir = tempfile.mkdtemp(prefix='marketsight-test-')
+        self.user = methods.User('user', 'password', verbose=False, keystore=MemoryKeyStore())
+
+    def tearDown(self):
+        from marketsight.transport import connection_pool
+        connection_pool.clear()
+        methods.URLS.update(self.urls)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def path(self, name):
+        return os.path.join(self.tempdir, name)
+
+
+class TestCall(ServerTestCase):
+
+    def test_expired_key(self):
+        dataset = methods.Dataset(self.user, GUID)
+        dataset.message = lambda message: None
+        self.server.state.respondents[GUID] = 3
+        self.server.state.keys.clear()
+        self.assertEqual(dataset.number_of_respondents(), 3)
+        self.assertEqual(self.server.state.calls['GetAuthorizationKey'], 2)
+
+    def test_other_errors_raised(self):
+        dataset = methods.Dataset(self.user, GUID)
+        self.server.state.respondents[GUID] = 'many'
+        self.assertRaises(ValueError, dataset.number_of_respondents)
+        self.assertEqual(self.server.state.calls['GetNumberOfRespondents'], 1)
+
+
+class TestAppendIncremental(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.manifest = Manifest(self.path('manifest.json'))
+        self.dataset = methods.Dataset(self.user, GUID, manifest=self.manifest)
+        self.dataset.message = lambda message: None
+        self.appended = []
+        append_sss = self.dataset.append_sss
+
+        def append(metadatafile_path, datafile_path, dataset=None, save_as=None):
+            with open(datafile_path, 'rb') as f:
+                self.appended.append(f.read())
+            return append_sss(metadatafile_path, datafile_path, dataset, save_as)
+        self.dataset.append_sss = append
+        with open(self.path('data.sss'), 'wb') as f:
+            f.write('<sss version="2.0"/>')
+
+    def write(self, rows):
+        with open(self.path('data.asc'), 'wb') as f:
+            f.write(''.join('%04d\r\n' % row for row in xrange(1, rows + 1)))
+
+    def append(self):
+        return self.dataset.append_sss_incremental(self.path('data.sss'), self.path('data.asc'))
+
+    def uploaded_elsewhere(self, respondents):
+        """As if the dataset were uploaded to from the web"""
+        self.server.state.respondents[GUID] = respondents
+        self.server.state.uploaded[GUID] = datetime.datetime(2016, 1, 1)
+
+    def test_appends_new_rows(self):
+        self.write(3)
+        self.assertTrue(self.append())
+        self.write(5)
+        self.assertTrue(self.append())
+        self.assertEqual(self.appended, ['0001\r\n0002\r\n0003\r\n', '0004\r\n0005\r\n'])
+        self.assertEqual(self.manifest.get(GUID)['rows'], 5)
+        # The high-water mark came from the manifest, not the dataset
+        self.assertEqual(self.server.state.calls['GetNumberOfRespondents'], 1)
+
+    def test_no_new_rows(self):
+        self.write(3)
+        self.assertTrue(self.append())
+        self.assertTrue(self.append())
+        self.assertEqual(self.dataset.last_status, 'skipped')
+        self.assertEqual(len(self.appended), 1)
+
+    def test_uploaded_elsewhere(self):
+        self.write(3)
+        self.assertTrue(self.append())
+        self.uploaded_elsewhere(4)
+        self.write(6)
+        self.assertTrue(self.append())
+        # Rows 4 and 5 went up some other way
+        self.assertEqual(self.appended[-1], '0005\r\n0006\r\n')
+        self.assertEqual(self.manifest.get(GUID)['rows'], 6)
+        self.write(7)
+        self.assertTrue(self.append())
+        self.assertEqual(self.appended[-1], '0007\r\n')
+
+    def test_fewer_rows_than_uploaded(self):
+        self.uploaded_elsewhere(4)
+        self.write(3)
+        self.assertRaises(AttributeError, self.append)
+        self.assertEqual(self.appended, [])
+
+    def test_without_manifest(self):
+        self.dataset.manifest = None
+        self.uploaded_elsewhere(2)
+        self.write(3)
+        self.assertTrue(self.append())
+        self.assertEqual(self.appended, ['0003\r\n'])
+
+
+class TestMissingVariables(ServerTestCase):
+    """The stand-in server reports variables named "missing..." missing"""
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        variables_cache.clear()
+        self.dataset = methods.Dataset(self.user, GUID)
+        self.dataset.message = lambda message: None
+
+    def tearDown(self):
+        variables_cache.clear()
+        ServerTestCase.tearDown(self)
+
+    def check(self, variables, **kwargs):
+        return self.dataset.check_for_missing_variables(variables, **kwargs)
+
+    def calls(self):
+        return self.server.state.calls.get('CheckForMissingVariables', 0)
+
+    def test_missing(self):
+        self.assertEqual(self.check('Q1, missing1,Q2,missing2,Q1'), ['missing1', 'missing2'])
+        self.assertEqual(self.check([]), [])
+
+    def test_chunks(self):
+        variables = ['Q%d' % index for index in range(5)] + ['missing1', 'missing2']
+        self.assertEqual(self.check(variables, chunk_size=2), ['missing1', 'missing2'])
+        self.assertEqual(self.calls(), 4)
+
+    def test_cached(self):
+        self.check('Q1,Q2,missing1')
+        self.assertEqual(variables_cache.get(GUID), frozenset(['Q1', 'Q2']))
+        # Only the variables not yet found are checked again
+        self.assertEqual(self.check('Q1,Q2,missing1,Q3'), ['missing1'])
+        self.assertEqual(self.calls(), 2)
+        self.assertEqual(variables_cache.get(GUID), frozenset(['Q1', 'Q2', 'Q3']))
+        self.check('Q1,Q2')
+        self.assertEqual(self.calls(), 2)
+
+    def test_names_as_the_server_has_them(self):
+        dispatch = fakeserver.Handler.dispatch
+
+        def upper(handler, state, op, params):
+            result = dispatch(handler, state, op, params)
+            return result.upper() if op == 'CheckForMissingVariables' else result
+        fakeserver.Handler.dispatch = upper
+        try:
+            self.assertEqual(self.check('Q1,missing1,Missing2'), ['MISSING1', 'MISSING2'])
+        finally:
+            fakeserver.Handler.dispatch = dispatch
+        self.assertEqual(variables_cache.get(GUID), frozenset(['Q1']))
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
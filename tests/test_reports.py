@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_reports
+----------------------------------
+
+Tests for the report links built by `marketsight.methods`.
+"""
+
+import unittest
+import urlparse
+import uuid
+
+from marketsight.methods import Report, ReportURL, ReportURLBuilder
+
+ID = '6F1B1A0E-0000-4000-8000-000000000001'
+
+
+class User(object):
+    key = 'a key/with+symbols'
+
+
+def query(url):
+    url = urlparse.urlsplit(url)
+    return url.path, sorted(urlparse.parse_qsl(url.query))
+
+
+class TestReportURL(unittest.TestCase):
+
+    def url(self, *args, **kwargs):
+        return query(ReportURL(*args, **kwargs).geturl())[1]
+
+    def test_chart(self):
+        self.assertEqual(self.url('chart', ID, user=User(), mode='fullwindow', export='IMAGE'),
+                         [('ak', User.key), ('export', 'image'), ('id', ID.lower()),
+                          ('mode', 'FullWindow')])
+
+    def test_dataset(self):
+        self.assertEqual(self.url('Dataset', ID, mode='unknown'),
+                         [('datasetid', ID.lower()), ('mode', 'ReadOnly')])
+
+    def test_rows_and_columns(self):
+        self.assertEqual(self.url('crosstab', ID, mode='readonly', rows='Q1,Q2', columns='Q3'),
+                         [('columns', 'Q3'), ('id', ID.lower()), ('mode', 'ReadOnly'),
+                          ('rows', 'Q1,Q2')])
+
+    def test_invalid(self):
+        self.assertRaises(AttributeError, ReportURL, 'chart', ID, mode='readonly', export='pdf')
+        self.assertRaises(AttributeError, ReportURL, 'table', ID, mode='readonly')
+        self.assertRaises(AttributeError, ReportURL, 'chart', 'not-an-id', mode='readonly')
+        self.assertRaises(AttributeError, ReportURL, 'chart', None, mode='readonly')
+
+
+class TestReportURLBuilder(unittest.TestCase):
+
+    def reports(self):
+        reports = []
+        for url_type, exports in sorted(ReportURL.export_types.items()) + [('dataset', ()),
+                                                                            ('file', ())]:
+            for export in (None,) + exports:
+                for mode in sorted(ReportURL.modes) + ['ReadOnly', 'unknown']:
+                    reports.append((url_type, '%s' % uuid.uuid4(), mode, export))
+        reports.append(('CHART', ID, 'readonly', 'Excel', 'Q1,Q2', 'Q3'))
+        reports.append(('crosstab', uuid.UUID(ID).hex, 'external', None, None, 'Q 3'))
+        return reports
+
+    def geturl(self, user, url_type, id, mode=None, export=None, rows=None, columns=None):
+        return ReportURL(url_type, id, user=user, mode=mode, export=export, rows=rows,
+                         columns=columns).geturl()
+
+    def test_same_as_reporturl(self):
+        for user in (None, User()):
+            reports = self.reports()
+            expected = [query(self.geturl(user, *report)) for report in reports]
+            self.assertEqual(map(query, ReportURLBuilder(user).urls(reports)), expected)
+            self.assertEqual(map(query, Report(user).urls(iter(reports))), expected)
+            self.assertEqual(query(ReportURLBuilder(user).url(*reports[0])), expected[0])
+
+    def test_report_shortcuts(self):
+        report = Report(User())
+        self.assertEqual(query(report.chart(ID, export='image')),
+                         query(ReportURLBuilder(User()).url('chart', ID, 'ReadOnly', 'image')))
+        self.assertEqual(query(report.datatable(ID)),
+                         query(ReportURLBuilder(User()).url('datatable', ID)))
+
+    def test_invalid(self):
+        builder = ReportURLBuilder()
+        self.assertRaises(AttributeError, builder.url, 'chart', ID, 'readonly', 'pdf')
+        self.assertRaises(AttributeError, builder.url, 'table', ID)
+        self.assertRaises(AttributeError, builder.url, 'chart', 'not-an-id')
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_retry
+----------------------------------
+
+Tests for `marketsight.retry`.
+"""
+
+import errno
+import httplib
+import socket
+import unittest
+import urllib2
+
+import suds
+from suds.transport import TransportError
+
+from marketsight import limiter
+from marketsight.retry import classify, unsent, Retrying, AUTH, TRANSIENT, PERMANENT
+
+
+class Fault(object):
+
+    def __init__(self, faultstring):
+        self.faultstring = faultstring
+        self.faultcode = 'soap:Server'
+
+def fault(faultstring):
+    return suds.WebFault(Fault(faultstring), None)
+
+def refused():
+    return socket.error(errno.ECONNREFUSED, 'Connection refused')
+
+
+class User(object):
+    """Stands in for methods.User, counting its logins"""
+
+    def __init__(self):
+        self.logins = 0
+        self.refreshes = 0
+
+    @property
+    def key(self):
+        if not self.logins:
+            self.logins += 1
+        return 'key-%d' % self.logins
+
+    def refresh(self):
+        self.refreshes += 1
+        self.logins = 0
+
+    def is_auth_error(self, error):
+        return 'A1' in error.fault.faultstring
+
+
+class Method(object):
+    """A SOAP method which raises each of "errors" in turn, then returns
+    the key it was called with"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+        self.__name__ = 'GetNumberOfRespondents'
+
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.errors:
+            raise self.errors.pop(0)
+        return kwargs['key']
+
+
+class TestClassify(unittest.TestCase):
+
+    def test_faults(self):
+        user = User()
+        self.assertEqual(classify(fault('A1: key expired'), user), AUTH)
+        # Without a user to say, it isn't known to be an auth error
+        self.assertEqual(classify(fault('A1: key expired')), PERMANENT)
+        self.assertEqual(classify(fault('The request timed out'), user), TRANSIENT)
+        self.assertEqual(classify(fault('Server busy, try again'), user), TRANSIENT)
+        self.assertEqual(classify(fault('U1: Unknown Error'), user), PERMANENT)
+        self.assertEqual(classify(fault('D1: no such dataset'), user), PERMANENT)
+
+    def test_http(self):
+        for status, kind in ((503, TRANSIENT), (502, TRANSIENT), (429, TRANSIENT),
+                             (404, PERMANENT), (400, PERMANENT)):
+            self.assertEqual(classify(TransportError('reason', status)), kind)
+            self.assertEqual(classify(urllib2.HTTPError('http://x', status, 'reason', {}, None)),
+                             kind)
+            self.assertEqual(classify(Exception((status, 'reason'))), kind)
+
+    def test_connections(self):
+        for error in (refused(), socket.error(errno.ECONNRESET, 'reset'),
+                      socket.timeout('timed out'), httplib.BadStatusLine(''),
+                      urllib2.URLError(refused())):
+            self.assertEqual(classify(error), TRANSIENT)
+
+    def test_others(self):
+        for error in (ValueError('bad'), AttributeError('bad'), Exception('bad')):
+            self.assertEqual(classify(error), PERMANENT)
+
+
+class TestUnsent(unittest.TestCase):
+
+    def test_unsent(self):
+        self.assertTrue(unsent(refused()))
+        self.assertTrue(unsent(urllib2.URLError(refused())))
+
+    def test_maybe_sent(self):
+        for error in (socket.error(errno.ECONNRESET, 'reset'), socket.timeout('timed out'),
+                      httplib.BadStatusLine(''), urllib2.URLError('timed out'),
+                      urllib2.HTTPError('http://x', 503, 'reason', {}, None),
+                      TransportError('reason', 503), fault('The request timed out')):
+            self.assertFalse(unsent(error))
+
+
+class TestRetrying(unittest.TestCase):
+
+    def setUp(self):
+        # The calls here shouldn't move the process-wide limiter
+        self.enabled = limiter.limiter.enabled
+        limiter.limiter.enabled = False
+        self.sleeps = []
+        self.user = User()
+
+    def tearDown(self):
+        limiter.limiter.enabled = self.enabled
+
+    def retrying(self, attempts=4):
+        return Retrying(attempts=attempts, backoff=1.0, max_backoff=5.0,
+                        sleep=self.sleeps.append, random=lambda: 1.0)
+
+    def test_success(self):
+        method = Method()
+        self.assertEqual(self.retrying().call(self.user, method, datasetGuid='guid'), 'key-1')
+        self.assertEqual(method.calls, [{'key': 'key-1', 'datasetGuid': 'guid'}])
+        self.assertEqual(self.sleeps, [])
+
+    def test_auth_refreshed_once(self):
+        method = Method(fault('A1'))
+        self.assertEqual(self.retrying().call(self.user, method), 'key-1')
+        self.assertEqual(self.user.refreshes, 1)
+        self.assertEqual(self.sleeps, [])
+        method = Method(fault('A1'), fault('A1'))
+        self.assertRaises(suds.WebFault, self.retrying().call, self.user, method)
+        self.assertEqual(len(method.calls), 2)
+        self.assertEqual(self.user.refreshes, 2)
+
+    def test_auth_with_one_attempt(self):
+        method = Method(fault('A1'))
+        self.assertEqual(self.retrying(attempts=1).call(self.user, method), 'key-1')
+        self.assertEqual(self.user.refreshes, 1)
+
+    def test_transient_backoff(self):
+        method = Method(TransportError('unavailable', 503), socket.timeout('timed out'),
+                        TransportError('unavailable', 503))
+        self.assertEqual(self.retrying().call(self.user, method), 'key-1')
+        self.assertEqual(len(method.calls), 4)
+        # Doubling from "backoff", up to "max_backoff"
+        self.assertEqual(self.sleeps, [1.0, 2.0, 4.0])
+
+    def test_attempts(self):
+        method = Method(*[TransportError('unavailable', 503)] * 10)
+        self.assertRaises(TransportError, self.retrying(attempts=3).call, self.user, method)
+        self.assertEqual(len(method.calls), 3)
+        self.assertEqual(len(self.sleeps), 2)
+        method = Method(TransportError('unavailable', 503))
+        self.assertRaises(TransportError, self.retrying(attempts=1).call, self.user, method)
+        self.assertEqual(len(method.calls), 1)
+
+    def test_permanent(self):
+        for error in (fault('D1: no such dataset'), ValueError('bad'),
+                      TransportError('not found', 404)):
+            method = Method(error)
+            self.assertRaises(type(error), self.retrying().call, self.user, method)
+            self.assertEqual(len(method.calls), 1)
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(self.user.refreshes, 0)
+
+    def test_not_idempotent(self):
+        method = Method(refused(), refused())
+        self.assertEqual(self.retrying().call(self.user, method, idempotent=False), 'key-1')
+        self.assertEqual(len(method.calls), 3)
+        # Each of these may come after the service applied the call
+        for error in (TransportError('unavailable', 503), socket.timeout('timed out'),
+                      socket.error(errno.ECONNRESET, 'reset'), httplib.BadStatusLine(''),
+                      fault('The request timed out')):
+            method = Method(error)
+            self.assertRaises(type(error), self.retrying().call, self.user, method,
+                              idempotent=False)
+            self.assertEqual(len(method.calls), 1)
+        # A rejected key means the call wasn't applied
+        method = Method(fault('A1'))
+        self.assertEqual(self.retrying().call(self.user, method, idempotent=False), 'key-1')
+
+    def test_messages(self):
+        messages = []
+        method = Method(fault('A1'), TransportError('unavailable', 503))
+        self.retrying().call(self.user, method, message=messages.append)
+        self.assertEqual(messages, ['...authorization key expired, logging in again',
+                                    '...unavailable, retrying in 1.0 seconds (1 of 3)'])
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_spss
+----------------------------------
+
+Tests for `marketsight.spss`, against system files made here record by
+record.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from marketsight.spss import read_header, BYTECODE, UNCOMPRESSED, ZLIB
+
+
+def variable(name, width=0, label=None, endian='<'):
+    """The type 2 records of a variable: one, plus one for each further
+    8 bytes of a string"""
+    record = struct.pack(endian + 'iiiiii8s', 2, width, label is not None, 0, 0x050800,
+                         0x050800, name.ljust(8))
+    if label is not None:
+        record += struct.pack(endian + 'i', len(label)) + label.ljust((len(label) + 3) // 4 * 4)
+    for continuation in xrange((width - 1) // 8 if width else 0):
+        record += struct.pack(endian + 'iiiiii8s', 2, -1, 0, 0, 0, 0, ' ' * 8)
+    return record
+
+def slots(width):
+    return max(1, (width + 7) // 8)
+
+def extension(subtype, data, item_size=1, endian='<'):
+    return struct.pack(endian + 'iiii', 7, subtype, item_size, len(data) // item_size) + data
+
+def sav(variables, cases=2, compression=UNCOMPRESSED, records='', endian='<', magic=None,
+        header_slots=None, file_label='survey'):
+    """A system file of (name, width, label) variables, with "records"
+    (such as extensions) after the variables, and data for "cases" cases"""
+    if magic is None:
+        magic = '$FL3' if compression == ZLIB else '$FL2'
+    slot_count = sum(slots(width) for name, width, label in variables)
+    if header_slots is None:
+        header_slots = slot_count
+    data = magic + struct.pack(endian + '60siiiiid9s8s64s3s', 'marketsight tests', 2,
+                               header_slots, compression, 0, cases, 100.0, '01 Jan 16',
+                               '12:00:00', file_label.ljust(64), '\0' * 3)
+    for name, width, label in variables:
+        data += variable(name, width, label, endian)
+    data += records + struct.pack(endian + 'ii', 999, 0)
+    if compression == ZLIB:
+        offset = len(data)
+        # An (empty) zlib data header, followed by its trailer
+        data += struct.pack(endian + 'qqq', offset, offset + 24, 24) + '\0' * 24
+    else:
+        data += '\0' * (8 * slot_count * max(cases, 0))
+    return data
+
+
+class TestReadHeader(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='marketsight-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, data, name='data.sav'):
+        filename = os.path.join(self.tempdir, name)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+
+    def read(self, data):
+        return read_header(self.write(data))
+
+    def assertInvalid(self, data, message):
+        with self.assertRaises(AttributeError) as raised:
+            self.read(data)
+        self.assertIn(message, '%s' % raised.exception)
+
+    def test_uncompressed(self):
+        header = self.read(sav([('RESPID', 0, None), ('Q1', 0, 'Gender')], cases=3))
+        self.assertEqual(header.names, ['RESPID', 'Q1'])
+        self.assertEqual(header.variables[1].label, 'Gender')
+        self.assertEqual(header.cases, 3)
+        self.assertEqual(header.compression, UNCOMPRESSED)
+        self.assertFalse(header.compressed)
+        self.assertIsNone(header.encoding)
+        self.assertEqual(header.file_label, 'survey')
+
+    def test_big_endian(self):
+        header = self.read(sav([('RESPID', 0, None), ('NAME', 20, 'Name')], endian='>'))
+        self.assertEqual(header.names, ['RESPID', 'NAME'])
+        self.assertEqual(header.variables[1].width, 20)
+
+    def test_compressed(self):
+        header = self.read(sav([('RESPID', 0, None)], cases=-1, compression=BYTECODE))
+        self.assertTrue(header.compressed)
+        self.assertIsNone(header.cases)
+        self.assertEqual(self.read(sav([('RESPID', 0, None)], compression=ZLIB)).compression,
+                         ZLIB)
+
+    def test_strings(self):
+        header = self.read(sav([('NAME', 20, None), ('CITY', 8, None), ('AGE', 0, None)]))
+        self.assertEqual([(variable.name, variable.width) for variable in header.variables],
+                         [('NAME', 20), ('CITY', 8), ('AGE', 0)])
+
+    def test_long_names_and_very_long_strings(self):
+        records = extension(13, 'RESPID=RespondentID\tCOMMENT=Comments') + \
+                  extension(14, 'COMMENT=00300\0\t')
+        header = self.read(sav([('RESPID', 0, None), ('COMMENT', 255, None),
+                                ('COMME0', 45, None), ('AGE', 0, None)], records=records))
+        self.assertEqual(header.names, ['RespondentID', 'Comments', 'AGE'])
+        self.assertEqual(header.variables[1].width, 300)
+        self.assertEqual(header.variables[1].short_name, 'COMMENT')
+
+    def test_encoding(self):
+        label = u'Genre (\xe9tudiant)'
+        header = self.read(sav([('Q1', 0, label.encode('utf-8'))],
+                               records=extension(20, 'UTF-8')))
+        self.assertEqual(header.encoding, 'UTF-8')
+        self.assertEqual(header.variables[0].label, label)
+
+    def test_code_page(self):
+        integers = struct.pack('<8i', 20, 0, 0, -1, 1, 1, 2, 1252)
+        header = self.read(sav([('Q1', 0, u'\xe9t\xe9'.encode('cp1252'))],
+                               records=extension(3, integers, item_size=4)))
+        self.assertEqual(header.encoding, 'cp1252')
+        self.assertEqual(header.variables[0].label, u'\xe9t\xe9')
+
+    def test_windows_encodings(self):
+        # Named as SPSS writes them, which Python knows by other names
+        for encoding, codec, label in (('windows-874', 'cp874', u'\u0e01'),
+                                       ('WINDOWS-949', 'cp949', u'\uac00'),
+                                       ('windows-31j', 'cp932', u'\u4e00'),
+                                       ('macintosh', 'mac_roman', u'\xe9'),
+                                       ('windows-1252', 'cp1252', u'\xe9')):
+            header = self.read(sav([('Q1', 0, label.encode(codec))],
+                                   records=extension(20, encoding)))
+            self.assertEqual(header.encoding, encoding)
+            self.assertEqual(header.variables[0].label, label)
+
+    def test_unknown_encoding(self):
+        # Left for the service to decode
+        records = extension(13, 'Q1=Qu\xe9stion') + extension(20, 'no-such-encoding')
+        header = self.read(sav([('Q1', 0, 'L\xe9bel')], records=records, file_label='\xe9'))
+        self.assertEqual(header.encoding, 'no-such-encoding')
+        self.assertEqual(header.names, ['Qu\xe9stion'])
+        self.assertEqual(header.variables[0].label, 'L\xe9bel')
+        self.assertEqual(header.file_label, '\xe9')
+        self.assertIsInstance(header.names[0], str)
+
+    def test_value_labels_and_documents(self):
+        labels = struct.pack('<ii', 3, 1) + '\0' * 8 + chr(4) + 'Male' + '\0' * 3 + \
+                 struct.pack('<iii', 4, 1, 1)
+        documents = struct.pack('<ii', 6, 1) + 'A note'.ljust(80)
+        header = self.read(sav([('Q1', 0, None)], records=labels + documents))
+        self.assertEqual(header.names, ['Q1'])
+
+    def test_not_spss(self):
+        self.assertInvalid('PK\3\4' + '\0' * 200, 'does not start with')
+
+    def test_truncated_dictionary(self):
+        data = sav([('RESPID', 0, None), ('Q1', 0, 'Gender')])
+        self.assertInvalid(data[:200], 'it ends in the dictionary')
+
+    def test_truncated_data(self):
+        data = sav([('RESPID', 0, None)], cases=10)
+        self.assertInvalid(data[:-8], 'it is truncated')
+
+    def test_zlib_trailer(self):
+        data = sav([('RESPID', 0, None)], compression=ZLIB)
+        self.assertInvalid(data + '\0' * 8, 'does not end where the file does')
+
+    def test_compression_and_magic(self):
+        self.assertInvalid(sav([('RESPID', 0, None)], compression=BYTECODE, magic='$FL3'),
+                           'compression code 1')
+
+    def test_slots(self):
+        self.assertInvalid(sav([('NAME', 20, None)], header_slots=1),
+                           'the header has 1 variable slots, the dictionary 3')
+
+    def test_no_variables(self):
+        self.assertInvalid(sav([], header_slots=-1), 'it has no variables')
+
+    def test_unknown_record(self):
+        self.assertInvalid(sav([('Q1', 0, None)], records=struct.pack('<i', 5)),
+                           'unknown record type 5')
+
+
+    def test_wrongly_encoded(self):
+        self.assertInvalid(sav([('Q1', 0, '\xe9t\xe9')], records=extension(20, 'UTF-8')),
+                           'is not valid UTF-8')
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
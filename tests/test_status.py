@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_status
+----------------------------------
+
+Tests for `marketsight.status`, against the stand-in server.
+"""
+
+import datetime
+import unittest
+
+from marketsight.cache import LRUCache
+from marketsight.status import DatasetStatus
+from tests.test_methods import ServerTestCase
+
+GUIDS = ['6f1b1a0e-0000-4000-8000-%012d' % index for index in range(4)]
+
+
+class TestDatasetStatus(ServerTestCase):
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        for index, guid in enumerate(GUIDS):
+            self.server.state.respondents[guid] = index * 10
+        self.status = DatasetStatus(self.user, cache=LRUCache())
+
+    def test_get(self):
+        statuses = self.status.get(GUIDS + GUIDS[:1])
+        self.assertEqual(sorted(statuses), GUIDS)
+        self.assertEqual([statuses[guid].respondents for guid in GUIDS], [0, 10, 20, 30])
+        self.assertEqual(statuses[GUIDS[0]].last_uploaded, datetime.datetime(2016, 5, 9))
+        # Cached, until refreshed
+        self.server.state.respondents[GUIDS[0]] = 5
+        self.assertEqual(self.status[GUIDS[0]].respondents, 0)
+        self.assertEqual(self.status.get(GUIDS[:1], refresh=True)[GUIDS[0]].respondents, 5)
+
+    def test_failed(self):
+        # One dataset's reply can't be read, which fails only its status
+        self.server.state.respondents[GUIDS[1]] = 'many'
+        statuses = self.status.get(GUIDS)
+        self.assertEqual(sorted(statuses), [GUIDS[0]] + GUIDS[2:])
+        self.assertIsNone(self.status.cache.get(GUIDS[1]))
+        self.server.state.respondents[GUIDS[1]] = 10
+        self.assertEqual(self.status[GUIDS[1]].respondents, 10)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
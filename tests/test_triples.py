@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_triples
+----------------------------------
+
+Tests for `marketsight.triples`.
+"""
+
+import unittest
+import zipfile
+
+from marketsight.triples import Schema, Variable, zip_triple_s
+
+
+class TestVariable(unittest.TestCase):
+
+    def test_quantity_range_fits_width(self):
+        variable = Variable('WEIGHT', 'quantity', width=8, decimals=4)
+        self.assertEqual(variable.range, (0, 999))
+        self.assertEqual(variable.formatter()(1.5), '001.5000')
+
+    def test_quantity_with_decimals_and_no_width(self):
+        variable = Variable('W', 'quantity', decimals=2)
+        self.assertEqual(variable.range, (0, 9))
+        self.assertEqual(variable.width, 4)
+        self.assertEqual(variable.formatter()(1.5), '1.50')
+
+    def test_quantity_too_narrow_for_decimals(self):
+        self.assertRaises(AttributeError, Variable, 'W', 'quantity', width=2, decimals=2)
+
+    def test_single_range_from_codes(self):
+        variable = Variable('Q1', 'single', values={1: 'Male', 2: 'Female', 9: 'Refused'})
+        self.assertEqual(variable.range, (1, 9))
+        self.assertIn('<range from="1" to="9"/>', variable.sss(1, 1))
+
+    def test_single_needs_values_or_range(self):
+        self.assertRaises(AttributeError, Variable, 'Q1', 'single')
+        self.assertEqual(Variable('Q1', 'single', range=(1, 5)).width, 1)
+
+
+class TestZipTripleS(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = Schema([
+            Variable('RESPID', 'quantity', width=6),
+            Variable('Q1', 'single', label=u'Genre (\xe9tudiant)',
+                     values={1: u'Homme', 2: u'Femme ♀'}),
+            Variable('CITY', 'character', width=20),
+        ], title=u'Enqu\xeate')
+        self.rows = [(index, index % 2 + 1, u'Montr\xe9al') for index in xrange(1, 1001)]
+
+    def read(self, fileobj):
+        with zipfile.ZipFile(fileobj) as zipped:
+            self.assertIsNone(zipped.testzip())
+            return zipped.read('data.sss'), zipped.read('data.asc')
+
+    def test_reads_back(self):
+        sss, asc = self.read(zip_triple_s(self.schema, self.rows))
+        self.assertEqual(asc, ''.join(self.schema.records(self.rows)))
+        self.assertEqual(len(asc.splitlines()), 1000)
+
+    def test_unicode_labels_are_utf8(self):
+        sss, asc = self.read(zip_triple_s(self.schema, self.rows))
+        sss = sss.decode('utf-8')
+        self.assertIn(u'<label>Genre (\xe9tudiant)</label>', sss)
+        self.assertIn(u'>Femme ♀</value>', sss)
+        self.assertIn(u'<title>Enqu\xeate</title>', sss)
+
+    def test_without_zip64(self):
+        sss, asc = self.read(zip_triple_s(self.schema, self.rows, zip64=False))
+        self.assertEqual(asc, ''.join(self.schema.records(self.rows)))
+
+    def test_large_data(self):
+        # Stands in for data over 4GB
+        limit = zipfile.ZIP64_LIMIT
+        zipfile.ZIP64_LIMIT = 1000
+        try:
+            sss, asc = self.read(zip_triple_s(self.schema, self.rows))
+            self.assertEqual(len(asc.splitlines()), 1000)
+
+            self.assertRaises(zipfile.LargeZipFile, zip_triple_s, self.schema, self.rows,
+                              zip64=False)
+        finally:
+            zipfile.ZIP64_LIMIT = limit
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())